@@ -0,0 +1,93 @@
+"""
+Compare per-line CPU cost of the OpenCanary importer's parse and aggregate
+step (tools/import_opencanary.py) with the webhook path it replaced, which
+built a events._WebhookEvent per line, and with json.loads alone, the floor
+for any stdlib parser. Also checks that both paths produce the same rows.
+
+    uv run python benchmarks/bench_import_parse.py [lines]
+"""
+import json
+import os
+import random
+import sys
+import time
+from itertools import accumulate
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tools"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import events  # noqa: E402
+import import_opencanary as importer  # noqa: E402
+
+
+def _lines(rng, count, sources):
+    hosts = [f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}" for _ in range(sources)]
+    weights = list(accumulate(1 / k**1.1 for k in range(1, sources + 1)))
+    lines = []
+    for i, host in enumerate(rng.choices(hosts, cum_weights=weights, k=count)):
+        ts = f"2025-08-28 18:{i // 60 % 60:02d}:{i % 60:02d}.{i % 1000000:06d}"
+        event = {
+            "dst_host": "10.0.0.5", "dst_port": 22, "local_time": ts, "local_time_adjusted": ts,
+            "logtype": 4002, "node_id": "opencanary-1", "src_host": host,
+            "src_port": rng.randint(1024, 65535), "utc_time": ts,
+            "logdata": {"LOCALVERSION": "SSH-2.0-OpenSSH_5.1p1", "PASSWORD": "123456", "REMOTEVERSION": "SSH-2.0-Go", "USERNAME": "root"},
+        }
+        lines.append((json.dumps(event) + "\n").encode())
+    return lines
+
+
+def event_path(line):
+    """The importer's previous per-line step: parse, build an event, take its row."""
+    try:
+        data = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or data.get("src_host") == "":
+        return None
+    try:
+        event = events._parse_event(data)
+    except events._InvalidEvent:
+        return None
+    if event.src_host and not importer._ip_filter.accepts(event.src_host):
+        return None
+    return event.row()
+
+
+def measure(parse, lines, aggregate=True):
+    best = float("inf")
+    for _ in range(9):
+        batch = importer._Batch()
+        start = time.process_time()
+        for line in lines:
+            row = parse(line)
+            if aggregate and row is not None:
+                batch.add(row)
+        best = min(best, time.process_time() - start)
+    return best / len(lines) * 1e6
+
+
+def _same_row(line):
+    row = importer._parse_line(line)
+    return event_path(line) == (tuple(row) if row is not None else None)
+
+
+def run(count):
+    lines = _lines(random.Random(1), count, 3000)
+    odd = [
+        b'{"src_host": "8.8.8.8", "dst_port": "22", "logdata": {"USERNAME": 7}}\n',
+        b'  {"src_host": "10.0.0.1"}  \n',
+        b"{} trailing\n",
+        b'{"dst_port": "x"}\n',
+        b"[1]\n",
+    ]
+    mismatches = sum(not _same_row(line) for line in lines[:1000] + odd)
+    floor = measure(json.loads, lines, aggregate=False)
+    before = measure(event_path, lines)
+    after = measure(importer._parse_line, lines)
+    print(f"json.loads only     {floor:5.2f} us/line  ({1e6 / floor:9,.0f} lines/s)")
+    print(f"per-line event      {before:5.2f} us/line  ({1e6 / before:9,.0f} lines/s)")
+    print(f"row parser          {after:5.2f} us/line  ({1e6 / after:9,.0f} lines/s)")
+    print(f"{mismatches} rows differ between the two paths")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
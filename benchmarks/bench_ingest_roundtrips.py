@@ -0,0 +1,121 @@
+"""
+Compare network round trips and latency per ingested event for the legacy
+webhook + geo worker flow and the pipelined ingest in main._store_events.
+
+Run against a scratch database initialised with infra/initdb/init.sql, using
+the same POSTGRES_* variables as the app:
+
+    uv run python benchmarks/bench_ingest_roundtrips.py [events]
+
+Round trips are counted from the libpq protocol trace: every ReadyForQuery
+message sent by the server ends one client/server exchange. Rows written by
+the benchmark use node_id "bench" and are deleted afterwards.
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import psycopg
+from psycopg.pq import Trace
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import main  # noqa: E402
+
+
+class _State:
+    aggregator = None
+    ingest_pipeline = True
+
+
+class _App:
+    state = _State()
+
+
+def _event(i):
+    return main._parse_event(
+        {
+            "dst_host": "10.0.0.1",
+            "dst_port": 22,
+            "logtype": 4002,
+            "node_id": "bench",
+            # One new source per event, so every event pays for enrichment.
+            "src_host": f"203.0.{(i >> 8) & 255}.{i & 255}",
+            "src_port": 40000 + i % 20000,
+            "utc_time": "2025-08-28 18:37:49.453000",
+            "logdata": {"USERNAME": "root", "PASSWORD": "123456"},
+        }
+    )
+
+
+class _RoundTrips:
+    """Counts ReadyForQuery messages in a libpq trace written to a temp file."""
+
+    def __init__(self, *conns):
+        self._file = tempfile.TemporaryFile(mode="w+")
+        for conn in conns:
+            conn.pgconn.trace(self._file.fileno())
+            conn.pgconn.set_trace_flags(Trace.SUPPRESS_TIMESTAMPS)
+
+    def count(self):
+        self._file.flush()
+        self._file.seek(0)
+        return sum("ReadyForQuery" in line for line in self._file)
+
+
+async def legacy(conns, event):
+    webhook_conn, worker_conn = conns
+    async with webhook_conn.cursor() as cur:
+        await cur.execute(main._INSERT_EVENT_SQL, event.row())
+    await webhook_conn.commit()
+    # Background task: second checkout, exists check, upsert, commit.
+    exists = await main._ip_exists_async(worker_conn, event.src_host)
+    assert not exists
+    await main._insert_geo_row_async(worker_conn, event, {})
+    await worker_conn.commit()
+
+
+async def pipelined(conns, event):
+    await main._store_events(_App, conns[0], [event])
+
+
+async def run(flow, events, offset):
+    dsn = main._dsn()
+    conns = [await psycopg.AsyncConnection.connect(dsn) for _ in range(2)]
+    trips = _RoundTrips(*conns)
+    latencies = []
+    for i in range(events):
+        start = time.perf_counter()
+        await flow(conns, _event(offset + i))
+        latencies.append((time.perf_counter() - start) * 1000)
+    for conn in conns:
+        conn.pgconn.untrace()
+        await conn.close()
+    return trips.count() / events, statistics.median(latencies), statistics.quantiles(latencies, n=100)[98]
+
+
+async def cleanup():
+    async with await psycopg.AsyncConnection.connect(main._dsn()) as conn:
+        await conn.execute(
+            "DELETE FROM source_details WHERE src_host IN "
+            "(SELECT src_host FROM webhook_logs WHERE node_id = 'bench')"
+        )
+        await conn.execute("DELETE FROM webhook_logs WHERE node_id = 'bench'")
+
+
+async def main_async(events):
+    await cleanup()
+    try:
+        for name, flow, offset in (("legacy", legacy, 0), ("pipeline", pipelined, events)):
+            trips, p50, p99 = await run(flow, events, offset)
+            print(f"{name:<9} {trips:4.1f} round trips/event   p50 {p50:6.2f} ms   p99 {p99:6.2f} ms")
+    finally:
+        await cleanup()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    asyncio.run(main_async(int(sys.argv[1]) if len(sys.argv) > 1 else 2000))
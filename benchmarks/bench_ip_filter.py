@@ -0,0 +1,81 @@
+"""
+Compare per-address cost of the legacy ipaddress-based public-address check
+with the compiled range filter in events._IpFilter (1000 deny networks loaded),
+uncached and with its hot-address cache. The address mix is Zipf-distributed like scan traffic:
+a few sources send most events.
+
+    uv run python benchmarks/bench_ip_filter.py [lookups]
+"""
+import ipaddress
+import os
+import random
+import sys
+import time
+from itertools import accumulate
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import events  # noqa: E402
+
+_EXCLUDED_NETS_V4 = [
+    ipaddress.ip_network("10.0.0.0/8"),
+    ipaddress.ip_network("172.16.0.0/12"),
+    ipaddress.ip_network("192.168.0.0/16"),
+    ipaddress.ip_network("127.0.0.0/8"),
+    ipaddress.ip_network("100.64.0.0/10"),  # CGNAT
+]
+
+
+def legacy_is_public_candidate(ip_str):
+    try:
+        ip_obj = ipaddress.ip_address(ip_str)
+    except ValueError:
+        return False
+    if ip_obj.version == 4:
+        for net in _EXCLUDED_NETS_V4:
+            if ip_obj in net:
+                return False
+    if (
+        ip_obj.is_private
+        or ip_obj.is_loopback
+        or ip_obj.is_link_local
+        or ip_obj.is_multicast
+        or ip_obj.is_reserved
+        or ip_obj.is_unspecified
+    ):
+        return False
+    return True
+
+
+def _addresses(rng, count, distinct):
+    pool = [str(ipaddress.IPv4Address(rng.getrandbits(32))) for _ in range(distinct * 9 // 10)]
+    pool += [str(ipaddress.IPv6Address((0x2000 << 112) | rng.getrandbits(112))) for _ in range(distinct // 10)]
+    rng.shuffle(pool)
+    weights = list(accumulate(1 / k**1.1 for k in range(1, len(pool) + 1)))
+    return rng.choices(pool, cum_weights=weights, k=count)
+
+
+def measure(check, addresses):
+    start = time.process_time()
+    for ip in addresses:
+        check(ip)
+    return (time.process_time() - start) / len(addresses) * 1e9
+
+
+def run(count):
+    addresses = _addresses(random.Random(1), count, 50000)
+    mismatches = sum(legacy_is_public_candidate(ip) != events._is_public_candidate(ip) for ip in set(addresses))
+    deny = [f"{ipaddress.IPv4Address(random.getrandbits(32))}/24" for _ in range(1000)]
+    uncached = events._IpFilter(deny=deny, cache_size=0)
+    legacy = measure(legacy_is_public_candidate, addresses)
+    for name, check in (
+        ("compiled", uncached.public),
+        ("compiled + cache", events._IpFilter(deny=deny).public),
+        ("accepts + cache", events._IpFilter(deny=deny).accepts),
+    ):
+        elapsed = measure(check, addresses)
+        print(f"{name:<20} {elapsed:7.0f} ns/lookup   legacy {legacy:7.0f} ns/lookup   ({legacy / elapsed:4.1f}x)")
+    print(f"{len(uncached.table)} compiled ranges, {mismatches} disagreements with legacy")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 500000)
@@ -0,0 +1,131 @@
+"""
+Compare CPU time spent turning a webhook request into INSERT parameters with
+the legacy try-JSON-then-form flow and the content-type dispatched parser in
+main.py. Note the fast path also validates and coerces every field, work the
+legacy flow left to Postgres.
+
+    uv run python benchmarks/bench_webhook_parse.py [iterations]
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+from urllib.parse import urlencode
+
+from starlette.requests import Request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import main  # noqa: E402
+
+EVENT = {
+    "dst_host": "10.10.10.10",
+    "dst_port": 22,
+    "local_time": "2025-08-28 13:37:49.454000",
+    "local_time_adjusted": "2025-08-28 13:37:49.454000",
+    "logtype": 4002,
+    "node_id": "opencanary-1",
+    "src_host": "140.82.114.3",
+    "src_port": 53211,
+    "utc_time": "2025-08-28 18:37:49.453000",
+    "logdata": {
+        "LOCALVERSION": "SSH-2.0-OpenSSH_5.1p1 Debian-4",
+        "PASSWORD": "123456",
+        "REMOTEVERSION": "SSH-2.0-Go",
+        "USERNAME": "root",
+    },
+}
+
+PAYLOADS = {
+    "form (OpenCanary)": (
+        b"application/x-www-form-urlencoded",
+        urlencode({"message": json.dumps(EVENT)}).encode(),
+    ),
+    "json": (b"application/json", json.dumps(EVENT).encode()),
+}
+
+
+def _request(content_type, body):
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/api/webhook",
+        "headers": [(b"content-type", content_type)],
+    }
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            return {"type": "http.disconnect"}
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return Request(scope, receive)
+
+
+async def legacy_parse(request):
+    data = None
+    try:
+        body = await request.body()
+        if body:
+            try:
+                data = await request.json()
+            except Exception:
+                pass
+    except Exception:
+        pass
+    if data is None:
+        form = await request.form()
+        data = json.loads(form["message"])
+    logdata = data.get("logdata", {}) or {}
+    return (
+        data.get("dst_host"),
+        data.get("dst_port"),
+        data.get("local_time"),
+        data.get("local_time_adjusted"),
+        data.get("logtype"),
+        data.get("node_id"),
+        data.get("src_host"),
+        data.get("src_port"),
+        data.get("utc_time"),
+        logdata.get("HOSTNAME"),
+        logdata.get("PATH"),
+        logdata.get("USERAGENT"),
+        logdata.get("LOCALVERSION"),
+        logdata.get("PASSWORD"),
+        logdata.get("REMOTEVERSION"),
+        logdata.get("USERNAME"),
+        logdata.get("SESSION"),
+    )
+
+
+async def fast_parse(request):
+    content_type = main._content_type(request)
+    data, _ = main._decode_webhook_body(content_type, await request.body())
+    return main._parse_event(data).row()
+
+
+async def measure(parse, content_type, body, iterations):
+    start = time.process_time()
+    for _ in range(iterations):
+        await parse(_request(content_type, body))
+    return (time.process_time() - start) / iterations * 1e6
+
+
+async def run(iterations, rounds=5):
+    for name, (content_type, body) in PAYLOADS.items():
+        # Best of several interleaved rounds: single runs swing by tens of
+        # percent, and whichever parser runs first pays for the warm-up.
+        legacy = fast = float("inf")
+        for _ in range(rounds):
+            legacy = min(legacy, await measure(legacy_parse, content_type, body, iterations))
+            fast = min(fast, await measure(fast_parse, content_type, body, iterations))
+        print(
+            f"{name:<18} legacy {legacy:7.1f} us/req   fast {fast:7.1f} us/req   "
+            f"({(1 - fast / legacy) * 100:5.1f}% less CPU)"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 20000))
@@ -0,0 +1,150 @@
+"""
+Database connection settings and the schema migration runner. Kept apart
+from main.py so tools/migrate.py and the other scripts can use them without
+building the web app; main.py imports them from here.
+"""
+import logging
+import os
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def _dsn(host=None):
+    port = os.getenv("POSTGRES_PORT")
+    if host and host.count(":") == 1:
+        host, port = host.split(":")
+    return (
+        f"host={host or os.getenv('POSTGRES_HOST')} "
+        f"port={port} "
+        f"dbname={os.getenv('POSTGRES_DB')} "
+        f"user={os.getenv('POSTGRES_USER')} "
+        f"password={os.getenv('POSTGRES_PASSWORD')}"
+    )
+
+
+
+_MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "infra", "migrations")
+# Arbitrary key for pg_try_advisory_lock; only one process migrates at a time.
+_MIGRATION_LOCK = 7_415_001
+_NO_TRANSACTION = "-- migrate: no-transaction"
+_MANUAL = "-- migrate: manual"
+
+
+class _Migration:
+    __slots__ = ("version", "name", "sql", "transactional", "manual")
+
+    def __init__(self, version, name, sql):
+        self.version = version
+        self.name = name
+        self.sql = sql
+        directives = set()
+        for line in sql.lstrip().splitlines():
+            if not line.startswith("--"):
+                break
+            directives.add(line.strip())
+        # CREATE/DROP INDEX CONCURRENTLY cannot run in a transaction block.
+        self.transactional = _NO_TRANSACTION not in directives
+        # Too disruptive for startup: only tools/migrate.py applies it.
+        self.manual = _MANUAL in directives
+
+    def statements(self):
+        """Split a no-transaction migration into its ';'-terminated statements."""
+        statements = []
+        for chunk in re.split(r";\s*$", self.sql, flags=re.M):
+            lines = [l for l in chunk.splitlines() if l.strip() and not l.strip().startswith("--")]
+            if lines:
+                statements.append("\n".join(lines))
+        return statements
+
+
+def _load_migrations(directory=_MIGRATIONS_DIR):
+    """infra/migrations/NNNN_name.sql files, in version order."""
+    migrations = []
+    for filename in sorted(os.listdir(directory)) if os.path.isdir(directory) else ():
+        match = re.fullmatch(r"(\d+)_(\w+)\.sql", filename)
+        if not match:
+            continue
+        with open(os.path.join(directory, filename)) as f:
+            migrations.append(_Migration(int(match.group(1)), match.group(2), f.read()))
+    versions = [m.version for m in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f"Duplicate migration versions in {directory}")
+    return migrations
+
+
+async def _migrate(conn, migrations, manual=False):
+    """
+    Apply pending migrations on an autocommit connection and record each in
+    schema_migrations. Returns the applied versions, or None when another
+    process holds the migration lock. Unless `manual` is set, stops at the
+    first pending manual migration; later ones wait until it is applied.
+    """
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """
+    )
+    row = await (await conn.execute("SELECT pg_try_advisory_lock(%s)", (_MIGRATION_LOCK,))).fetchone()
+    if not row[0]:
+        return None
+    applied = []
+    try:
+        await conn.execute("SET statement_timeout = 0")
+        done = {r[0] for r in await (await conn.execute("SELECT version FROM schema_migrations")).fetchall()}
+        for migration in migrations:
+            if migration.version in done:
+                continue
+            if migration.manual and not manual:
+                logger.warning(
+                    f"Migration {migration.version:04d}_{migration.name} must be applied "
+                    f"with tools/migrate.py; it and later migrations are pending"
+                )
+                break
+            start = time.time()
+            record = (
+                "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                (migration.version, migration.name),
+            )
+            if migration.transactional:
+                async with conn.transaction():
+                    await conn.execute(migration.sql)
+                    await conn.execute(*record)
+            else:
+                for statement in migration.statements():
+                    # A failed concurrent build leaves an INVALID index that
+                    # IF NOT EXISTS would skip on the next run; drop it first.
+                    index = re.search(r"INDEX CONCURRENTLY IF NOT EXISTS (\w+)", statement)
+                    if index:
+                        await _drop_invalid_index(conn, index.group(1))
+                    await conn.execute(statement)
+                await conn.execute(*record)
+            logger.info(
+                f"Applied migration {migration.version:04d}_{migration.name} "
+                f"in {time.time() - start:.1f}s"
+            )
+            applied.append(migration.version)
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock(%s)", (_MIGRATION_LOCK,))
+    return applied
+
+
+async def _drop_invalid_index(conn, name):
+    row = await (
+        await conn.execute(
+            """
+            SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = %s AND c.relnamespace = current_schema()::regnamespace
+              AND NOT i.indisvalid
+            """,
+            (name,),
+        )
+    ).fetchone()
+    if row:
+        logger.warning(f"Dropping invalid index {name} left by an interrupted migration")
+        await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
@@ -0,0 +1,315 @@
+"""
+OpenCanary event validation and the ingest IP filter: the webhook's field
+mapping and coercers, and the compiled exclusion/deny/allow ranges. Has no
+web or database dependencies, so tools/import_opencanary.py applies exactly
+the webhook's rules without building the app.
+"""
+import bisect
+import ipaddress
+import json
+import logging
+import operator
+import os
+import socket
+from datetime import datetime
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+
+# Webhook payload schema: (column, source key, coercer). _parse_event reads
+# the same fields by name, in this order.
+class _InvalidEvent(ValueError):
+    pass
+
+
+def _coerce_int(value):
+    if value is None or value == "":
+        return None
+    if type(value) is int:
+        return value
+    if isinstance(value, str) and value.strip().removeprefix("-").isdecimal():
+        return int(value)
+    raise _InvalidEvent("expected an integer")
+
+
+def _coerce_timestamp(value):
+    # webhook_logs uses TIMESTAMP (without time zone); Postgres drops any offset
+    # when casting text to it, so do the same to keep stored values unchanged.
+    if type(value) is str and value:
+        try:
+            ts = datetime.fromisoformat(value)
+        except ValueError:
+            raise _InvalidEvent("expected an ISO 8601 timestamp") from None
+        return ts if ts.tzinfo is None else ts.replace(tzinfo=None)
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    raise _InvalidEvent("expected an ISO 8601 timestamp")
+
+
+def _coerce_str(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
+
+
+_EVENT_SCHEMA = (
+    ("dst_host", "dst_host", _coerce_str),
+    ("dst_port", "dst_port", _coerce_int),
+    ("local_time", "local_time", _coerce_timestamp),
+    ("local_time_adjusted", "local_time_adjusted", _coerce_timestamp),
+    ("logtype", "logtype", _coerce_int),
+    ("node_id", "node_id", _coerce_str),
+    ("src_host", "src_host", _coerce_str),
+    ("src_port", "src_port", _coerce_int),
+    ("utc_time", "utc_time", _coerce_timestamp),
+)
+_LOGDATA_SCHEMA = (
+    ("logdata_hostname", "HOSTNAME"),
+    ("logdata_path", "PATH"),
+    ("logdata_useragent", "USERAGENT"),
+    ("logdata_localversion", "LOCALVERSION"),
+    ("logdata_password", "PASSWORD"),
+    ("logdata_remoteversion", "REMOTEVERSION"),
+    ("logdata_username", "USERNAME"),
+    ("logdata_session", "SESSION"),
+)
+_EVENT_COLUMNS = tuple(c for c, _, _ in _EVENT_SCHEMA) + tuple(
+    c for c, _ in _LOGDATA_SCHEMA
+)
+
+
+class _WebhookEvent(tuple):
+    """
+    One validated OpenCanary event: its webhook_logs row, in column order,
+    with each column also readable as an attribute.
+    """
+
+    __slots__ = ()
+
+    def get(self, name, default=None):
+        return getattr(self, name, default) if name in _EVENT_COLUMNS else default
+
+    def row(self):
+        return self
+
+
+for _i, _column in enumerate(_EVENT_COLUMNS):
+    setattr(_WebhookEvent, _column, property(operator.itemgetter(_i)))
+del _i, _column
+
+_PLAIN_STRING_TYPES = frozenset((str, type(None)))
+_fromisoformat = datetime.fromisoformat
+
+
+def _parse_event(data):
+    """
+    Validate and coerce one decoded event into a _WebhookEvent. Raises
+    _InvalidEvent.
+
+    Events as OpenCanary sends them (integer ports and logtype, ISO 8601
+    times, string or null text fields) are read with plain .get() calls
+    straight into the row; anything else goes through _coerce_event.
+    """
+    get = data.get
+    dst_port, logtype, src_port = get("dst_port"), get("logtype"), get("src_port")
+    if not (type(dst_port) is int and type(logtype) is int and type(src_port) is int):
+        return _coerce_event(data)
+    try:
+        local_time = _fromisoformat(get("local_time"))
+        local_time_adjusted = _fromisoformat(get("local_time_adjusted"))
+        utc_time = _fromisoformat(get("utc_time"))
+    except (TypeError, ValueError):
+        return _coerce_event(data)
+    if local_time.tzinfo or local_time_adjusted.tzinfo or utc_time.tzinfo:
+        return _coerce_event(data)
+    logdata = get("logdata") or {}
+    if type(logdata) is not dict:
+        raise _InvalidEvent("Invalid logdata: expected an object.")
+    dst_host, node_id, src_host = get("dst_host"), get("node_id"), get("src_host")
+    get = logdata.get
+    logdata = (
+        get("HOSTNAME"), get("PATH"), get("USERAGENT"), get("LOCALVERSION"),
+        get("PASSWORD"), get("REMOTEVERSION"), get("USERNAME"), get("SESSION"),
+    )
+    if not (
+        _PLAIN_STRING_TYPES.issuperset(map(type, logdata))
+        and type(dst_host) in _PLAIN_STRING_TYPES
+        and type(node_id) in _PLAIN_STRING_TYPES
+        and type(src_host) in _PLAIN_STRING_TYPES
+    ):
+        return _coerce_event(data)
+    return tuple.__new__(_WebhookEvent, (
+        dst_host, dst_port, local_time, local_time_adjusted, logtype,
+        node_id, src_host, src_port, utc_time, *logdata,
+    ))
+
+
+def _coerce_event(data):
+    """_parse_event for any other event: each field goes through its coercer."""
+    get = data.get
+    row = []
+    for _, key, coerce in _EVENT_SCHEMA:
+        try:
+            row.append(coerce(get(key)))
+        except _InvalidEvent as e:
+            raise _InvalidEvent(f"Invalid {key}: {e}.") from None
+    logdata = get("logdata") or {}
+    if type(logdata) is not dict:
+        raise _InvalidEvent("Invalid logdata: expected an object.")
+    get = logdata.get
+    row += [_coerce_str(get(key)) for _, key in _LOGDATA_SCHEMA]
+    return tuple.__new__(_WebhookEvent, row)
+
+
+class _RangeTable:
+    """Sorted, disjoint integer ranges mapped to values, searched with bisect."""
+
+    def __init__(self, ranges):
+        ranges = sorted(ranges, key=lambda r: r[0])
+        self._starts = [r[0] for r in ranges]
+        self._ends = [r[1] for r in ranges]
+        self._values = [r[2] for r in ranges]
+
+    def __len__(self):
+        return len(self._starts)
+
+    def get(self, key, default=None):
+        i = bisect.bisect_right(self._starts, key) - 1
+        if i >= 0 and key <= self._ends[i]:
+            return self._values[i]
+        return default
+
+    @classmethod
+    def merged(cls, ranges, value=True):
+        """Union of possibly overlapping (start, end) ranges, all mapped to `value`."""
+        out = []
+        for start, end in sorted(ranges):
+            if out and start <= out[-1][1] + 1:
+                out[-1][1] = max(out[-1][1], end)
+            else:
+                out.append([start, end])
+        return cls((start, end, value) for start, end in out)
+
+
+def _ip_key(ip):
+    """Order-preserving integer for an address; IPv6 sorts after all of IPv4."""
+    addr = ipaddress.ip_address(ip)
+    return int(addr) + (1 << 32 if addr.version == 6 else 0)
+
+
+def _network_range(network):
+    network = ipaddress.ip_network(network, strict=False)
+    offset = 1 << 32 if network.version == 6 else 0
+    return int(network.network_address) + offset, int(network.broadcast_address) + offset
+
+
+# Addresses that are never looked up or given a source_details row: the IANA
+# special-purpose ranges (private, loopback, link-local, multicast, reserved,
+# documentation, unspecified) plus CGNAT. Mirrors what the ipaddress
+# is_private/is_reserved/... tables of Python 3.11 and 3.12 excluded; listed
+# explicitly so the result doesn't change with the Python version (3.13
+# reclassified e.g. 192.0.0.8 and 2002::/16).
+_BUILTIN_EXCLUDED_NETS = (
+    "0.0.0.0/8", "10.0.0.0/8", "100.64.0.0/10", "127.0.0.0/8", "169.254.0.0/16",
+    "172.16.0.0/12", "192.0.0.0/29", "192.0.0.170/31", "192.0.2.0/24",
+    "192.168.0.0/16", "198.18.0.0/15", "198.51.100.0/24", "203.0.113.0/24",
+    "224.0.0.0/4", "240.0.0.0/4",
+    "::/8", "::ffff:0:0/96", "100::/8", "200::/7", "400::/6", "800::/5",
+    "1000::/4", "2001::/23", "2001:db8::/32", "4000::/3", "6000::/3",
+    "8000::/3", "a000::/3", "c000::/3", "e000::/4", "f000::/5", "f800::/6",
+    "fc00::/7", "fe00::/9", "fe80::/10", "ff00::/8",
+)
+
+_IP_PUBLIC = 1  # not in a built-in exclusion
+_IP_ACCEPTED = 2  # not dropped by INGEST_DENY_CIDRS
+
+
+def _parse_ip_key(ip):
+    """_ip_key() without building ipaddress objects; None if not an address."""
+    try:
+        if ":" in ip:
+            return int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), "big") + (1 << 32)
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+    except (OSError, TypeError):
+        pass
+    # Scoped IPv6 ("fe80::1%eth0") and anything inet_pton rejects
+    try:
+        return _ip_key(ip)
+    except ValueError:
+        return None
+
+
+class _IpFilter:
+    """
+    Built-in exclusions and the deny/allow CIDR lists, compiled into disjoint
+    integer ranges that each carry _IP_PUBLIC / _IP_ACCEPTED flags, so an
+    address is classified with one bisect. Allow entries punch holes in the
+    deny list. Results for recently seen addresses are cached.
+    """
+
+    def __init__(self, deny=(), allow=(), cache_size=65536):
+        lists = [
+            [_network_range(n) for n in _BUILTIN_EXCLUDED_NETS],
+            [_network_range(n) for n in deny],
+            [_network_range(n) for n in allow],
+        ]
+        tables = [_RangeTable.merged(ranges) for ranges in lists]
+        bounds = {0}
+        for ranges in lists:
+            for start, end in ranges:
+                bounds.update((start, end + 1))
+        bounds = sorted(bounds)
+        intervals = []
+        for start, next_start in zip(bounds, bounds[1:] + [1 << 129]):
+            excluded, denied, allowed = (t.get(start, False) for t in tables)
+            flags = (0 if excluded else _IP_PUBLIC) | (
+                _IP_ACCEPTED if allowed or not denied else 0
+            )
+            if intervals and intervals[-1][2] == flags:
+                intervals[-1][1] = next_start - 1
+            else:
+                intervals.append([start, next_start - 1, flags])
+        self.table = _RangeTable(intervals)
+        self.deny, self.allow = tuple(deny), tuple(allow)
+        self._flags = lru_cache(maxsize=cache_size)(self._classify)
+
+    def _classify(self, ip):
+        key = _parse_ip_key(ip)
+        # Unparseable sources are stored as sent but never looked up.
+        return _IP_ACCEPTED if key is None else self.table.get(key, 0)
+
+    def public(self, ip):
+        return bool(self._flags(ip) & _IP_PUBLIC)
+
+    def accepts(self, ip):
+        return bool(self._flags(ip) & _IP_ACCEPTED)
+
+
+def _build_ip_filter():
+    """INGEST_DENY_CIDRS / INGEST_ALLOW_CIDRS: comma-separated v4/v6 networks."""
+    lists = []
+    for name in ("INGEST_DENY_CIDRS", "INGEST_ALLOW_CIDRS"):
+        lists.append([n.strip() for n in os.getenv(name, "").split(",") if n.strip()])
+    ip_filter = _IpFilter(*lists)
+    if ip_filter.deny:
+        logger.info(
+            f"Ingest filter: {len(ip_filter.deny)} denied, {len(ip_filter.allow)} allowed networks, "
+            f"{len(ip_filter.table)} ranges"
+        )
+    return ip_filter
+
+
+_BUILTIN_IP_FILTER = _IpFilter()
+
+
+def _is_public_candidate(ip_str: str) -> bool:
+    """
+    Return True if IP should be looked up (public routable), False if excluded.
+    Handles IP Addressing (skips private, loopback, link-local, multicast, unspecified).
+    """
+    return _BUILTIN_IP_FILTER.public(ip_str)
@@ -53,43 +53,20 @@ export default function App() {
   const [totalSrc, setTotalSrc] = useState(0);
   const [logsForSrc, setLogsForSrc] = useState([]);
 
-  // Fetch paginated source list (server should return { data: [...], total: <int> })
-  useEffect(() => {
-    let cancelled = false;
-    (async () => {
-      try {
-        const res = await axios.get('/api/logs', { params: { page, per_page: rowsPerPage } });
-        if (cancelled) return;
-        const payload = res.data || {};
-        setSrcList(payload.data || []);
-        setTotalSrc(Number(payload.total || (payload.data ? payload.data.length : 0)));
-      } catch (e) {
-        setSrcList([]);
-        setTotalSrc(0);
-      }
-    })();
-    return () => { cancelled = true; };
-  }, [page, rowsPerPage]);
+  // Top stats from API
+  const [apiStats, setApiStats] = useState({});
 
-  // Fetch GeoIP/country data for visible source IPs in the current srcList (batch)
+  // Source page, country flags, stats bar and totals in a single request
   useEffect(() => {
     let cancelled = false;
-    const ips = (srcList || []).map(item => item.src_host).filter(ip => ip && ip !== 'Unknown');
-    if (ips.length === 0) return;
-    const missing = ips.filter(ip => !geo[ip]);
-    if (missing.length === 0) return;
     (async () => {
       try {
-        const res = await fetch('/api/source_details/batch', {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ ips: missing })
-        });
-        if (!res.ok) throw new Error('geo batch failed');
-        const result = await res.json();
+        const res = await axios.get('/api/dashboard', { params: { page, per_page: rowsPerPage } });
         if (cancelled) return;
+        const payload = res.data || {};
+        const rows = payload.data || [];
         const geoWithFlag = {};
-        for (const [ip, cc] of Object.entries(result.data || {})) {
+        for (const { src_host: ip, country: cc } of rows) {
           let flag = '🏳️';
           if (cc && cc.length === 2 && /^[A-Z]{2}$/i.test(cc)) {
             const up = cc.toUpperCase();
@@ -98,14 +75,16 @@ export default function App() {
           geoWithFlag[ip] = { country: cc || '??', flag };
         }
         setGeo(prev => ({ ...prev, ...geoWithFlag }));
+        setSrcList(rows);
+        setTotalSrc(Number(payload.total || rows.length));
+        setApiStats(payload.stats || {});
       } catch (e) {
-        const fallback = {};
-        for (const ip of missing) fallback[ip] = { country: '??', flag: '🏳️' };
-        setGeo(prev => ({ ...prev, ...fallback }));
+        setSrcList([]);
+        setTotalSrc(0);
       }
     })();
     return () => { cancelled = true; };
-  }, [srcList]);
+  }, [page, rowsPerPage]);
 
   const handleOpen = async src => {
     setSelectedSrc(src);
@@ -116,7 +95,8 @@ export default function App() {
     try {
       const [detailsRes, logsRes] = await Promise.all([
         axios.get(`/api/source_details/${encodeURIComponent(src)}`),
-        axios.get('/api/logs', { params: { src } })
+        // Only the columns the logs table renders
+        axios.get('/api/logs', { params: { src, fields: 'utc_time,node_id,dst_port,logdata_username,logdata_password' } })
       ]);
       const details = detailsRes.data.logs || detailsRes.data.data || detailsRes.data || [];
       setSrcDetails(Array.isArray(details) ? details[0] : details);
@@ -154,14 +134,6 @@ export default function App() {
     setPage(1);
   };
 
-  // Top stats from API
-  const [apiStats, setApiStats] = useState({});
-  useEffect(() => {
-    axios.get('/api/stats').then(res => {
-      setApiStats(res.data.logs || res.data.data || res.data || []);
-    });
-  }, []);
-
   return (
     <Box sx={{
       minHeight: '100vh',
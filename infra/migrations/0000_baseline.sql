@@ -0,0 +1,277 @@
+-- Everything infra/initdb/init.sql added after the original schema, for
+-- databases created before it: init.sql only runs when the Postgres volume
+-- is first created. Every statement is idempotent, so this is a no-op on
+-- databases that init.sql already built.
+--
+-- Runs in one transaction. webhook_logs is altered before source_details,
+-- the order ingest locks them in. ADD COLUMN with a constant default does
+-- not rewrite the table, but both tables stay locked until the backfill
+-- below commits.
+
+-- Burst aggregation (INGEST_AGGREGATE_WINDOW)
+ALTER TABLE webhook_logs ADD COLUMN IF NOT EXISTS repeat_count INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE webhook_logs ADD COLUMN IF NOT EXISTS last_utc_time TIMESTAMP;
+
+-- Geo copied from another address in the same network prefix
+ALTER TABLE source_details ADD COLUMN IF NOT EXISTS src_geo_inferred BOOLEAN NOT NULL DEFAULT FALSE;
+-- Local blocklists the source appears in (THREAT_LISTS)
+ALTER TABLE source_details ADD COLUMN IF NOT EXISTS src_threat_tags TEXT[];
+
+-- Shared ip-api budget and per-IP lookup claims (GEO_COORDINATION=postgres)
+CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+    name VARCHAR(64) PRIMARY KEY,
+    tokens DOUBLE PRECISION NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS geo_lookup_claims (
+    src_host VARCHAR(255) PRIMARY KEY,
+    claimed_at TIMESTAMPTZ NOT NULL
+);
+
+-- Sources created by tools/import_opencanary.py, waiting for geo enrichment
+CREATE TABLE IF NOT EXISTS enrichment_queue (
+    src_host VARCHAR(255) PRIMARY KEY,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    queued_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS idx_enrichment_queue_queued_at ON enrichment_queue (queued_at);
+
+-- Resume points for tools/import_opencanary.py, one row per imported file
+CREATE TABLE IF NOT EXISTS import_checkpoints (
+    path TEXT PRIMARY KEY,
+    byte_offset BIGINT NOT NULL,
+    events BIGINT NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- Attack map grid cells (see init.sql)
+CREATE TABLE IF NOT EXISTS source_geo_cells (
+    resolution SMALLINT NOT NULL,
+    cell_lat INTEGER NOT NULL,
+    cell_lon INTEGER NOT NULL,
+    sources INTEGER NOT NULL,
+    events BIGINT NOT NULL,
+    sum_lat DOUBLE PRECISION NOT NULL,
+    sum_lon DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (resolution, cell_lat, cell_lon)
+);
+
+CREATE OR REPLACE FUNCTION source_geo_cells_apply(
+    p_lat DECIMAL[], p_lon DECIMAL[], p_sources INTEGER[], p_events BIGINT[]
+) RETURNS void AS $$
+    -- One upsert per cell for the whole statement, sorted so concurrent
+    -- statements lock cells in the same order; cells whose changes cancel
+    -- out are skipped.
+    INSERT INTO source_geo_cells AS c
+        (resolution, cell_lat, cell_lon, sources, events, sum_lat, sum_lon)
+    SELECT r.res - 1, floor((d.lat + 90) / r.size), floor((d.lon + 180) / r.size),
+           SUM(d.sources), SUM(d.events), SUM(d.lat * d.sources), SUM(d.lon * d.sources)
+    FROM unnest(p_lat, p_lon, p_sources, p_events) AS d(lat, lon, sources, events)
+    CROSS JOIN unnest(ARRAY[10, 2, 0.5, 0.1]::DOUBLE PRECISION[]) WITH ORDINALITY AS r(size, res)
+    WHERE d.lat IS NOT NULL AND d.lon IS NOT NULL
+    GROUP BY 1, 2, 3
+    HAVING SUM(d.sources) != 0 OR SUM(d.events) != 0
+    ORDER BY 1, 2, 3
+    ON CONFLICT (resolution, cell_lat, cell_lon) DO UPDATE SET
+        sources = c.sources + EXCLUDED.sources,
+        events = c.events + EXCLUDED.events,
+        sum_lat = c.sum_lat + EXCLUDED.sum_lat,
+        sum_lon = c.sum_lon + EXCLUDED.sum_lon;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION source_geo_cells_insert_trigger() RETURNS trigger AS $$
+BEGIN
+    PERFORM source_geo_cells_apply(
+        array_agg(src_latitude), array_agg(src_longitude),
+        array_agg(1), array_agg(COALESCE(times_seen, 0)::BIGINT)
+    )
+    FROM new_rows
+    WHERE src_latitude IS NOT NULL AND src_longitude IS NOT NULL;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION source_geo_cells_delete_trigger() RETURNS trigger AS $$
+BEGIN
+    PERFORM source_geo_cells_apply(
+        array_agg(src_latitude), array_agg(src_longitude),
+        array_agg(-1), array_agg(-COALESCE(times_seen, 0)::BIGINT)
+    )
+    FROM old_rows
+    WHERE src_latitude IS NOT NULL AND src_longitude IS NOT NULL;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+-- Each changed source leaves its old cell and joins its new one; for the
+-- common case, a known source seen again, the two cancel out except for the
+-- times_seen difference.
+CREATE OR REPLACE FUNCTION source_geo_cells_update_trigger() RETURNS trigger AS $$
+BEGIN
+    PERFORM source_geo_cells_apply(
+        array_agg(d.lat), array_agg(d.lon), array_agg(d.sources), array_agg(d.events)
+    )
+    FROM old_rows o
+    JOIN new_rows n ON n.id = o.id
+    CROSS JOIN LATERAL (VALUES
+        (o.src_latitude, o.src_longitude, -1, -COALESCE(o.times_seen, 0)::BIGINT),
+        (n.src_latitude, n.src_longitude, 1, COALESCE(n.times_seen, 0)::BIGINT)
+    ) AS d(lat, lon, sources, events)
+    WHERE (o.src_latitude, o.src_longitude, o.times_seen)
+        IS DISTINCT FROM (n.src_latitude, n.src_longitude, n.times_seen);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+-- The trigger blocks writes to source_details until commit, so the backfill
+-- sees every existing source exactly once; it is skipped when the cells are
+-- already populated.
+-- Replaces the per-row trigger of earlier init.sql versions.
+DROP TRIGGER IF EXISTS trg_source_geo_cells ON source_details;
+DROP FUNCTION IF EXISTS source_geo_cells_trigger();
+DROP FUNCTION IF EXISTS source_geo_cells_apply(DECIMAL, DECIMAL, INTEGER, BIGINT);
+
+CREATE OR REPLACE TRIGGER trg_source_geo_cells_insert
+AFTER INSERT ON source_details
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION source_geo_cells_insert_trigger();
+
+CREATE OR REPLACE TRIGGER trg_source_geo_cells_delete
+AFTER DELETE ON source_details
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION source_geo_cells_delete_trigger();
+
+-- Transition tables rule out an UPDATE OF column list; the function ignores
+-- updates that leave the position and times_seen alone.
+CREATE OR REPLACE TRIGGER trg_source_geo_cells_update
+AFTER UPDATE ON source_details
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION source_geo_cells_update_trigger();
+
+INSERT INTO source_geo_cells (resolution, cell_lat, cell_lon, sources, events, sum_lat, sum_lon)
+SELECT r.res - 1, floor((s.src_latitude + 90) / r.size), floor((s.src_longitude + 180) / r.size),
+       COUNT(*), COALESCE(SUM(s.times_seen), 0), SUM(s.src_latitude), SUM(s.src_longitude)
+FROM source_details s
+CROSS JOIN unnest(ARRAY[10, 2, 0.5, 0.1]::DOUBLE PRECISION[]) WITH ORDINALITY AS r(size, res)
+WHERE s.src_latitude IS NOT NULL AND s.src_longitude IS NOT NULL
+  AND NOT EXISTS (SELECT 1 FROM source_geo_cells)
+GROUP BY 1, 2, 3;
+
+-- ASN / ISP / country breakdowns (see init.sql)
+CREATE TABLE IF NOT EXISTS source_breakdowns (
+    dimension VARCHAR(16) NOT NULL,
+    value VARCHAR(255) NOT NULL,
+    label VARCHAR(255),
+    sources INTEGER NOT NULL,
+    events BIGINT NOT NULL,
+    PRIMARY KEY (dimension, value)
+);
+CREATE INDEX IF NOT EXISTS idx_source_breakdowns_events ON source_breakdowns (dimension, events DESC, value);
+CREATE INDEX IF NOT EXISTS idx_source_breakdowns_sources ON source_breakdowns (dimension, sources DESC, value);
+
+CREATE OR REPLACE FUNCTION source_breakdowns_apply(
+    p_dim TEXT[], p_value TEXT[], p_label TEXT[], p_sources INTEGER[], p_events BIGINT[]
+) RETURNS void AS $$
+    -- Same shape as source_geo_cells_apply: one sorted upsert per value.
+    INSERT INTO source_breakdowns AS b (dimension, value, label, sources, events)
+    SELECT d.dimension, d.value, MAX(NULLIF(d.label, '')), SUM(d.sources), SUM(d.events)
+    FROM unnest(p_dim, p_value, p_label, p_sources, p_events) AS d(dimension, value, label, sources, events)
+    WHERE d.value IS NOT NULL AND d.value != ''
+    GROUP BY 1, 2
+    HAVING SUM(d.sources) != 0 OR SUM(d.events) != 0
+    ORDER BY 1, 2
+    ON CONFLICT (dimension, value) DO UPDATE SET
+        label = COALESCE(EXCLUDED.label, b.label),
+        sources = b.sources + EXCLUDED.sources,
+        events = b.events + EXCLUDED.events;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION source_breakdowns_insert_trigger() RETURNS trigger AS $$
+BEGIN
+    PERFORM source_breakdowns_apply(
+        array_agg(d.dimension), array_agg(d.value), array_agg(d.label),
+        array_agg(1), array_agg(COALESCE(n.times_seen, 0)::BIGINT)
+    )
+    FROM new_rows n
+    CROSS JOIN LATERAL (VALUES
+        ('asn', n.src_asnum::text, n.src_asorg::text),
+        ('isp', n.src_isp::text, NULL),
+        ('country', n.src_country::text, n.src_isocountrycode::text)
+    ) AS d(dimension, value, label);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION source_breakdowns_delete_trigger() RETURNS trigger AS $$
+BEGIN
+    PERFORM source_breakdowns_apply(
+        array_agg(d.dimension), array_agg(d.value), NULL,
+        array_agg(-1), array_agg(-COALESCE(o.times_seen, 0)::BIGINT)
+    )
+    FROM old_rows o
+    CROSS JOIN LATERAL (VALUES
+        ('asn', o.src_asnum::text),
+        ('isp', o.src_isp::text),
+        ('country', o.src_country::text)
+    ) AS d(dimension, value);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+-- As for the grid cells: each changed source leaves its old values and
+-- joins its new ones, which cancel out except for the times_seen difference
+-- when it was only seen again.
+CREATE OR REPLACE FUNCTION source_breakdowns_update_trigger() RETURNS trigger AS $$
+BEGIN
+    PERFORM source_breakdowns_apply(
+        array_agg(d.dimension), array_agg(d.value), array_agg(d.label),
+        array_agg(d.sources), array_agg(d.events)
+    )
+    FROM old_rows o
+    JOIN new_rows n ON n.id = o.id
+    CROSS JOIN LATERAL (VALUES
+        ('asn', o.src_asnum::text, NULL, -1, -COALESCE(o.times_seen, 0)::BIGINT),
+        ('isp', o.src_isp::text, NULL, -1, -COALESCE(o.times_seen, 0)::BIGINT),
+        ('country', o.src_country::text, NULL, -1, -COALESCE(o.times_seen, 0)::BIGINT),
+        ('asn', n.src_asnum::text, n.src_asorg::text, 1, COALESCE(n.times_seen, 0)::BIGINT),
+        ('isp', n.src_isp::text, NULL, 1, COALESCE(n.times_seen, 0)::BIGINT),
+        ('country', n.src_country::text, n.src_isocountrycode::text, 1, COALESCE(n.times_seen, 0)::BIGINT)
+    ) AS d(dimension, value, label, sources, events)
+    WHERE (o.src_asnum, o.src_asorg, o.src_isp, o.src_country, o.src_isocountrycode, o.times_seen)
+        IS DISTINCT FROM (n.src_asnum, n.src_asorg, n.src_isp, n.src_country, n.src_isocountrycode, n.times_seen);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+-- As for the grid cells: replace the per-row trigger, then backfill.
+DROP TRIGGER IF EXISTS trg_source_breakdowns ON source_details;
+DROP FUNCTION IF EXISTS source_breakdowns_trigger();
+DROP FUNCTION IF EXISTS source_breakdowns_apply(TEXT, TEXT, TEXT, INTEGER, BIGINT);
+
+CREATE OR REPLACE TRIGGER trg_source_breakdowns_insert
+AFTER INSERT ON source_details
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION source_breakdowns_insert_trigger();
+
+CREATE OR REPLACE TRIGGER trg_source_breakdowns_delete
+AFTER DELETE ON source_details
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION source_breakdowns_delete_trigger();
+
+CREATE OR REPLACE TRIGGER trg_source_breakdowns_update
+AFTER UPDATE ON source_details
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION source_breakdowns_update_trigger();
+
+INSERT INTO source_breakdowns (dimension, value, label, sources, events)
+SELECT d.dimension, d.value, MAX(d.label), COUNT(*), COALESCE(SUM(d.times_seen), 0)
+FROM source_details s
+CROSS JOIN LATERAL (VALUES
+    ('asn', s.src_asnum::text, s.src_asorg, s.times_seen),
+    ('isp', s.src_isp, NULL, s.times_seen),
+    ('country', s.src_country, s.src_isocountrycode, s.times_seen)
+) AS d(dimension, value, label, times_seen)
+WHERE d.value IS NOT NULL AND d.value != ''
+  AND NOT EXISTS (SELECT 1 FROM source_breakdowns)
+GROUP BY d.dimension, d.value;
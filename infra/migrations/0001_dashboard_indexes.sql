@@ -0,0 +1,39 @@
+-- migrate: no-transaction
+--
+-- Indexes for the dashboard queries in get_stats and get_logs. Each one lets
+-- its query be answered from the index alone (index-only scan) once the
+-- visibility map is current, instead of scanning webhook_logs.
+-- ASN/ISP/country rankings read source_breakdowns and need nothing here.
+
+-- top_username / top_password: same predicate as the queries, so the partial
+-- index is usable and only holds rows that can be counted.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_webhook_logs_username
+    ON webhook_logs (logdata_username)
+    WHERE logdata_username IS NOT NULL AND TRIM(logdata_username) <> '';
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_webhook_logs_password
+    ON webhook_logs (logdata_password)
+    WHERE logdata_password IS NOT NULL AND TRIM(logdata_password) <> '';
+
+-- top_node sums repeat_count per node; also serves node_id filters on exports.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_webhook_logs_node
+    ON webhook_logs (node_id) INCLUDE (repeat_count)
+    WHERE node_id IS NOT NULL AND node_id <> '';
+
+-- Per-source log listing (WHERE src_host = ? ORDER BY utc_time DESC NULLS LAST)
+-- and the per-source summary (MAX(COALESCE(last_utc_time, utc_time)),
+-- SUM(repeat_count) GROUP BY src_host). Supersedes idx_webhook_logs_src_host.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_webhook_logs_src_host_time
+    ON webhook_logs (src_host, utc_time DESC NULLS LAST)
+    INCLUDE (last_utc_time, repeat_count);
+
+DROP INDEX CONCURRENTLY IF EXISTS idx_webhook_logs_src_host;
+
+-- top_src_host: top of this index instead of sorting every source.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_source_details_times_seen
+    ON source_details (times_seen DESC NULLS LAST, src_host)
+    WHERE src_host IS NOT NULL AND src_host <> '';
+
+-- Source exports filtered on since/until, newest sources first.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_source_details_last_seen
+    ON source_details (last_seen DESC NULLS LAST);
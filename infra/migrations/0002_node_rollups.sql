@@ -0,0 +1,127 @@
+-- migrate: manual
+--
+-- Per-node activity in hourly buckets, kept current by statement-level
+-- triggers on webhook_logs so /api/nodes never scans the event table.
+-- Covers every write path: webhook inserts, aggregated bursts (repeat_count
+-- updates), COPY imports. Events without a utc_time are not counted.
+--
+-- Runs in one transaction: CREATE TRIGGER blocks inserts into webhook_logs
+-- until the backfill below commits, so no event is counted twice or missed.
+-- The backfill reads all of webhook_logs, so this is never applied at
+-- startup: run tools/migrate.py in a quiet period. Until then /api/stats
+-- counts nodes from webhook_logs and /api/nodes returns 503.
+
+CREATE TABLE IF NOT EXISTS node_rollups (
+    node_id VARCHAR(100) NOT NULL,
+    bucket TIMESTAMP NOT NULL,
+    events BIGINT NOT NULL,
+    last_seen TIMESTAMP,
+    PRIMARY KEY (node_id, bucket)
+);
+
+-- Events per port / logtype / source within a node and hour; the number of
+-- 'src' rows is the node's unique source count.
+CREATE TABLE IF NOT EXISTS node_rollup_values (
+    node_id VARCHAR(100) NOT NULL,
+    dimension VARCHAR(16) NOT NULL,
+    bucket TIMESTAMP NOT NULL,
+    value VARCHAR(255) NOT NULL,
+    events BIGINT NOT NULL,
+    PRIMARY KEY (node_id, dimension, bucket, value)
+);
+
+CREATE OR REPLACE FUNCTION node_rollups_apply(
+    p_node VARCHAR[], p_bucket TIMESTAMP[], p_port INTEGER[], p_logtype INTEGER[],
+    p_src VARCHAR[], p_events INTEGER[], p_seen TIMESTAMP[]
+) RETURNS void AS $$
+    WITH d AS (
+        SELECT * FROM unnest(p_node, p_bucket, p_port, p_logtype, p_src, p_events, p_seen)
+            AS t(node_id, bucket, dst_port, logtype, src_host, events, seen)
+    ),
+    totals AS (
+        -- Sorted so concurrent batches lock rows in the same order.
+        INSERT INTO node_rollups AS r (node_id, bucket, events, last_seen)
+        SELECT node_id, bucket, SUM(events), MAX(seen)
+        FROM d GROUP BY node_id, bucket ORDER BY node_id, bucket
+        ON CONFLICT (node_id, bucket) DO UPDATE SET
+            events = r.events + EXCLUDED.events,
+            last_seen = GREATEST(r.last_seen, EXCLUDED.last_seen)
+    )
+    INSERT INTO node_rollup_values AS v (node_id, dimension, bucket, value, events)
+    SELECT d.node_id, x.dimension, d.bucket, x.value, SUM(d.events)
+    FROM d
+    CROSS JOIN LATERAL (VALUES
+        ('port', d.dst_port::text),
+        ('logtype', d.logtype::text),
+        ('src', d.src_host::text)
+    ) AS x(dimension, value)
+    WHERE x.value IS NOT NULL AND x.value != ''
+    GROUP BY 1, 2, 3, 4 ORDER BY 1, 2, 3, 4
+    ON CONFLICT (node_id, dimension, bucket, value) DO UPDATE SET
+        events = v.events + EXCLUDED.events;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION node_rollups_insert_trigger() RETURNS trigger AS $$
+BEGIN
+    PERFORM node_rollups_apply(
+        array_agg(node_id),
+        array_agg(date_trunc('hour', utc_time)),
+        array_agg(dst_port), array_agg(logtype), array_agg(src_host),
+        array_agg(repeat_count),
+        array_agg(COALESCE(last_utc_time, utc_time))
+    )
+    FROM new_rows
+    WHERE node_id IS NOT NULL AND node_id != '' AND utc_time IS NOT NULL;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+-- Aggregated bursts grow repeat_count after the insert; count the difference
+-- in the hour of the latest repeat.
+CREATE OR REPLACE FUNCTION node_rollups_update_trigger() RETURNS trigger AS $$
+BEGIN
+    PERFORM node_rollups_apply(
+        array_agg(n.node_id),
+        array_agg(date_trunc('hour', COALESCE(n.last_utc_time, n.utc_time))),
+        array_agg(n.dst_port), array_agg(n.logtype), array_agg(n.src_host),
+        array_agg(n.repeat_count - o.repeat_count),
+        array_agg(COALESCE(n.last_utc_time, n.utc_time))
+    )
+    FROM new_rows n JOIN old_rows o ON o.id = n.id
+    WHERE n.node_id IS NOT NULL AND n.node_id != '' AND n.utc_time IS NOT NULL
+      AND n.repeat_count != o.repeat_count;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER trg_node_rollups_insert
+AFTER INSERT ON webhook_logs
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION node_rollups_insert_trigger();
+
+CREATE OR REPLACE TRIGGER trg_node_rollups_update
+AFTER UPDATE ON webhook_logs
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION node_rollups_update_trigger();
+
+-- Backfill existing events, unless init.sql created the tables and the
+-- triggers have counted every event since.
+INSERT INTO node_rollups (node_id, bucket, events, last_seen)
+SELECT node_id, date_trunc('hour', utc_time), SUM(repeat_count), MAX(COALESCE(last_utc_time, utc_time))
+FROM webhook_logs
+WHERE node_id IS NOT NULL AND node_id != '' AND utc_time IS NOT NULL
+  AND NOT EXISTS (SELECT 1 FROM node_rollups)
+GROUP BY 1, 2;
+
+INSERT INTO node_rollup_values (node_id, dimension, bucket, value, events)
+SELECT w.node_id, x.dimension, date_trunc('hour', w.utc_time), x.value, SUM(w.repeat_count)
+FROM webhook_logs w
+CROSS JOIN LATERAL (VALUES
+    ('port', w.dst_port::text),
+    ('logtype', w.logtype::text),
+    ('src', w.src_host::text)
+) AS x(dimension, value)
+WHERE w.node_id IS NOT NULL AND w.node_id != '' AND w.utc_time IS NOT NULL
+  AND x.value IS NOT NULL AND x.value != ''
+  AND NOT EXISTS (SELECT 1 FROM node_rollup_values)
+GROUP BY 1, 2, 3, 4;
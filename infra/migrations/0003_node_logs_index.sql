@@ -0,0 +1,9 @@
+-- migrate: no-transaction
+--
+-- /api/logs?node_id= and node-filtered exports: one node's events, newest
+-- first. top_node now reads node_rollups, so the node_id index from 0001 has
+-- no remaining users.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_webhook_logs_node_time
+    ON webhook_logs (node_id, utc_time DESC NULLS LAST);
+
+DROP INDEX CONCURRENTLY IF EXISTS idx_webhook_logs_node;
@@ -0,0 +1,109 @@
+-- migrate: manual
+--
+-- Per-source activity, overall and within each node, kept current by
+-- statement-level triggers on webhook_logs so the source lists (/api/logs,
+-- /api/dashboard) and their totals page through an index instead of
+-- grouping every event. Same rules as the queries they replace: every event
+-- with a src_host counts, with or without a utc_time.
+--
+-- Runs in one transaction and is manual for the same reasons as
+-- 0002_node_rollups: CREATE TRIGGER blocks inserts into webhook_logs until
+-- the backfill below commits, and the backfill reads all of webhook_logs.
+-- Until it is applied the lists are aggregated from webhook_logs.
+
+CREATE TABLE IF NOT EXISTS source_rollups (
+    src_host VARCHAR(45) PRIMARY KEY,
+    events BIGINT NOT NULL,
+    last_seen TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_source_rollups_last_seen
+    ON source_rollups (last_seen DESC NULLS LAST, src_host) INCLUDE (events);
+
+CREATE TABLE IF NOT EXISTS source_node_rollups (
+    node_id VARCHAR(100) NOT NULL,
+    src_host VARCHAR(45) NOT NULL,
+    events BIGINT NOT NULL,
+    last_seen TIMESTAMP,
+    PRIMARY KEY (node_id, src_host)
+);
+
+CREATE INDEX IF NOT EXISTS idx_source_node_rollups_last_seen
+    ON source_node_rollups (node_id, last_seen DESC NULLS LAST, src_host) INCLUDE (events);
+
+CREATE OR REPLACE FUNCTION source_rollups_apply(
+    p_node VARCHAR[], p_src VARCHAR[], p_events INTEGER[], p_seen TIMESTAMP[]
+) RETURNS void AS $$
+    WITH d AS (
+        SELECT * FROM unnest(p_node, p_src, p_events, p_seen) AS t(node_id, src_host, events, seen)
+    ),
+    totals AS (
+        -- Sorted so concurrent batches lock rows in the same order.
+        INSERT INTO source_rollups AS r (src_host, events, last_seen)
+        SELECT src_host, SUM(events), MAX(seen)
+        FROM d GROUP BY src_host ORDER BY src_host
+        ON CONFLICT (src_host) DO UPDATE SET
+            events = r.events + EXCLUDED.events,
+            last_seen = GREATEST(r.last_seen, EXCLUDED.last_seen)
+    )
+    INSERT INTO source_node_rollups AS n (node_id, src_host, events, last_seen)
+    SELECT node_id, src_host, SUM(events), MAX(seen)
+    FROM d
+    WHERE node_id IS NOT NULL AND node_id != ''
+    GROUP BY node_id, src_host ORDER BY node_id, src_host
+    ON CONFLICT (node_id, src_host) DO UPDATE SET
+        events = n.events + EXCLUDED.events,
+        last_seen = GREATEST(n.last_seen, EXCLUDED.last_seen);
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION source_rollups_insert_trigger() RETURNS trigger AS $$
+BEGIN
+    PERFORM source_rollups_apply(
+        array_agg(node_id), array_agg(src_host), array_agg(repeat_count),
+        array_agg(COALESCE(last_utc_time, utc_time))
+    )
+    FROM new_rows
+    WHERE src_host IS NOT NULL AND src_host != '';
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+-- Aggregated bursts grow repeat_count and move last_utc_time after the insert.
+CREATE OR REPLACE FUNCTION source_rollups_update_trigger() RETURNS trigger AS $$
+BEGIN
+    PERFORM source_rollups_apply(
+        array_agg(n.node_id), array_agg(n.src_host), array_agg(n.repeat_count - o.repeat_count),
+        array_agg(COALESCE(n.last_utc_time, n.utc_time))
+    )
+    FROM new_rows n JOIN old_rows o ON o.id = n.id
+    WHERE n.src_host IS NOT NULL AND n.src_host != ''
+      AND (n.repeat_count, n.last_utc_time) IS DISTINCT FROM (o.repeat_count, o.last_utc_time);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER trg_source_rollups_insert
+AFTER INSERT ON webhook_logs
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION source_rollups_insert_trigger();
+
+CREATE OR REPLACE TRIGGER trg_source_rollups_update
+AFTER UPDATE ON webhook_logs
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION source_rollups_update_trigger();
+
+-- Backfill existing events, unless init.sql created the tables and the
+-- triggers have counted every event since.
+INSERT INTO source_rollups (src_host, events, last_seen)
+SELECT src_host, SUM(repeat_count), MAX(COALESCE(last_utc_time, utc_time))
+FROM webhook_logs
+WHERE src_host IS NOT NULL AND src_host != ''
+  AND NOT EXISTS (SELECT 1 FROM source_rollups)
+GROUP BY src_host;
+
+INSERT INTO source_node_rollups (node_id, src_host, events, last_seen)
+SELECT node_id, src_host, SUM(repeat_count), MAX(COALESCE(last_utc_time, utc_time))
+FROM webhook_logs
+WHERE src_host IS NOT NULL AND src_host != '' AND node_id IS NOT NULL AND node_id != ''
+  AND NOT EXISTS (SELECT 1 FROM source_node_rollups)
+GROUP BY node_id, src_host;
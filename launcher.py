@@ -0,0 +1,87 @@
+"""
+Production launcher: runs WEB_CONCURRENCY uvicorn workers, each with its own
+SO_REUSEPORT listening socket so the kernel balances connections across them.
+
+    uv run launcher.py
+
+Every worker binds its socket up front but only starts listening once the
+app's lifespan startup (pool warm-up) has finished, so the kernel never hands
+connections to a cold worker. Dead workers are restarted; SIGTERM/SIGINT are
+forwarded so each worker shuts down gracefully.
+
+The parent deliberately imports nothing but the standard library: FastAPI,
+psycopg and the app itself are only imported inside the workers.
+"""
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("launcher")
+
+
+def _reuseport_socket(host, port):
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    return sock
+
+
+def _serve(host, port):
+    # Bound but not listening: uvicorn calls listen() after lifespan startup.
+    sock = _reuseport_socket(host, port)
+    import uvicorn
+
+    config = uvicorn.Config("main:app", log_level="info")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def main():
+    os.environ.setdefault("WOS_LAUNCHED_AT", str(time.time()))
+    host = os.getenv("HOST", "0.0.0.0")
+    port = int(os.getenv("PORT", "8081"))
+    count = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+    ctx = multiprocessing.get_context("spawn")
+    workers = {}
+    stopping = False
+
+    def start():
+        proc = ctx.Process(target=_serve, args=(host, port), daemon=False)
+        proc.start()
+        workers[proc.pid] = proc
+        logger.info(f"Started worker {proc.pid}")
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for proc in workers.values():
+            if proc.is_alive():
+                os.kill(proc.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(count):
+        start()
+    logger.info(f"Serving on {host}:{port} with {count} worker(s)")
+
+    while workers:
+        for pid, proc in list(workers.items()):
+            proc.join(timeout=0.5)
+            if proc.exitcode is None:
+                continue
+            del workers[pid]
+            if not stopping:
+                logger.warning(f"Worker {pid} exited with {proc.exitcode}, restarting")
+                time.sleep(1)
+                start()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
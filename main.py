@@ -1,21 +1,57 @@
+import abc
 import asyncio
+import codecs
 import os
+import sys
+import hmac
 import ipaddress
 import threading
 import re
 import time
 import logging
 import json
+import math
+import operator
+import socket
+import zlib
 import httpx
+import psycopg
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
 from decimal import Decimal
 from fastapi import FastAPI, Request, BackgroundTasks
+from starlette.background import BackgroundTask
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import (
+    FileResponse,
+    JSONResponse,
+    PlainTextResponse,
+    Response,
+    StreamingResponse,
+)
 from dotenv import load_dotenv
-from datetime import datetime, timezone
-from contextlib import asynccontextmanager
-from psycopg_pool import AsyncConnectionPool
-import uvicorn
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qsl
+from contextlib import AsyncExitStack, asynccontextmanager, contextmanager
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+
+from db import _dsn, _load_migrations, _migrate
+from events import (
+    _InvalidEvent,
+    _RangeTable,
+    _build_ip_filter,
+    _ip_key,
+    _is_public_candidate,
+    _network_range,
+    _parse_event,
+)
+
+# Load .env before anything below reads its settings at import time.
+load_dotenv()
+
+# Launch time handed down by launcher.py, so time-to-ready includes imports.
+_STARTED_AT = float(os.getenv("WOS_LAUNCHED_AT") or time.time())
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -24,39 +60,683 @@ logger = logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app):
-    dsn = (
-        f"host={os.getenv('POSTGRES_HOST')} "
-        f"port={os.getenv('POSTGRES_PORT')} "
-        f"dbname={os.getenv('POSTGRES_DB')} "
-        f"user={os.getenv('POSTGRES_USER')} "
-        f"password={os.getenv('POSTGRES_PASSWORD')}"
+    pool_max = int(os.getenv("DB_POOL_MAX", "10"))
+    read_pool_max = int(os.getenv("DB_READ_POOL_MAX", str(max(1, pool_max // 2))))
+    # Writes (webhook ingest, geo enrichment) get their own pool so heavy
+    # dashboard reads can never hold all of its connections. DB_POOL_WARM
+    # connections are opened up front so the first requests don't pay for it.
+    pool_min = max(int(os.getenv("DB_POOL_MIN", "1")), int(os.getenv("DB_POOL_WARM", "4")))
+    app.state.ready = False
+    app.state.db_pool = await _open_pool(_dsn(), min(pool_min, pool_max), pool_max)
+    read_pool_min = int(os.getenv("DB_READ_POOL_MIN", "1"))
+    replicas = []
+    for host in filter(None, os.getenv("POSTGRES_READ_HOSTS", "").split(",")):
+        replicas.append(
+            (host.strip(), await _open_pool(_dsn(host.strip()), read_pool_min, read_pool_max))
+        )
+    # The primary read pool serves reads without replicas and is the fallback
+    # when none is healthy, so it only opens connections when needed.
+    primary_reads = await _open_pool(
+        _dsn(), 0 if replicas else read_pool_min, read_pool_max
+    )
+    app.state.read_router = _ReadRouter(
+        primary_reads, replicas, float(os.getenv("DB_MAX_REPLICA_LAG", "30"))
     )
+    app.state.pool_timeout = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+    app.state.admission = _build_admission(pool_max, read_pool_max)
+    spool_max = int(os.getenv("INGEST_SPOOL_MAX", "0"))
+    app.state.spool = _IngestSpool(spool_max) if spool_max > 0 else None
+
+    app.state.ingest_pipeline = _env_flag("INGEST_PIPELINE", "true")
+    app.state.ip_filter = _build_ip_filter()
+    app.state.geo_coordinator = _build_geo_coordinator(app.state.db_pool)
+    app.state.enrichment = _build_enrichment(app.state.geo_coordinator)
+    cache_size = int(os.getenv("SOURCE_CACHE_SIZE", "10000"))
+    app.state.source_cache = (
+        _TTLCache(cache_size, float(os.getenv("SOURCE_CACHE_TTL", "60")))
+        if cache_size > 0
+        else None
+    )
+    app.state.stats_cache = _TTLCache(1, float(os.getenv("DASHBOARD_STATS_TTL", "30")))
+    app.state.stats_flights = _SingleFlight(1)
+    app.state.geo_flights = _SingleFlight(int(os.getenv("GEO_MAX_PENDING", "1000")))
+    window = float(os.getenv("INGEST_AGGREGATE_WINDOW", "0"))
+    app.state.aggregator = _IngestAggregator(window) if window > 0 else None
+    flusher = None
+    if app.state.aggregator is not None:
+        flusher = asyncio.create_task(_aggregate_flusher(app))
+    drainer = None
+    if app.state.spool is not None:
+        drainer = asyncio.create_task(_drain_spool(app))
+    # Index builds can take a while on large tables, so migrations run in
+    # the background; they never block ingest or reads.
+    if _env_flag("MIGRATE_ON_STARTUP", "true"):
+        _spawn(_run_migrations())
+    recent_size = int(os.getenv("RECENT_EVENTS_SIZE", "1000"))
+    app.state.recent_events = _RecentEvents(recent_size) if recent_size > 0 else None
+    if app.state.recent_events is not None:
+        _spawn(_seed_recent_events(app))
+    app.state.rate_tracker = _build_rate_tracker()
+    if app.state.rate_tracker is not None:
+        _spawn(_rebuild_rates(app))
+    enrichment_rate = float(os.getenv("ENRICHMENT_QUEUE_RATE", "20"))
+    enricher = None
+    if enrichment_rate > 0:
+        enricher = asyncio.create_task(_drain_enrichment_queue(app, enrichment_rate))
+    health_checker = None
+    if replicas:
+        health_checker = asyncio.create_task(
+            app.state.read_router.run(float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "10")))
+        )
+
+    # Block startup on warm-up so uvicorn doesn't start accepting connections
+    # on a cold worker; if the database is slow to come up, serve anyway and
+    # let /api/ready report 503 until warm-up completes in the background.
+    warmer = asyncio.create_task(_warm_up(app))
+    try:
+        await asyncio.wait_for(
+            asyncio.shield(warmer), float(os.getenv("DB_WARM_TIMEOUT", "30"))
+        )
+    except asyncio.TimeoutError:
+        logger.warning("Warm-up still running, serving with /api/ready = 503")
+
+    try:
+        yield
+    finally:
+        app.state.ready = False
+        warmer.cancel()
+        if flusher is not None:
+            flusher.cancel()
+            await _flush_bursts(app, force=True)
+        if drainer is not None:
+            drainer.cancel()
+            await asyncio.gather(drainer, return_exceptions=True)
+        if enricher is not None:
+            enricher.cancel()
+        if health_checker is not None:
+            health_checker.cancel()
+        # close the pools on shutdown
+        await app.state.read_router.close()
+        await app.state.db_pool.close()
+
+
+async def _open_pool(dsn, min_size, max_size):
     # create the pool object (constructor no longer opens it)
     pool = AsyncConnectionPool(
         conninfo=dsn,
-        min_size=int(os.getenv("DB_POOL_MIN", "1")),
-        max_size=int(os.getenv("DB_POOL_MAX", "10")),
+        min_size=min_size,
+        max_size=max_size,
         open=False,
     )
     # explicitly open the pool to avoid the deprecation warning
     await pool.open()
-    app.state.db_pool = pool
+    return pool
+
+
+async def _warm_up(app):
+    """
+    Wait for every pool to reach its min_size and run a trivial query through
+    each, then mark the app ready. Retries until the database is reachable.
+    """
+    start = time.time()
+    pools = [app.state.db_pool, app.state.read_router.primary]
+    pools += [pool for _, pool in app.state.read_router.replicas]
+    while True:
+        try:
+            for pool in pools:
+                await pool.wait(timeout=10)
+                async with pool.connection(timeout=10) as conn:
+                    await conn.execute("SELECT 1")
+            break
+        except Exception as e:
+            logger.warning(f"Pool warm-up failed, retrying: {e}")
+            await asyncio.sleep(1)
+    app.state.ready = True
+    now = time.time()
+    logger.info(
+        f"Ready in {(now - _STARTED_AT) * 1000:.0f} ms "
+        f"(warm-up {(now - start) * 1000:.0f} ms, pid {os.getpid()})"
+    )
+
 
+async def _run_migrations():
+    """Startup migrations on a dedicated connection, outside the app's pools."""
     try:
-        yield
-    finally:
-        # close the pool on shutdown
-        await app.state.db_pool.close()
+        async with await psycopg.AsyncConnection.connect(_dsn(), autocommit=True) as conn:
+            applied = await _migrate(conn, _load_migrations())
+        if applied is None:
+            logger.info("Migrations are being applied by another process")
+        elif applied:
+            logger.info(f"Applied {len(applied)} migration(s)")
+    except Exception as e:
+        logger.error(f"Schema migration failed: {e}")
 
 
 app = FastAPI(lifespan=lifespan)
-load_dotenv()
 
 _build_dir = os.path.join(os.path.dirname(__file__), "frontend", "build")
 app.mount(
     "/static", StaticFiles(directory=os.path.join(_build_dir, "static")), name="static"
 )
 
+
+def _env_flag(name, default="false"):
+    return str(os.getenv(name, default)).lower() in ("1", "true", "yes")
+
+
+def _is_admin(request: Request) -> bool:
+    """
+    Admin endpoints are only reachable when ADMIN_TOKEN is configured and the
+    caller sends it back in the X-Admin-Token header.
+    """
+    token = os.getenv("ADMIN_TOKEN")
+    if not token:
+        return False
+    supplied = request.headers.get("x-admin-token", "")
+    return hmac.compare_digest(supplied.encode(), token.encode())
+
+
+def _admin_forbidden():
+    return JSONResponse(
+        content={"status": "error", "message": "Admin token required."},
+        status_code=403,
+    )
+
+
+# Per-request profiling. Enabled for every request with PROFILING_ENABLED=true,
+# or for a single request by an admin sending "X-Profile: 1".
+_PROFILE_HEADER = "x-profile"
+_SLOW_QUERY_MS = float(os.getenv("PROFILING_SLOW_QUERY_MS", "100"))
+_slow_queries = deque(maxlen=int(os.getenv("PROFILING_RING_SIZE", "50")))
+_profile_var: ContextVar = ContextVar("wos_profile", default=None)
+
+
+class _RequestProfile:
+    __slots__ = ("phases", "slow")
+
+    def __init__(self):
+        self.phases = {}
+        self.slow = []
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def server_timing(self, total):
+        parts = [f"{name};dur={secs * 1000:.2f}" for name, secs in self.phases.items()]
+        parts.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(parts)
+
+
+@contextmanager
+def _phase(name):
+    """Time the enclosed block into the current request profile, if any."""
+    profile = _profile_var.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if profile is not None:
+            profile.add(name, time.perf_counter() - start)
+
+
+async def _execute(cur, sql, params=None):
+    """cur.execute() that records SQL time and remembers slow statements."""
+    profile = _profile_var.get()
+    if profile is None:
+        await cur.execute(sql, params)
+        return
+    start = time.perf_counter()
+    await cur.execute(sql, params)
+    elapsed = time.perf_counter() - start
+    profile.add("sql", elapsed)
+    if elapsed * 1000 >= _SLOW_QUERY_MS:
+        profile.slow.append((sql, params, elapsed))
+
+
+async def _capture_explain(pool, entry):
+    try:
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "EXPLAIN (ANALYZE, BUFFERS) " + entry["sql"], entry.pop("_params")
+                )
+                rows = await cur.fetchall()
+                entry["plan"] = "\n".join(str(r[0]) for r in rows)
+    except Exception as e:
+        entry["plan_error"] = str(e)
+
+
+def _record_slow_queries(app, path, profile):
+    explain = _env_flag("PROFILING_EXPLAIN")
+    for sql, params, elapsed in profile.slow:
+        sql = sql.strip()
+        entry = {
+            "captured_at": datetime.now(timezone.utc).isoformat(),
+            "path": path,
+            "duration_ms": round(elapsed * 1000, 2),
+            "sql": sql,
+            "params": repr(params),
+        }
+        _slow_queries.append(entry)
+        # EXPLAIN ANALYZE executes the statement, so only ever do it for reads.
+        if explain and sql.split(None, 1)[0].upper() in ("SELECT", "WITH"):
+            entry["_params"] = params
+            _spawn(_capture_explain(app.state.read_router.pool(), entry))
+
+
+class _ProfilingMiddleware:
+    """
+    Pure ASGI middleware so unprofiled requests only pay for one header check.
+    Adds a Server-Timing header with the per-phase breakdown of the request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._wanted(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile = _RequestProfile()
+        token = _profile_var.set(profile)
+        start = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                value = profile.server_timing(time.perf_counter() - start)
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", value.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _profile_var.reset(token)
+            if profile.slow:
+                _record_slow_queries(scope["app"], scope["path"], profile)
+
+    @staticmethod
+    def _wanted(scope):
+        if _env_flag("PROFILING_ENABLED"):
+            return True
+        headers = dict(scope.get("headers") or [])
+        if headers.get(_PROFILE_HEADER.encode()) != b"1":
+            return False
+        return _is_admin(Request(scope))
+
+
+app.add_middleware(_ProfilingMiddleware)
+
+
+class _ReadRouter:
+    """
+    Picks the pool for read endpoints: replicas in round-robin order while
+    they are healthy and within DB_MAX_REPLICA_LAG, else the primary.
+    """
+
+    _LAG_SQL = """
+        SELECT CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+        END
+    """
+
+    def __init__(self, primary, replicas, max_lag):
+        self.primary = primary
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.lag = {name: None for name, _ in replicas}
+        self.healthy = {name: True for name, _ in replicas}
+        self._next = 0
+
+    def pool(self):
+        count = len(self.replicas)
+        for i in range(count):
+            name, pool = self.replicas[(self._next + i) % count]
+            if self.healthy[name]:
+                self._next = (self._next + i + 1) % count
+                return pool
+        return self.primary
+
+    async def check(self):
+        for name, pool in self.replicas:
+            try:
+                async with pool.connection(timeout=2) as conn:
+                    async with conn.cursor() as cur:
+                        await cur.execute(self._LAG_SQL)
+                        row = await cur.fetchone()
+                lag = float(row[0]) if row and row[0] is not None else None
+            except Exception as e:
+                logger.warning(f"Read replica {name} failed health check: {e}")
+                lag = None
+            healthy = lag is not None and lag <= self.max_lag
+            if healthy != self.healthy[name]:
+                logger.warning(f"Read replica {name} is now {'healthy' if healthy else 'unhealthy'} (lag={lag})")
+            self.lag[name] = lag
+            self.healthy[name] = healthy
+
+    async def run(self, interval):
+        while True:
+            await self.check()
+            await asyncio.sleep(interval)
+
+    async def close(self):
+        for _, pool in self.replicas:
+            await pool.close()
+        await self.primary.close()
+
+    def stats(self):
+        return {
+            name: {"healthy": self.healthy[name], "lag_seconds": self.lag[name]}
+            for name, _ in self.replicas
+        }
+
+
+# Admission control: caps concurrent DB work per route class so an ingest
+# flood cannot queue unbounded work on the pool and starve dashboard reads.
+class _Overloaded(Exception):
+    def __init__(self, route_class, retry_after):
+        super().__init__(f"{route_class} capacity exhausted")
+        self.route_class = route_class
+        self.retry_after = retry_after
+
+
+class _PoolMonitor:
+    """
+    Time-decayed average of checkout wait on one pool, shared by every
+    admission controller whose routes check out from it.
+    """
+
+    _HALF_LIFE = 1.0
+
+    def __init__(self):
+        self._wait = 0.0
+        self._updated = time.monotonic()
+
+    def wait(self):
+        elapsed = time.monotonic() - self._updated
+        return self._wait * 0.5 ** (elapsed / self._HALF_LIFE)
+
+    def observe(self, seconds):
+        self._wait = 0.8 * self.wait() + 0.2 * seconds
+        self._updated = time.monotonic()
+
+    def retry_after(self):
+        return max(1, min(30, math.ceil(self.wait() * 4)))
+
+
+class _AdmissionController:
+    def __init__(self, route_class, limit, queue_timeout, monitor, shed_wait=None):
+        self.route_class = route_class
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self.shed_wait = shed_wait
+        self.monitor = monitor
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._sem = asyncio.Semaphore(limit)
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.shed_wait is not None and self.monitor.wait() > self.shed_wait:
+            self._reject()
+        try:
+            await asyncio.wait_for(self._sem.acquire(), self.queue_timeout)
+        except TimeoutError:
+            self._reject()
+        self.in_flight += 1
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._sem.release()
+
+    def _reject(self):
+        self.rejected += 1
+        raise _Overloaded(self.route_class, self.monitor.retry_after())
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+
+def _build_admission(pool_max, read_pool_max):
+    queue_timeout = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2"))
+    shed_ms = float(os.getenv("ADMISSION_READ_SHED_MS", "500"))
+    # One monitor per pool: ingest checks out from the write pool, reads and
+    # exports from the read pools, so reads also give way when exports are
+    # waiting for connections.
+    write_pool, read_pools = _PoolMonitor(), _PoolMonitor()
+    return {
+        "ingest": _AdmissionController(
+            "ingest",
+            int(os.getenv("ADMISSION_INGEST_LIMIT", str(pool_max))),
+            queue_timeout,
+            write_pool,
+        ),
+        # Reads give way first when checkouts are already slow.
+        "read": _AdmissionController(
+            "read",
+            int(os.getenv("ADMISSION_READ_LIMIT", str(read_pool_max))),
+            queue_timeout,
+            read_pools,
+            shed_wait=shed_ms / 1000,
+        ),
+        # Bulk exports hold a read connection for minutes; keep them few.
+        "export": _AdmissionController(
+            "export",
+            int(os.getenv("EXPORT_CONCURRENCY", "2")),
+            queue_timeout,
+            read_pools,
+        ),
+    }
+
+
+@asynccontextmanager
+async def _db_connection(app, route_class):
+    """
+    Admit the caller into `route_class`, then check out a connection with a
+    bounded wait. Records the checkout wait for admission and profiling.
+    """
+    controller = app.state.admission[route_class]
+    pool = app.state.db_pool if route_class == "ingest" else app.state.read_router.pool()
+    async with controller.slot():
+        start = time.perf_counter()
+        try:
+            async with pool.connection(timeout=app.state.pool_timeout) as conn:
+                waited = time.perf_counter() - start
+                controller.monitor.observe(waited)
+                profile = _profile_var.get()
+                if profile is not None:
+                    profile.add("pool", waited)
+                yield conn
+        except PoolTimeout:
+            controller.monitor.observe(time.perf_counter() - start)
+            controller._reject()
+
+
+def _overloaded_response(exc: _Overloaded):
+    # Ingest senders are told to slow down; reads are temporarily unavailable.
+    status_code = 429 if exc.route_class == "ingest" else 503
+    return JSONResponse(
+        content={"status": "error", "message": "Server is busy, retry later."},
+        status_code=status_code,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+class _IngestSpool:
+    """Bounded overflow queue for events that could not be admitted."""
+
+    _BATCH = 500
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._events = deque()
+        self._ready = asyncio.Event()
+
+    def put(self, event):
+        if len(self._events) >= self.max_size:
+            return False
+        self._events.append(event)
+        self._ready.set()
+        return True
+
+    def requeue(self, events):
+        self._events.extendleft(reversed(events))
+
+    def take(self):
+        batch = []
+        while self._events and len(batch) < self._BATCH:
+            batch.append(self._events.popleft())
+        if not self._events:
+            self._ready.clear()
+        return batch
+
+    async def wait(self):
+        await self._ready.wait()
+
+    def __len__(self):
+        return len(self._events)
+
+
+async def _store_spooled(app, batch):
+    async with _db_connection(app, "ingest") as conn:
+        new_sources = await _store_events(app, conn, batch)
+    background = BackgroundTasks()
+    for event in new_sources:
+        schedule_geo_lookup(event, background=background, app=app)
+    if background.tasks:
+        _spawn(background())
+
+
+async def _drain_spool(app):
+    spool = app.state.spool
+    try:
+        while True:
+            await spool.wait()
+            batch = spool.take()
+            try:
+                await _store_spooled(app, batch)
+            except Exception as e:
+                spool.requeue(batch)
+                logger.warning(f"Spool drain deferred ({len(spool)} queued): {e}")
+                await asyncio.sleep(1)
+    except asyncio.CancelledError:
+        # Last attempt to persist what is left before shutting down.
+        while len(spool):
+            batch = spool.take()
+            try:
+                await _store_spooled(app, batch)
+            except Exception as e:
+                logger.error(f"Dropping {len(batch) + len(spool)} spooled events: {e}")
+                return
+        raise
+
+
+_background_tasks = set()
+
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+class _StackSampler:
+    """
+    Minimal sampling profiler for long captures. Samples one thread's stack
+    from a helper thread and aggregates collapsed stacks (flamegraph format).
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+
+    def run(self, duration):
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A profile capture is already running.")
+        try:
+            stacks = Counter()
+            deadline = time.monotonic() + duration
+            while time.monotonic() < deadline:
+                frame = sys._current_frames().get(self.thread_id)
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(
+                        f"{os.path.basename(code.co_filename)}:{code.co_name}"
+                    )
+                    frame = frame.f_back
+                if names:
+                    stacks[";".join(reversed(names))] += 1
+                time.sleep(self.interval)
+            return stacks
+        finally:
+            self._lock.release()
+
+
+@app.get("/api/admin/slow_queries")
+async def get_slow_queries(request: Request):
+    if not _is_admin(request):
+        return _admin_forbidden()
+    data = [
+        {k: v for k, v in entry.items() if not k.startswith("_")}
+        for entry in reversed(_slow_queries)
+    ]
+    return JSONResponse(content={"status": "success", "data": data}, status_code=200)
+
+
+@app.get("/api/admin/admission")
+async def get_admission_stats(request: Request):
+    if not _is_admin(request):
+        return _admin_forbidden()
+    state = request.app.state
+    data = {}
+    for name, controller in state.admission.items():
+        data[name] = controller.stats()
+        data[name]["pool_wait_ms"] = round(controller.monitor.wait() * 1000, 2)
+    data["spool_depth"] = len(state.spool) if state.spool is not None else None
+    data["replicas"] = state.read_router.stats()
+    for name, pool in (("pool", state.db_pool), ("read_pool", state.read_router.primary)):
+        get_pool_stats = getattr(pool, "get_stats", None)
+        if get_pool_stats:
+            data[name] = get_pool_stats()
+    return JSONResponse(content={"status": "success", "data": data}, status_code=200)
+
+
+@app.post("/api/admin/profile")
+async def capture_profile(request: Request, seconds: float = 10, interval_ms: float = 5):
+    """
+    Sample the event loop thread for `seconds` and return collapsed stacks,
+    one "frame;frame;frame count" line per unique stack.
+    """
+    if not _is_admin(request):
+        return _admin_forbidden()
+    seconds = max(0.1, min(float(seconds), 300))
+    interval = max(0.001, float(interval_ms) / 1000)
+    sampler = _StackSampler(threading.get_ident(), interval)
+    try:
+        stacks = await asyncio.to_thread(sampler.run, seconds)
+    except RuntimeError as e:
+        return JSONResponse(
+            content={"status": "error", "message": str(e)}, status_code=409
+        )
+    body = "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+    return PlainTextResponse(body)
+
 # Rate limit / caching / duplicate guard for Geo lookups
 # ENABLE_GLOBAL_COLLECTOR = str(os.getenv("ENABLE_GLOBAL_COLLECTOR", "false")).lower() not in ("1", "true", "yes")
 # GLOBAL_COLLECTOR_URL = os.getenv("GLOBAL_COLLECTOR_URL", "https://shame.shrunbr.dev/api/webhook")
@@ -65,54 +745,147 @@ _RATE_LIMIT = 45  # per 60 seconds for this server
 _call_times = []
 _call_lock = threading.Lock()
 
-_ip_locks = {}
-_ip_locks_lock = threading.Lock()
 _as_regex = re.compile(r"^AS(\d+)\s*(.*)$")
 
-_GEO_LOOKUP_SEMAPHORE = asyncio.Semaphore(5)
 
-_EXCLUDED_NETS_V4 = [
-    ipaddress.ip_network("10.0.0.0/8"),
-    ipaddress.ip_network("172.16.0.0/12"),
-    ipaddress.ip_network("192.168.0.0/16"),
-    ipaddress.ip_network("127.0.0.0/8"),
-    ipaddress.ip_network("100.64.0.0/10"),  # CGNAT
-]
+class _SingleFlight:
+    """
+    Coalesces concurrent work per key: callers arriving while a key is in
+    flight await the same future instead of starting their own. Entries are
+    dropped as soon as the work finishes, so memory follows in-flight work
+    rather than every address ever seen.
+
+    `max_pending` caps work from the moment it is scheduled: callers take a
+    _Slot with reserve() before queueing a task and hand it to the task,
+    which releases it when it finishes, whether it led a flight or joined
+    one.
+    """
+
+    def __init__(self, max_pending):
+        self.max_pending = max_pending
+        self.dropped = 0
+        self.pending = 0
+        self._flights = {}
+
+    def __contains__(self, key):
+        return key in self._flights
+
+    def __len__(self):
+        return len(self._flights)
+
+    def full(self):
+        return self.pending >= self.max_pending
+
+    def reserve(self):
+        """Take a slot for work about to be scheduled; None (and counted as dropped) when full."""
+        if self.full():
+            self.dropped += 1
+            return None
+        self.pending += 1
+        return _Slot(self)
+
+    async def join(self, key):
+        """Wait for `key` if it is in flight. True if there was anything to wait for."""
+        flight = self._flights.get(key)
+        if flight is None:
+            return False
+        try:
+            await asyncio.shield(flight)
+        except Exception:
+            pass
+        return True
+
+    async def do(self, key, fn):
+        flight = self._flights.get(key)
+        if flight is not None:
+            return await asyncio.shield(flight)
+        flight = asyncio.get_running_loop().create_future()
+        # Followers may never look at a failure; don't warn about it.
+        flight.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._flights[key] = flight
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            del self._flights[key]
 
 
-def _is_public_candidate(ip_str: str) -> bool:
+class _Slot:
     """
-    Return True if IP should be looked up (public routable), False if excluded.
-    Handles IP Addressing (skips private, loopback, link-local, multicast, unspecified).
+    One _SingleFlight pending slot. release() gives it back once, and so does
+    dropping the slot unreleased: Starlette skips a response's remaining
+    background tasks after one raises (and runs none if the response fails
+    to send), so a task holding a slot is not guaranteed to run.
     """
-    try:
-        ip_obj = ipaddress.ip_address(ip_str)
-    except ValueError:
-        return False
-    if ip_obj.version == 4:
-        for net in _EXCLUDED_NETS_V4:
-            if ip_obj in net:
-                return False
-    # Generic exclusions
-    if (
-        ip_obj.is_private
-        or ip_obj.is_loopback
-        or ip_obj.is_link_local
-        or ip_obj.is_multicast
-        or ip_obj.is_reserved
-        or ip_obj.is_unspecified
-    ):
-        return False
-    return True
 
+    __slots__ = ("_flights",)
 
-def _acquire_ip_lock(ip): # pragma: no cover
-    with _ip_locks_lock:
-        lock = _ip_locks.get(ip)
-        if not lock:
-            lock = asyncio.Lock()
-            _ip_locks[ip] = lock
-    return lock
+    def __init__(self, flights):
+        self._flights = flights
+
+    def release(self):
+        flights, self._flights = self._flights, None
+        if flights is not None:
+            flights.pending -= 1
+
+    __del__ = release
+
+
+class _TTLCache:
+    """Size-bounded LRU whose entries expire `ttl` seconds after being stored."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def get_many(self, keys):
+        """Return ({key: row-or-None} for fresh entries, [missing keys])."""
+        now = time.monotonic()
+        found, missing = {}, []
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                found[key] = entry[1]
+            else:
+                missing.append(key)
+        self.hits += len(found)
+        self.misses += len(missing)
+        return found, missing
+
+    def put(self, key, row):
+        self._entries[key] = (time.monotonic() + self.ttl, row)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+        }
 
 
 def _within_rate_limit():
@@ -126,6 +899,108 @@ def _within_rate_limit():
         return True
 
 
+class _LocalGeoCoordinator:
+    """
+    Single-process default: the in-memory sliding window above, and no
+    cross-process claim (per-IP locking stays in-process).
+    """
+
+    async def allow_lookup(self):
+        return _within_rate_limit()
+
+    async def claim(self, ip):
+        return True
+
+    async def release(self, ip):
+        return None
+
+
+class _PostgresGeoCoordinator:
+    """
+    Shares the ip-api budget and per-IP in-flight claims between worker
+    processes and containers through Postgres.
+
+    The budget is a token bucket in rate_limit_buckets, refilled and spent in a
+    single conditional upsert. Refill is (limit - burst) per minute on top of a
+    `burst` capacity, so no 60 second window can ever exceed `limit` calls.
+    """
+
+    _ACQUIRE_SQL = """
+        INSERT INTO rate_limit_buckets AS b (name, tokens, updated_at)
+        VALUES (%(name)s, %(capacity)s - 1, clock_timestamp())
+        ON CONFLICT (name) DO UPDATE SET
+            tokens = LEAST(%(capacity)s, b.tokens
+                + EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at) * %(rate)s) - 1,
+            updated_at = clock_timestamp()
+        WHERE LEAST(%(capacity)s, b.tokens
+                + EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at) * %(rate)s) >= 1
+        RETURNING tokens
+    """
+    _CLAIM_SQL = """
+        INSERT INTO geo_lookup_claims (src_host, claimed_at)
+        VALUES (%(ip)s, clock_timestamp())
+        ON CONFLICT (src_host) DO UPDATE SET claimed_at = EXCLUDED.claimed_at
+        WHERE geo_lookup_claims.claimed_at < clock_timestamp() - make_interval(secs => %(ttl)s)
+        RETURNING 1
+    """
+
+    def __init__(self, pool, limit=_RATE_LIMIT, burst=5, claim_ttl=60):
+        self.pool = pool
+        self.capacity = burst
+        self.rate = (limit - burst) / 60
+        self.claim_ttl = claim_ttl
+
+    async def _returns_row(self, sql, params):
+        try:
+            async with self.pool.connection(timeout=2) as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(sql, params)
+                    row = await cur.fetchone()
+                await conn.commit()
+            return row is not None
+        except Exception as e:
+            # Fail closed: skipping a lookup is cheaper than an ip-api ban.
+            logger.warning(f"Geo coordination query failed: {e}")
+            return False
+
+    async def allow_lookup(self):
+        return await self._returns_row(
+            self._ACQUIRE_SQL,
+            {"name": "ip-api", "capacity": self.capacity, "rate": self.rate},
+        )
+
+    async def claim(self, ip):
+        return await self._returns_row(self._CLAIM_SQL, {"ip": ip, "ttl": self.claim_ttl})
+
+    async def release(self, ip):
+        try:
+            async with self.pool.connection(timeout=2) as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(
+                        "DELETE FROM geo_lookup_claims WHERE src_host = %s", (ip,)
+                    )
+                await conn.commit()
+        except Exception as e:
+            logger.warning(f"Failed to release geo claim for {ip}: {e}")
+
+
+_LOCAL_GEO_COORDINATOR = _LocalGeoCoordinator()
+
+
+def _build_geo_coordinator(pool):
+    backend = os.getenv("GEO_COORDINATION", "local").lower()
+    if backend == "postgres":
+        return _PostgresGeoCoordinator(
+            pool,
+            limit=_RATE_LIMIT,
+            burst=int(os.getenv("GEO_RATE_BURST", "5")),
+            claim_ttl=float(os.getenv("GEO_CLAIM_TTL", "60")),
+        )
+    if backend != "local":
+        logger.warning(f"Unknown GEO_COORDINATION {backend!r}, using local")
+    return _LOCAL_GEO_COORDINATOR
+
+
 async def _ip_exists_async(conn, ip): # pragma: no cover
     async with conn.cursor() as c:
         await c.execute("SELECT 1 FROM source_details WHERE src_host=%s LIMIT 1", (ip,))
@@ -133,7 +1008,8 @@ async def _ip_exists_async(conn, ip): # pragma: no cover
         return row is not None
 
 
-async def _insert_geo_row_async(conn, base, geo):
+def _geo_columns(geo):
+    """Map an ip-api response onto source_details geo columns."""
     asnum = None
     asorg = None
     if geo and geo.get("as"):
@@ -147,13 +1023,7 @@ async def _insert_geo_row_async(conn, base, geo):
         else:
             asorg = geo.get("as")
 
-    ts = base.get("utc_time") or datetime.now(timezone.utc)
-
-    with_params = {
-        "first_seen": ts,
-        "last_seen": ts,
-        "times_seen": 1,
-        "src_host": base.get("src_host"),
+    return {
         "src_country": geo.get("country") if geo else None,
         "src_isocountrycode": geo.get("countryCode") if geo else None,
         "src_region": geo.get("region") if geo else None,
@@ -171,88 +1041,485 @@ async def _insert_geo_row_async(conn, base, geo):
         "src_mobile": geo.get("mobile") if geo else None,
         "src_proxy": geo.get("proxy") if geo else None,
         "src_hosting": geo.get("hosting") if geo else None,
+        "src_geo_inferred": bool(geo and geo.get("inferred")),
     }
 
-    async with conn.cursor() as cur:
-        await cur.execute(
-            """
-            INSERT INTO source_details (
-                first_seen, last_seen, times_seen,
-                src_host, src_country, src_isocountrycode, src_region, src_regionname, src_city, src_zip,
-                src_latitude, src_longitude, src_timezone,
-                src_isp, src_org, src_asnum, src_asorg, src_reversedns,
-                src_mobile, src_proxy, src_hosting
-            ) VALUES (
-                %(first_seen)s, %(last_seen)s, %(times_seen)s,
-                %(src_host)s, %(src_country)s, %(src_isocountrycode)s, %(src_region)s, %(src_regionname)s, %(src_city)s, %(src_zip)s,
-                %(src_latitude)s, %(src_longitude)s, %(src_timezone)s,
-                %(src_isp)s, %(src_org)s, %(src_asnum)s, %(src_asorg)s, %(src_reversedns)s,
-                %(src_mobile)s, %(src_proxy)s, %(src_hosting)s
-            )
-            ON CONFLICT (src_host)
-            DO UPDATE SET
-                last_seen = GREATEST(source_details.last_seen, EXCLUDED.last_seen),
-                times_seen = source_details.times_seen + 1
-        """,
-            with_params,
-        )
 
+_GEO_COLUMNS = tuple(_geo_columns(None))
+_INSERT_SOURCE_SQL = """
+    INSERT INTO source_details (
+        first_seen, last_seen, times_seen,
+        src_host, src_country, src_isocountrycode, src_region, src_regionname, src_city, src_zip,
+        src_latitude, src_longitude, src_timezone,
+        src_isp, src_org, src_asnum, src_asorg, src_reversedns,
+        src_mobile, src_proxy, src_hosting, src_geo_inferred
+    ) VALUES (
+        %(first_seen)s, %(last_seen)s, %(times_seen)s,
+        %(src_host)s, %(src_country)s, %(src_isocountrycode)s, %(src_region)s, %(src_regionname)s, %(src_city)s, %(src_zip)s,
+        %(src_latitude)s, %(src_longitude)s, %(src_timezone)s,
+        %(src_isp)s, %(src_org)s, %(src_asnum)s, %(src_asorg)s, %(src_reversedns)s,
+        %(src_mobile)s, %(src_proxy)s, %(src_hosting)s, %(src_geo_inferred)s
+    )
+    ON CONFLICT (src_host)
+    DO UPDATE SET
+        last_seen = GREATEST(source_details.last_seen, EXCLUDED.last_seen),
+        times_seen = source_details.times_seen + 1
+"""
 
-async def _fetch_geo_async(ip):
-    if not _within_rate_limit():
-        return None
-    try:
-        async with httpx.AsyncClient(timeout=5) as client:
-            r = await client.get(f"http://ip-api.com/json/{ip}?fields={_IP_API_FIELDS}")
-            if r.status_code == 200:
-                j = r.json()
-                if j.get("status") == "success":
+
+async def _insert_geo_row_async(conn, base, geo):
+    ts = base.get("utc_time") or datetime.now(timezone.utc)
+
+    with_params = {
+        "first_seen": ts,
+        "last_seen": ts,
+        "times_seen": 1,
+        "src_host": base.get("src_host"),
+        **_geo_columns(geo),
+    }
+
+    async with conn.cursor() as cur:
+        await cur.execute(_INSERT_SOURCE_SQL, with_params)
+
+
+# Scanners tend to come from contiguous blocks, so a lookup result is reused
+# for other addresses in the same /24 (IPv4) or /64 (IPv6). Reused results
+# are stored with src_geo_inferred = true.
+_GEO_PREFIX_LENGTHS = {
+    4: int(os.getenv("GEO_PREFIX_V4", "24")),
+    6: int(os.getenv("GEO_PREFIX_V6", "64")),
+}
+# Fields that describe the address itself rather than its network.
+_PER_ADDRESS_GEO_FIELDS = ("query", "reverse", "mobile", "proxy")
+_geo_prefix_cache_size = int(os.getenv("GEO_PREFIX_CACHE_SIZE", "50000"))
+_GEO_PREFIX_CACHE = (
+    _TTLCache(_geo_prefix_cache_size, float(os.getenv("GEO_PREFIX_CACHE_TTL", "86400")))
+    if _geo_prefix_cache_size > 0
+    else None
+)
+
+
+def _geo_prefix(ip):
+    try:
+        addr = ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+    return str(ipaddress.ip_network((addr, _GEO_PREFIX_LENGTHS[addr.version]), strict=False))
+
+
+async def _fetch_geo_async(ip, coordinator=None):
+    prefix = _geo_prefix(ip) if _GEO_PREFIX_CACHE is not None else None
+    if prefix is not None:
+        known, _ = _GEO_PREFIX_CACHE.get_many([prefix])
+        if known:
+            return {**known[prefix], "inferred": True}
+    if not await (coordinator or _LOCAL_GEO_COORDINATOR).allow_lookup():
+        return None
+    try:
+        async with httpx.AsyncClient(timeout=5) as client:
+            r = await client.get(f"http://ip-api.com/json/{ip}?fields={_IP_API_FIELDS}")
+            if r.status_code == 200:
+                j = r.json()
+                if j.get("status") == "success":
+                    if prefix is not None:
+                        _GEO_PREFIX_CACHE.put(
+                            prefix,
+                            {k: v for k, v in j.items() if k not in _PER_ADDRESS_GEO_FIELDS},
+                        )
                     return j
     except Exception as e:
         logger.warning(f"GeoIP lookup failed for {ip}: {e}")
     return None
 
 
+# Enrichment pipeline: independent stages run concurrently per source, each
+# with its own concurrency limit, timeout, cache and latency stats, and their
+# columns are merged into a single source_details UPDATE. Earlier stages win
+# on conflicting columns, so local data only fills what ip-api left empty.
+class _Enricher(abc.ABC):
+    name = None
+
+    def __init__(self, concurrency, timeout, cache_size=10000, cache_ttl=3600):
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._cache = _TTLCache(cache_size, cache_ttl) if cache_size > 0 else None
+        self._latencies = deque(maxlen=512)
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+
+    @abc.abstractmethod
+    async def lookup(self, ip):
+        """Return {column: value} for `ip`; empty when nothing is known."""
+
+    async def enrich(self, ip):
+        if self._cache is not None:
+            cached, _ = self._cache.get_many([ip])
+            if cached:
+                return cached[ip]
+        async with self._semaphore:
+            start = time.perf_counter()
+            self.calls += 1
+            try:
+                columns = await asyncio.wait_for(self.lookup(ip), self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                columns = {}
+            except Exception as e:
+                logger.warning(f"Enricher {self.name} failed for {ip}: {e}")
+                self.errors += 1
+                columns = {}
+            finally:
+                self._latencies.append(time.perf_counter() - start)
+        if columns and self._cache is not None:
+            self._cache.put(ip, columns)
+        return columns
+
+    def stats(self):
+        recent = sorted(self._latencies)
+        pick = lambda q: round(recent[int(q * (len(recent) - 1))] * 1000, 2) if recent else None  # noqa: E731
+        data = {
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "p50_ms": pick(0.5),
+            "p95_ms": pick(0.95),
+            "max_ms": round(recent[-1] * 1000, 2) if recent else None,
+        }
+        if self._cache is not None:
+            data["cache"] = self._cache.stats()
+        return data
+
+
+class _GeoEnricher(_Enricher):
+    """ip-api lookup, subject to the shared rate limit and the prefix cache."""
+
+    name = "geo"
+
+    def __init__(self, coordinator, **kwargs):
+        super().__init__(**kwargs)
+        self.coordinator = coordinator
+
+    async def lookup(self, ip):
+        geo = await _fetch_geo_async(ip, self.coordinator)
+        return _geo_columns(geo) if geo else {}
+
+
+class _AsnEnricher(_Enricher):
+    """
+    Local ASN database in the iptoasn.com TSV layout:
+    range_start, range_end, as_number, country_code, as_description.
+    """
+
+    name = "asn"
+
+    def __init__(self, path, **kwargs):
+        super().__init__(cache_size=0, **kwargs)
+        ranges = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) < 5 or parts[2] in ("", "0"):
+                    continue
+                try:
+                    ranges.append((_ip_key(parts[0]), _ip_key(parts[1]), (int(parts[2]), parts[4])))
+                except ValueError:
+                    continue
+        self.table = _RangeTable(ranges)
+        logger.info(f"Loaded {len(self.table)} ASN ranges from {path}")
+
+    async def lookup(self, ip):
+        found = self.table.get(_ip_key(ip))
+        if found is None:
+            return {}
+        return {"src_asnum": found[0], "src_asorg": found[1] or None}
+
+
+class _ReverseDnsEnricher(_Enricher):
+    """
+    PTR lookup through the system resolver, on resolver threads of its own.
+    A timed-out lookup keeps its thread until the resolver gives up, so the
+    stage never shares the default executor (asyncio.to_thread, outgoing
+    connection DNS) and skips lookups while every thread is still busy.
+    Off by default: PTR queries go to the attacker's DNS servers.
+    """
+
+    name = "rdns"
+
+    def __init__(self, concurrency, **kwargs):
+        super().__init__(concurrency=concurrency, **kwargs)
+        self.threads = concurrency
+        self.busy = 0
+        self.skipped = 0
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="rdns")
+
+    def _done(self, future):
+        self.busy -= 1
+        # A timed-out lookup's late result or error is never awaited.
+        future.cancelled() or future.exception()
+
+    async def lookup(self, ip):
+        if self.busy >= self.threads:
+            self.skipped += 1
+            return {}
+        future = asyncio.get_running_loop().run_in_executor(
+            self._executor, socket.getnameinfo, (ip, 0), socket.NI_NAMEREQD
+        )
+        self.busy += 1
+        future.add_done_callback(self._done)
+        try:
+            host, _ = await asyncio.shield(future)
+        except socket.gaierror:
+            return {}
+        return {"src_reversedns": host}
+
+    def stats(self):
+        return {**super().stats(), "busy_threads": self.busy, "skipped": self.skipped}
+
+
+class _ThreatListEnricher(_Enricher):
+    """Tags sources found in local blocklists: THREAT_LISTS="tag=path,tag=path"."""
+
+    name = "threat"
+
+    def __init__(self, lists, **kwargs):
+        super().__init__(cache_size=0, **kwargs)
+        self.tables = {}
+        for tag, path in lists.items():
+            ranges = []
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    entry = line.split("#", 1)[0].split(";", 1)[0].strip()
+                    if not entry:
+                        continue
+                    try:
+                        ranges.append(_network_range(entry.split()[0]))
+                    except ValueError:
+                        continue
+            self.tables[tag] = _RangeTable.merged(ranges)
+            logger.info(f"Loaded {len(self.tables[tag])} ranges for threat list {tag}")
+
+    async def lookup(self, ip):
+        key = _ip_key(ip)
+        tags = [tag for tag, table in self.tables.items() if table.get(key)]
+        return {"src_threat_tags": tags} if tags else {}
+
+
+class _EnrichmentPipeline:
+    def __init__(self, stages):
+        self.stages = stages
+
+    async def run(self, ip):
+        """Run every stage concurrently; returns {stage name: columns}."""
+        results = await asyncio.gather(*(stage.enrich(ip) for stage in self.stages))
+        return {stage.name: columns for stage, columns in zip(self.stages, results)}
+
+    @staticmethod
+    def merge(results):
+        merged = {}
+        for columns in results.values():
+            for column, value in columns.items():
+                if value is not None:
+                    merged.setdefault(column, value)
+        return merged
+
+    def stats(self):
+        return {stage.name: stage.stats() for stage in self.stages}
+
+
+def _build_enrichment(coordinator):
+    stages = [
+        _GeoEnricher(
+            coordinator,
+            concurrency=int(os.getenv("GEO_CONCURRENCY", "5")),
+            timeout=float(os.getenv("GEO_TIMEOUT", "6")),
+        )
+    ]
+    if os.getenv("ASN_DB_FILE"):
+        stages.append(_AsnEnricher(os.getenv("ASN_DB_FILE"), concurrency=100, timeout=1))
+    if _env_flag("ENRICH_RDNS"):
+        stages.append(
+            _ReverseDnsEnricher(
+                concurrency=int(os.getenv("RDNS_CONCURRENCY", "10")),
+                timeout=float(os.getenv("RDNS_TIMEOUT", "2")),
+            )
+        )
+    lists = dict(
+        item.split("=", 1)
+        for item in filter(None, os.getenv("THREAT_LISTS", "").split(","))
+    )
+    if lists:
+        stages.append(_ThreatListEnricher(lists, concurrency=100, timeout=1))
+    return _EnrichmentPipeline(stages)
+
+
+_ENRICHABLE_COLUMNS = frozenset(_GEO_COLUMNS) | {"src_threat_tags"}
+
+
+def _update_source_sql(names):
+    return (
+        "UPDATE source_details SET "
+        + ", ".join(f"{c} = %({c})s" for c in names)
+        + " WHERE src_host = %(src_host)s"
+    )
+
+
+async def _update_source_columns(conn, ip, columns):
+    """UPDATE only the enriched columns that were found."""
+    names = [c for c in columns if c in _ENRICHABLE_COLUMNS]
+    if not names:
+        return
+    async with conn.cursor() as cur:
+        await cur.execute(_update_source_sql(names), {"src_host": ip, **{c: columns[c] for c in names}})
+
+
 def schedule_geo_lookup(event, background: BackgroundTasks = None, app=None):
     ip = event.get("src_host")
     if not ip:
         return
     if not _is_public_candidate(ip):
         return
+    flights = getattr(app.state, "geo_flights", None)
+    slot = None
+    if flights is not None:
+        if app.state.ingest_pipeline and ip in flights:
+            return
+        slot = flights.reserve()
+        if slot is None:
+            logger.debug(f"Geo lookup queue full, not enriching {ip}")
+            return
 
     try:
         logger.info(f"Scheduling geo lookup for {ip}")
-        background.add_task(_geo_worker_async, app, ip, event)
+        background.add_task(_geo_worker_async, app, ip, event, slot=slot)
         return
     except Exception as e:
+        if slot is not None:
+            slot.release()
         logger.error(f"Failed to schedule background task: {e}")
         return
 
 
-async def _geo_worker_async(app, ip, event):
-    lock = _acquire_ip_lock(ip)
+async def _geo_lookup_and_store(app, ip, event, coordinator, enrich=True):
+    pool = app.state.db_pool
+    enrichment = app.state.enrichment
+    if app.state.ingest_pipeline:
+        # The webhook already created the source row, so only enrich it,
+        # without holding a connection during the lookups.
+        columns = enrichment.merge(await enrichment.run(ip))
+        if columns:
+            async with pool.connection() as conn:
+                await _update_source_columns(conn, ip, columns)
+                await conn.commit()
+            _invalidate_source(app, ip)
+        return
+    async with pool.connection() as conn:
+        exists = await _ip_exists_async(conn, ip)
+        await _insert_geo_row_async(conn, event, {})
+        if enrich and not exists:
+            columns = enrichment.merge(await enrichment.run(ip))
+            await _update_source_columns(conn, ip, columns)
+        await conn.commit()
+    _invalidate_source(app, ip)
+
+
+async def _geo_worker_async(app, ip, event, slot=None):
+    """Enrich `ip`; `slot` is the geo_flights slot schedule_geo_lookup took for it."""
     start = time.monotonic()
     logger.info(f"Geo worker scheduled for {ip}")
+    coordinator = app.state.geo_coordinator
+    flights = app.state.geo_flights
+
+    async def lookup():
+        # Concurrency is limited per enrichment stage, so a slow stage
+        # (reverse DNS) never holds up the others.
+        claimed = await coordinator.claim(ip)
+        if not claimed:
+            logger.info(f"Geo lookup for {ip} already in flight elsewhere")
+            # Legacy mode counts the event here, so still write its row.
+            if app.state.ingest_pipeline:
+                return
+        try:
+            await _geo_lookup_and_store(app, ip, event, coordinator, enrich=claimed)
+        finally:
+            if claimed:
+                await coordinator.release(ip)
+
     try:
-        async with lock:
-            async with _GEO_LOOKUP_SEMAPHORE:
-                pool = app.state.db_pool
-                async with pool.connection() as conn:
-                    exists = await _ip_exists_async(conn, ip)
-                    geo = None
-                    if not exists:
-                        geo = await _fetch_geo_async(ip)
-                    await _insert_geo_row_async(conn, event, geo or {})
-                    await conn.commit()
+        if app.state.ingest_pipeline:
+            await flights.do(ip, lookup)
+        elif await flights.join(ip):
+            # Legacy mode writes one upsert per event: wait for the lookup in
+            # flight, then write this event's (now existing) row ourselves.
+            await lookup()
+        else:
+            await flights.do(ip, lookup)
     except Exception as e:
         logger.error(f"Geo worker failed for {ip}: {e}")
     finally:
+        if slot is not None:
+            slot.release()
         elapsed = time.monotonic() - start
         if elapsed > 2:
             logger.warning(f"Geo worker for {ip} took {elapsed:.2f}s")
         logger.info(f"Geo worker completed for {ip}")
 
 
+# Sources bulk-loaded by tools/import_opencanary.py are queued in the database
+# and enriched here at a steady pace, leaving ip-api budget for live traffic.
+_DEQUEUE_ENRICHMENT_SQL = """
+    DELETE FROM enrichment_queue
+    WHERE src_host = (
+        SELECT src_host FROM enrichment_queue
+        ORDER BY queued_at
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING src_host, attempts
+"""
+_REQUEUE_ENRICHMENT_SQL = """
+    INSERT INTO enrichment_queue (src_host, attempts) VALUES (%s, %s)
+    ON CONFLICT (src_host) DO NOTHING
+"""
+_ENRICHMENT_MAX_ATTEMPTS = 3
+
+
+async def _enrich_queued_source(app):
+    """Enrich the oldest queued source. False when the queue is empty."""
+    pool = app.state.db_pool
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(_DEQUEUE_ENRICHMENT_SQL)
+            row = await cur.fetchone()
+        await conn.commit()
+    if row is None:
+        return False
+    ip, attempts = row
+    enrichment = app.state.enrichment
+    results = await enrichment.run(ip)
+    columns = enrichment.merge(results)
+    async with pool.connection() as conn:
+        await _update_source_columns(conn, ip, columns)
+        # Retry sources ip-api could not answer (e.g. out of budget).
+        if not results.get("geo") and attempts + 1 < _ENRICHMENT_MAX_ATTEMPTS:
+            await conn.execute(_REQUEUE_ENRICHMENT_SQL, (ip, attempts + 1))
+        await conn.commit()
+    if columns:
+        _invalidate_source(app, ip)
+    return True
+
+
+async def _drain_enrichment_queue(app, per_minute):
+    interval = 60 / per_minute
+    while True:
+        try:
+            found = await _enrich_queued_source(app)
+        except Exception as e:
+            logger.warning(f"Enrichment queue drain failed: {e}")
+            found = False
+        await asyncio.sleep(interval if found else max(interval, 10))
+
+
 # def _forward_to_global_collector(payload):
 #    """
 #    Send the webhook payload to the global collector. This runs in a background
@@ -266,183 +1533,847 @@ async def _geo_worker_async(app, ip, event):
 #        pass
 
 
-def serialize_datetimes(obj):
-    if isinstance(obj, dict):
-        return {k: serialize_datetimes(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [serialize_datetimes(i) for i in obj]
-    elif isinstance(obj, datetime):
-        return obj.strftime("%Y-%m-%d %H:%M:%S %z")
-    elif isinstance(obj, Decimal):
-        return float(obj)
-    else:
-        return obj
+def serialize_datetimes(obj):
+    if isinstance(obj, dict):
+        return {k: serialize_datetimes(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [serialize_datetimes(i) for i in obj]
+    elif isinstance(obj, datetime):
+        return obj.strftime("%Y-%m-%d %H:%M:%S %z")
+    elif isinstance(obj, Decimal):
+        return float(obj)
+    else:
+        return obj
+
+
+_raw_decode = json.JSONDecoder().raw_decode
+
+
+def _json_loads(text):
+    # json.loads() minus its encoding detection (for bytes) and whitespace
+    # regexes, together about a third of the cost of a small event; anything
+    # after the value is still an error.
+    text = text.strip()
+    data, end = _raw_decode(text)
+    if end != len(text):
+        raise ValueError("Extra data")
+    return data
+
+
+def _content_type(request):
+    # Straight from the ASGI header list (names are lowercase) instead of
+    # building request.headers for this one lookup.
+    for name, value in request.scope["headers"]:
+        if name == b"content-type":
+            return value.decode("latin-1")
+    return ""
+
+
+def _decode_webhook_body(content_type, body):
+    """
+    Parse the raw body once based on its Content-Type. Returns (data, error).
+    OpenCanary posts application/x-www-form-urlencoded with the event JSON in
+    the "message" field; direct API clients post application/json. A body
+    with no or any other Content-Type (text/plain, ...) is parsed as JSON if
+    it starts with { or [, as the old try-JSON-first flow accepted it.
+    """
+    media_type = content_type.partition(";")[0].strip().lower()
+    is_json = media_type == "application/json" or media_type.endswith("+json")
+    if not is_json and media_type != "application/x-www-form-urlencoded":
+        is_json = body.lstrip()[:1] in (b"{", b"[")
+        if not is_json and media_type:
+            return None, f"Unsupported content type: {media_type}."
+    if is_json:
+        try:
+            # Webhook bodies are UTF-8 (RFC 8259), BOM or not.
+            return _json_loads(body.removeprefix(codecs.BOM_UTF8).decode("utf-8")), None
+        except ValueError:
+            return None, "Failed to parse JSON body."
+    try:
+        form = dict(parse_qsl(body.decode("utf-8"), keep_blank_values=True))
+    except UnicodeDecodeError:
+        return None, "Failed to read form data."
+    return _decode_form_message(form)
+
+
+def _decode_form_message(form):
+    if "message" not in form:
+        return None, "No 'message' field in form data."
+    try:
+        return _json_loads(form["message"]), None
+    except ValueError:
+        return None, "Failed to parse form data."
+
+
+_MINIMAL_ACK = b'{"status":"success"}'
+
+
+def _error_response(message, status_code=400):
+    return JSONResponse(
+        content={"status": "error", "message": message}, status_code=status_code
+    )
+
+
+_INSERT_EVENT_SQL = """
+    INSERT INTO webhook_logs (
+        dst_host, dst_port, local_time, local_time_adjusted, logtype, node_id,
+        src_host, src_port, utc_time,
+        logdata_hostname, logdata_path, logdata_useragent, logdata_localversion, logdata_password, logdata_remoteversion, logdata_username, logdata_session
+    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+_UPSERT_SOURCE_SQL = """
+    INSERT INTO source_details (first_seen, last_seen, times_seen, src_host)
+    VALUES (%(seen)s, %(seen)s, 1, %(src_host)s)
+    ON CONFLICT (src_host)
+    DO UPDATE SET
+        last_seen = GREATEST(source_details.last_seen, EXCLUDED.last_seen),
+        times_seen = source_details.times_seen + 1
+    RETURNING (xmax = 0) AS inserted
+"""
+
+
+async def _store_events(app, conn, events):
+    """
+    Insert events and return those that need geo enrichment.
+
+    With INGEST_PIPELINE (the default) each event's INSERT, its source_details
+    upsert and the COMMIT are sent as prepared statements in one pipeline, so
+    a batch costs a single network round trip. Only sources the upsert newly
+    created are returned for enrichment.
+    """
+    aggregator = app.state.aggregator
+    if not app.state.ingest_pipeline:
+        async with conn.cursor() as cur:
+            for event in events:
+                if aggregator is not None and aggregator.mergeable(event):
+                    await cur.execute(_INSERT_EVENT_SQL + " RETURNING id", event.row())
+                    row = await cur.fetchone()
+                    if row:
+                        aggregator.open(event, row[0])
+                else:
+                    await cur.execute(_INSERT_EVENT_SQL, event.row())
+        await conn.commit()
+        return events
+
+    pending = []
+    insert_cur = conn.cursor()
+    async with conn.pipeline():
+        for event in events:
+            event_cur = None
+            if aggregator is not None and aggregator.mergeable(event):
+                event_cur = conn.cursor()
+                await event_cur.execute(
+                    _INSERT_EVENT_SQL + " RETURNING id", event.row(), prepare=True
+                )
+            else:
+                await insert_cur.execute(_INSERT_EVENT_SQL, event.row(), prepare=True)
+            source_cur = None
+            if event.src_host and _is_public_candidate(event.src_host):
+                source_cur = conn.cursor()
+                await source_cur.execute(
+                    _UPSERT_SOURCE_SQL,
+                    {
+                        "seen": event.utc_time or datetime.now(timezone.utc),
+                        "src_host": event.src_host,
+                    },
+                    prepare=True,
+                )
+            pending.append((event, event_cur, source_cur))
+        await conn.commit()
+    await insert_cur.close()
+
+    new_sources = []
+    for event, event_cur, source_cur in pending:
+        if event_cur is not None:
+            row = await event_cur.fetchone()
+            if row:
+                aggregator.open(event, row[0])
+            await event_cur.close()
+        if source_cur is not None:
+            row = await source_cur.fetchone()
+            if row and row[0]:
+                new_sources.append(event)
+                # May be cached as "no such source" by the batch endpoint.
+                _invalidate_source(app, event.src_host)
+            await source_cur.close()
+    return new_sources
+
+
+# Events carrying any of these are always stored individually.
+_FIDELITY_COLUMNS = (
+    "logdata_hostname",
+    "logdata_path",
+    "logdata_useragent",
+    "logdata_password",
+    "logdata_username",
+    "logdata_session",
+)
+_burst_key = operator.attrgetter(
+    "src_host",
+    "dst_host",
+    "dst_port",
+    "logtype",
+    "node_id",
+    "logdata_localversion",
+    "logdata_remoteversion",
+)
+
+
+class _Burst:
+    __slots__ = ("row_id", "src_host", "opened", "count", "last_time")
+
+    def __init__(self, row_id, event, opened):
+        self.row_id = row_id
+        self.src_host = event.src_host
+        self.opened = opened
+        self.count = 1
+        self.last_time = event.utc_time
+
+
+class _IngestAggregator:
+    """
+    Collapses scan floods: the first event of a (src_host, dst_port, logtype,
+    node_id, ...) tuple is stored as usual, identical events arriving within
+    `window` seconds only bump an in-memory counter, and the stored row gets
+    repeat_count / last_utc_time when the window closes.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self._open = {}
+        self._closed = []
+
+    @staticmethod
+    def mergeable(event):
+        return not any(getattr(event, c) for c in _FIDELITY_COLUMNS)
+
+    def merge(self, event):
+        """Count `event` into an open burst. False if it must be stored."""
+        if not self.mergeable(event):
+            return False
+        burst = self._open.get(_burst_key(event))
+        if burst is None or time.monotonic() - burst.opened >= self.window:
+            return False
+        burst.count += 1
+        if event.utc_time is not None:
+            burst.last_time = event.utc_time
+        return True
+
+    def open(self, event, row_id):
+        key = _burst_key(event)
+        burst = self._open.get(key)
+        # A burst whose window closed but was not flushed yet is queued for the
+        # next flush so the new one can take its place.
+        if burst is None or time.monotonic() - burst.opened >= self.window:
+            self._open.pop(key, None)
+            if burst is not None and burst.count > 1:
+                self._closed.append(burst)
+            self._open[key] = _Burst(row_id, event, time.monotonic())
+
+    def drain(self, force=False):
+        """Remove and return bursts whose window has closed."""
+        now = time.monotonic()
+        done = self._closed
+        self._closed = []
+        for key, burst in list(self._open.items()):
+            if force or now - burst.opened >= self.window:
+                del self._open[key]
+                if burst.count > 1:
+                    done.append(burst)
+        return done
+
+    def __len__(self):
+        return len(self._open)
+
+
+_FLUSH_BURSTS_SQL = """
+    UPDATE webhook_logs
+    SET repeat_count = %s, last_utc_time = %s
+    WHERE id = %s
+"""
+
+_FLUSH_BURST_SOURCES_SQL = """
+    UPDATE source_details
+    SET times_seen = times_seen + %s,
+        last_seen = GREATEST(last_seen, %s)
+    WHERE src_host = %s
+"""
+
+
+async def _flush_bursts(app, force=False):
+    aggregator = app.state.aggregator
+    bursts = aggregator.drain(force=force)
+    if not bursts:
+        return
+    try:
+        pool = app.state.db_pool
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.executemany(
+                    _FLUSH_BURSTS_SQL, [(b.count, b.last_time, b.row_id) for b in bursts]
+                )
+                # source_details.times_seen counts events, merged or not.
+                await cur.executemany(
+                    _FLUSH_BURST_SOURCES_SQL,
+                    [
+                        (b.count - 1, b.last_time, b.src_host)
+                        for b in bursts
+                        if b.src_host and _is_public_candidate(b.src_host)
+                    ],
+                )
+            await conn.commit()
+    except Exception as e:
+        logger.error(f"Failed to flush {len(bursts)} aggregated bursts: {e}")
+
+
+async def _aggregate_flusher(app):
+    interval = max(0.5, app.state.aggregator.window / 2)
+    while True:
+        await asyncio.sleep(interval)
+        await _flush_bursts(app)
+
+
+# Hot sources: per-source event counts over a sliding window, kept in a ring
+# of time buckets. Memory is bounded by evicting the least recently active
+# source; idle sources are the first to go.
+class _SourceRate:
+    __slots__ = ("ticks", "counts", "nodes", "ports", "alerted_at")
+
+    def __init__(self, buckets):
+        self.ticks = [-1] * buckets
+        self.counts = [0] * buckets
+        # value -> last tick seen, for distinct counts within the window
+        self.nodes = {}
+        self.ports = {}
+        self.alerted_at = None
+
+
+class _RateTracker:
+    _MAX_DISTINCT = 32
+
+    def __init__(self, window=60, buckets=12, max_sources=20000):
+        self.window = window
+        self.buckets = buckets
+        self.max_sources = max_sources
+        self.bucket_width = window / buckets
+        self.evictions = 0
+        # Events before this are only known from webhook_logs (_rebuild_rates)
+        self.started = time.time()
+        # Alerting: fire hooks when a source reaches `alert_events` in the
+        # window and was seen by `alert_spread` nodes or ports.
+        self.alert_events = None
+        self.alert_spread = 1
+        self.hooks = []
+        self._sources = OrderedDict()
+
+    def __len__(self):
+        return len(self._sources)
+
+    def _tick(self, ts):
+        return int(ts // self.bucket_width)
+
+    def record(self, ip, node_id=None, dst_port=None, ts=None, count=1):
+        tick = self._tick(time.time() if ts is None else ts)
+        state = self._sources.get(ip)
+        if state is None:
+            state = self._sources[ip] = _SourceRate(self.buckets)
+            while len(self._sources) > self.max_sources:
+                self._sources.popitem(last=False)
+                self.evictions += 1
+        else:
+            self._sources.move_to_end(ip)
+        slot = tick % self.buckets
+        if state.ticks[slot] != tick:
+            if state.ticks[slot] > tick:
+                return  # older than the window (rebuild with stale rows)
+            state.ticks[slot] = tick
+            state.counts[slot] = 0
+        state.counts[slot] += count
+        for seen, value in ((state.nodes, node_id), (state.ports, dst_port)):
+            if value is None:
+                continue
+            if value not in seen and len(seen) >= self._MAX_DISTINCT:
+                self._expire(seen, tick)
+                if len(seen) >= self._MAX_DISTINCT:
+                    continue
+            seen[value] = tick
+        if self.alert_events is not None:
+            self._check_alert(ip, state, tick)
+
+    def _expire(self, seen, tick):
+        for value in [v for v, t in seen.items() if t <= tick - self.buckets]:
+            del seen[value]
+
+    def _summary(self, ip, state, tick):
+        oldest = tick - self.buckets
+        events = sum(c for t, c in zip(state.ticks, state.counts) if t > oldest)
+        return {
+            "src_host": ip,
+            "events": events,
+            "per_minute": round(events * 60 / self.window, 2),
+            "nodes": sum(1 for t in state.nodes.values() if t > oldest),
+            "ports": sum(1 for t in state.ports.values() if t > oldest),
+        }
+
+    def _check_alert(self, ip, state, tick):
+        if state.alerted_at is not None and state.alerted_at > tick - self.buckets:
+            return  # at most one alert per source per window
+        summary = self._summary(ip, state, tick)
+        if summary["events"] < self.alert_events:
+            return
+        if max(summary["nodes"], summary["ports"]) < self.alert_spread:
+            return
+        state.alerted_at = tick
+        for hook in self.hooks:
+            try:
+                hook(summary)
+            except Exception as e:
+                logger.warning(f"Hot source alert hook failed: {e}")
+
+    def top(self, limit=20, min_events=1):
+        tick = self._tick(time.time())
+        hot = []
+        for ip, state in self._sources.items():
+            summary = self._summary(ip, state, tick)
+            if summary["events"] >= min_events:
+                hot.append(summary)
+        hot.sort(key=lambda h: (-h["events"], h["src_host"]))
+        return hot[:limit]
+
+
+_RECENT_RATES_SQL = """
+    SELECT src_host, node_id, dst_port, COALESCE(last_utc_time, utc_time), repeat_count
+    FROM webhook_logs
+    WHERE utc_time >= %s AND COALESCE(last_utc_time, utc_time) < %s
+      AND src_host IS NOT NULL AND src_host != ''
+    ORDER BY utc_time
+"""
+
+
+async def _rebuild_rates(app):
+    """Replay the last window of stored events so a restart starts warm."""
+    tracker = app.state.rate_tracker
+    # utc_time is stored as naive UTC
+    since = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=tracker.window)
+    # Anything newer was already recorded live; a burst row still growing
+    # after the start is left out rather than counted twice.
+    until = datetime.fromtimestamp(tracker.started, timezone.utc).replace(tzinfo=None)
+    try:
+        async with _db_connection(app, "read") as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(_RECENT_RATES_SQL, (since, until))
+                rows = await cur.fetchall()
+    except Exception as e:
+        logger.warning(f"Could not rebuild hot source rates: {e}")
+        return
+    alert_events, tracker.alert_events = tracker.alert_events, None
+    for ip, node_id, dst_port, seen, count in rows:
+        ts = seen.replace(tzinfo=timezone.utc).timestamp() if seen else None
+        tracker.record(ip, node_id, dst_port, ts=ts, count=count or 1)
+    tracker.alert_events = alert_events
+    logger.info(f"Rebuilt hot source rates from {len(rows)} recent events")
+
+
+def _build_rate_tracker():
+    window = float(os.getenv("HOT_SOURCE_WINDOW", "60"))
+    if window <= 0:
+        return None
+    tracker = _RateTracker(window, max_sources=int(os.getenv("HOT_SOURCE_MAX", "20000")))
+    if os.getenv("HOT_SOURCE_ALERT_EVENTS"):
+        tracker.alert_events = int(os.getenv("HOT_SOURCE_ALERT_EVENTS"))
+        tracker.alert_spread = int(os.getenv("HOT_SOURCE_ALERT_SPREAD", "1"))
+        tracker.hooks.append(
+            lambda summary: logger.warning(f"Hot source: {json.dumps(summary)}")
+        )
+        url = os.getenv("HOT_SOURCE_ALERT_URL")
+        if url:
+            tracker.hooks.append(lambda summary: _spawn(_post_alert(url, summary)))
+    return tracker
+
+
+async def _post_alert(url, summary):
+    try:
+        async with httpx.AsyncClient(timeout=5) as client:
+            await client.post(url, json={"event": "hot_source", **summary})
+    except Exception as e:
+        logger.warning(f"Hot source alert to {url} failed: {e}")
+
+
+@app.get("/api/hot_sources")
+async def get_hot_sources(request: Request, limit: int = 20, min_events: int = 1):
+    """Sources with the most events in the last HOT_SOURCE_WINDOW seconds."""
+    tracker = request.app.state.rate_tracker
+    if tracker is None:
+        return _error_response("Hot source tracking is disabled.", 404)
+    limit = max(1, min(int(limit), 1000))
+    return JSONResponse(
+        content={
+            "status": "success",
+            "window": tracker.window,
+            "data": tracker.top(limit, max(1, int(min_events))),
+        },
+        status_code=200,
+    )
+
+
+# Columns kept per event in the recent-events ring; enough for a live feed.
+_RECENT_FIELDS = (
+    "utc_time", "src_host", "node_id", "dst_port", "logtype",
+    "logdata_username", "logdata_password",
+)
+_recent_row = operator.attrgetter(*_RECENT_FIELDS)
+
+
+class _RecentEvents:
+    """
+    Fixed-size ring of the last `size` accepted events, stored as tuples in
+    _RECENT_FIELDS order. Per worker: with several workers each one holds
+    the events it received, plus what it seeded from the database.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._slots = [None] * size
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, event):
+        self._slots[self._next] = _recent_row(event)
+        self._next = (self._next + 1) % self.size
+        self._count = min(self._count + 1, self.size)
+
+    def latest(self, limit):
+        """Up to `limit` events, newest first."""
+        limit = min(limit, self._count)
+        return [self._slots[(self._next - 1 - i) % self.size] for i in range(limit)]
+
+    def seed(self, rows):
+        """
+        Put stored rows (newest first) behind anything added since startup.
+        Events that were added and also stored by then appear once.
+        """
+        live = self.latest(self.size)
+        # (utc_time, src_host, node_id, dst_port); a multiset, so identical
+        # events are only dropped as often as they were added.
+        added = Counter(row[:4] for row in live)
+        stored = []
+        for row in rows:
+            row = tuple(row)
+            if added[row[:4]] > 0:
+                added[row[:4]] -= 1
+            else:
+                stored.append(row)
+        rows = (live + stored)[: self.size]
+        self._slots = list(reversed(rows)) + [None] * (self.size - len(rows))
+        self._next = len(rows) % self.size
+        self._count = len(rows)
+
+
+_SEED_RECENT_SQL = f"""
+    SELECT {", ".join(_RECENT_FIELDS)} FROM webhook_logs
+    WHERE utc_time IS NOT NULL
+    ORDER BY utc_time DESC
+    LIMIT %s
+"""
+
+
+async def _seed_recent_events(app):
+    """Fill the ring from the newest stored events (idx_webhook_logs_utc_time)."""
+    recent = app.state.recent_events
+    try:
+        async with _db_connection(app, "read") as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(_SEED_RECENT_SQL, (recent.size,))
+                rows = await cur.fetchall()
+    except Exception as e:
+        logger.warning(f"Could not seed recent events: {e}")
+        return
+    recent.seed(rows)
+
+
+def _remember(app, event):
+    recent = app.state.recent_events
+    if recent is not None:
+        recent.add(event)
+
+
+@app.get("/api/recent")
+async def get_recent(request: Request, limit: int = 50, format: str = "json"):
+    """
+    The most recent events, newest first, served from memory.
+    Response: { status: "success", data: [...] } (or columns/rows).
+    """
+    recent = request.app.state.recent_events
+    if recent is None:
+        return _error_response("Recent events are disabled.", 404)
+    if format not in _RESPONSE_FORMATS:
+        return _error_response("format must be json or columnar")
+    rows = recent.latest(max(1, min(int(limit), recent.size)))
+    return JSONResponse(
+        content={"status": "success", **_rows_content(list(_RECENT_FIELDS), rows, format)},
+        status_code=200,
+    )
+
+
+@app.get("/api/ready")
+async def readiness(request: Request):
+    """Readiness probe: 200 once the pools are warm, 503 while warming or shutting down."""
+    if getattr(request.app.state, "ready", False):
+        return JSONResponse(content={"status": "ready"}, status_code=200)
+    return JSONResponse(content={"status": "warming"}, status_code=503)
+
+
+@app.post("/api/webhook")
+async def webhook(request: Request, background: BackgroundTasks, ack: str | None = None):
+    """
+    Store one OpenCanary event. `ack=minimal` (or WEBHOOK_ACK_MODE=minimal)
+    skips echoing the parsed payload back in the response.
+    """
+    content_type = _content_type(request)
+    if content_type.startswith("multipart/form-data"):
+        try:
+            form = await request.form()
+        except Exception as e:
+            logging.error(f"Failed to parse form data: {e}")
+            return _error_response("Failed to read form data.")
+        data, error = _decode_form_message(form)
+    else:
+        data, error = _decode_webhook_body(content_type, await request.body())
+    if error:
+        logging.error(error)
+        return _error_response(error)
+
+    if not data or not isinstance(data, dict) or data.get("src_host") == "":
+        return _error_response("src_host is not defined.")
+
+    try:
+        event = _parse_event(data)
+    except _InvalidEvent as e:
+        return _error_response(str(e))
+
+    # Our own scanners / monitoring (INGEST_DENY_CIDRS): acknowledge, don't store.
+    if event.src_host and not request.app.state.ip_filter.accepts(event.src_host):
+        return JSONResponse(content={"status": "filtered"}, status_code=200)
+
+    tracker = request.app.state.rate_tracker
+    if tracker is not None and event.src_host:
+        tracker.record(event.src_host, event.node_id, event.dst_port)
+
+    aggregator = request.app.state.aggregator
+    if aggregator is not None and aggregator.merge(event):
+        _remember(request.app, event)
+        return _webhook_ack(ack, data)
+
+    try:
+        async with _db_connection(request.app, "ingest") as conn:
+            new_sources = await _store_events(request.app, conn, [event])
+    except _Overloaded as e:
+        spool = request.app.state.spool
+        if spool is None or not spool.put(event):
+            return _overloaded_response(e)
+        _remember(request.app, event)
+        return JSONResponse(content={"status": "queued"}, status_code=202)
+
+    _remember(request.app, event)
+    for source in new_sources:
+        schedule_geo_lookup(source, background=background, app=request.app)
+    return _webhook_ack(ack, data)
+
+
+def _webhook_ack(ack, data):
+    if (ack or os.getenv("WEBHOOK_ACK_MODE", "full")).lower() == "minimal":
+        return Response(content=_MINIMAL_ACK, media_type="application/json")
+    return JSONResponse(
+        content={"status": "success", "received": data}, status_code=200
+    )
+
+
+# Columns callers may pick with `fields=`. Requested names are only ever
+# checked against these tuples, never interpolated from the request.
+_LOG_FIELDS = (
+    "id", "dst_host", "dst_port", "local_time", "local_time_adjusted", "logtype",
+    "node_id", "src_host", "src_port", "utc_time", "logdata_hostname",
+    "logdata_path", "logdata_useragent", "logdata_localversion",
+    "logdata_password", "logdata_remoteversion", "logdata_username",
+    "logdata_session", "repeat_count", "last_utc_time",
+)
+_LOG_SUMMARY_FIELDS = ("src_host", "last_seen", "times_seen")
+_SOURCE_FIELDS = (
+    "id", "first_seen", "last_seen", "times_seen", "src_host", "src_country",
+    "src_isocountrycode", "src_region", "src_regionname", "src_city", "src_zip",
+    "src_latitude", "src_longitude", "src_timezone", "src_isp", "src_org",
+    "src_asnum", "src_asorg", "src_reversedns", "src_mobile", "src_proxy",
+    "src_hosting", "src_geo_inferred", "src_threat_tags",
+)
+_RESPONSE_FORMATS = ("json", "columnar")
+
+
+def _parse_fields(fields, allowed):
+    """Comma-separated `fields=` value -> list of column names, or None for all."""
+    if not fields:
+        return None
+    requested = list(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    unknown = [f for f in requested if f not in allowed]
+    if unknown or not requested:
+        raise ValueError(f"Unknown fields: {', '.join(unknown) or fields}")
+    return requested
 
 
-@app.post("/api/webhook")
-async def webhook(request: Request, background: BackgroundTasks):
-    data = None
+def _rows_content(columns, rows, fmt):
+    """
+    Default: {"data": [{column: value}, ...]}. Columnar sends the keys once:
+    {"columns": [...], "rows": [[...], ...]}.
+    """
+    if fmt == "columnar":
+        return {"columns": columns, "rows": serialize_datetimes([list(row) for row in rows])}
+    return {"data": serialize_datetimes([dict(zip(columns, row)) for row in rows])}
 
-    # Try JSON parsing first, useful for direct API testing
-    try:
-        body = await request.body()
-        if body:
-            try:
-                data = await request.json()
-            except Exception:
-                pass
-    except Exception:
-        pass
-
-    # If not JSON, try as form, how OpenCanary sends the data
-    if data is None:
-        try:
-            form = await request.form()
-            if "message" in form:
-                try:
-                    data = json.loads(form["message"])
-                except Exception as e:
-                    logging.error(f"Failed to parse form data: {e}")
-                    return JSONResponse(
-                        content={
-                            "status": "error",
-                            "message": f"Failed to parse form data.",
-                        },
-                        status_code=400,
-                    )
-            else:
-                return JSONResponse(
-                    content={
-                        "status": "error",
-                        "message": "No 'message' field in form data.",
-                    },
-                    status_code=400,
-                )
-        except Exception as e:
-            logging.error(f"Failed to parse form data: {e}")
-            return JSONResponse(
-                content={
-                    "status": "error",
-                    "message": f"Failed to read form data.",
-                },
-                status_code=400,
-            )
 
-    if not data or data.get("src_host") == "":
-        return JSONResponse(
-            content={"status": "error", "message": "src_host is not defined."},
-            status_code=400,
+# The source list, newest activity first: one row per src_host with its
+# latest event time and event count, optionally within one node. Read from
+# source_rollups / source_node_rollups, kept current by statement-level
+# triggers on webhook_logs (infra/migrations/0004_source_rollups.sql). That
+# migration is manual; until it is applied the list is aggregated from
+# webhook_logs, in the same order.
+_SOURCE_ROLLUP_TABLES = {False: "source_rollups", True: "source_node_rollups"}
+_SOURCE_ORDER = "ORDER BY last_seen DESC NULLS LAST, src_host"
+
+
+def _source_list_sql(node, rollups=True):
+    """
+    (count, page) statements. The page takes LIMIT and OFFSET parameters;
+    `node` adds a node_id = %s parameter before them.
+    """
+    if rollups:
+        table = _SOURCE_ROLLUP_TABLES[bool(node)]
+        where = " WHERE node_id = %s" if node else ""
+        return (
+            f"SELECT COUNT(*) FROM {table}{where}",
+            f"""
+                SELECT src_host, last_seen, events AS times_seen
+                FROM {table}{where}
+                {_SOURCE_ORDER}
+                LIMIT %s OFFSET %s""",
         )
+    where = "WHERE src_host IS NOT NULL AND src_host != ''" + (" AND node_id = %s" if node else "")
+    return (
+        f"SELECT COUNT(DISTINCT src_host) FROM webhook_logs {where}",
+        f"""
+                SELECT src_host, MAX(COALESCE(last_utc_time, utc_time)) AS last_seen, SUM(repeat_count) AS times_seen
+                FROM webhook_logs
+                {where}
+                GROUP BY src_host
+                {_SOURCE_ORDER}
+                LIMIT %s OFFSET %s""",
+    )
 
-    pool = request.app.state.db_pool
-    async with pool.connection() as conn:
-        async with conn.cursor() as cur:
-            logdata = data.get("logdata", {}) or {}
-            await cur.execute(
-                """
-                INSERT INTO webhook_logs (
-                    dst_host, dst_port, local_time, local_time_adjusted, logtype, node_id,
-                    src_host, src_port, utc_time,
-                    logdata_hostname, logdata_path, logdata_useragent, logdata_localversion, logdata_password, logdata_remoteversion, logdata_username, logdata_session
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """,
-                (
-                    data.get("dst_host"),
-                    data.get("dst_port"),
-                    data.get("local_time"),
-                    data.get("local_time_adjusted"),
-                    data.get("logtype"),
-                    data.get("node_id"),
-                    data.get("src_host"),
-                    data.get("src_port"),
-                    data.get("utc_time"),
-                    logdata.get("HOSTNAME"),
-                    logdata.get("PATH"),
-                    logdata.get("USERAGENT"),
-                    logdata.get("LOCALVERSION"),
-                    logdata.get("PASSWORD"),
-                    logdata.get("REMOTEVERSION"),
-                    logdata.get("USERNAME"),
-                    logdata.get("SESSION"),
-                ),
-            )
-        await conn.commit()
 
-    schedule_geo_lookup(data, background=background, app=request.app)
+async def _count_sources(cur, node_id=None):
+    params = (node_id,) if node_id else ()
+    try:
+        await _execute(cur, _source_list_sql(node_id)[0], params)
+    except psycopg.errors.UndefinedTable:
+        # source_rollups only exists once migration 0004 has been applied
+        await cur.connection.rollback()
+        await _execute(cur, _source_list_sql(node_id, rollups=False)[0], params)
+    with _phase("fetch"):
+        row = await cur.fetchone()
+    return row[0] if row else 0
 
-    return JSONResponse(
-        content={"status": "success", "received": data}, status_code=200
-    )
+
+async def _source_page(cur, node_id, limit, offset):
+    """One page of the source list: (columns, rows)."""
+    params = ((node_id,) if node_id else ()) + (limit, offset)
+    try:
+        await _execute(cur, _source_list_sql(node_id)[1], params)
+    except psycopg.errors.UndefinedTable:
+        await cur.connection.rollback()
+        await _execute(cur, _source_list_sql(node_id, rollups=False)[1], params)
+    with _phase("fetch"):
+        rows = await cur.fetchall()
+        columns = [desc[0] for desc in cur.description]
+    return columns, rows
 
 
 @app.get("/api/logs")
 async def get_logs(
-    request: Request, page: int = 1, per_page: int = 10, src: str | None = None
+    request: Request,
+    page: int = 1,
+    per_page: int = 10,
+    src: str | None = None,
+    fields: str | None = None,
+    format: str = "json",
+    node_id: str | None = None,
 ):
     """
     If `src` is provided: return logs for that src_host (most recent first).
     Otherwise: return paginated list of distinct src_host with last_seen and count.
+    `node_id` restricts either form to one honeypot node.
+    `fields` limits the columns returned; `format=columnar` returns
+    columns/rows instead of data.
     Response:
       { status: "success", data: [...], total: <int>, page: <int>, per_page: <int> }
     """
+    if format not in _RESPONSE_FORMATS:
+        return _error_response("format must be json or columnar")
+    try:
+        fields = _parse_fields(fields, _LOG_FIELDS if src else _LOG_SUMMARY_FIELDS)
+    except ValueError as e:
+        return _error_response(str(e))
     try:
         per_page = max(1, min(int(per_page), 1000))
         page = max(1, int(page))
-        pool = request.app.state.db_pool
-        async with pool.connection() as conn:
+        node_filter = " AND node_id = %s" if node_id else ""
+        node_params = (node_id,) if node_id else ()
+        async with _db_connection(request.app, "read") as conn:
             async with conn.cursor() as cur:
                 if src:
                     # Return logs for a single source (most recent first)
-                    await cur.execute(
-                        """
-                        SELECT * FROM webhook_logs
-                        WHERE src_host = %s
+                    await _execute(
+                        cur,
+                        f"""
+                        SELECT {", ".join(fields) if fields else "*"} FROM webhook_logs
+                        WHERE src_host = %s{node_filter}
                         ORDER BY utc_time DESC NULLS LAST
                     """,
-                        (src,),
+                        (src, *node_params),
                     )
-                    rows = await cur.fetchall()
-                    columns = [desc[0] for desc in cur.description]
-                    data = [dict(zip(columns, row)) for row in rows]
-                    data = serialize_datetimes(data)
+                    with _phase("fetch"):
+                        rows = await cur.fetchall()
+                        columns = [desc[0] for desc in cur.description]
+                    with _phase("serialize"):
+                        content = _rows_content(columns, rows, format)
+                    with _phase("encode"):
+                        return JSONResponse(
+                            content={"status": "success", **content}, status_code=200
+                        )
+
+                # One row per src_host: latest event time and count
+                total = await _count_sources(cur, node_id)
+                columns, rows = await _source_page(cur, node_id, per_page, (page - 1) * per_page)
+                if fields:
+                    picks = [columns.index(f) for f in fields]
+                    columns = fields
+                    rows = [[row[i] for i in picks] for row in rows]
+                with _phase("serialize"):
+                    content = _rows_content(columns, rows, format)
+                with _phase("encode"):
                     return JSONResponse(
-                        content={"status": "success", "data": data}, status_code=200
+                        content={
+                            "status": "success",
+                            **content,
+                            "total": total,
+                            "page": page,
+                            "per_page": per_page,
+                        },
+                        status_code=200,
                     )
-
-                # Total distinct sources
-                await cur.execute(
-                    "SELECT COUNT(DISTINCT src_host) FROM webhook_logs WHERE src_host IS NOT NULL AND src_host != ''"
-                )
-                total_row = await cur.fetchone()
-                total = total_row[0] if total_row else 0
-
-                offset = (page - 1) * per_page
-                # Return one row per src_host: latest utc_time and count
-                await cur.execute(
-                    """
-                    SELECT src_host, MAX(utc_time) AS last_seen, COUNT(*) AS times_seen
-                    FROM webhook_logs
-                    WHERE src_host IS NOT NULL AND src_host != ''
-                    GROUP BY src_host
-                    ORDER BY last_seen DESC NULLS LAST
-                    LIMIT %s OFFSET %s
-                """,
-                    (per_page, offset),
-                )
-                rows = await cur.fetchall()
-                columns = [desc[0] for desc in cur.description]
-                data = [dict(zip(columns, row)) for row in rows]
-                data = serialize_datetimes(data)
-                return JSONResponse(
-                    content={
-                        "status": "success",
-                        "data": data,
-                        "total": total,
-                        "page": page,
-                        "per_page": per_page,
-                    },
-                    status_code=200,
-                )
+    except _Overloaded as e:
+        return _overloaded_response(e)
     except Exception as e:
         logger.error(f"Failed to retrieve logs: {e}")
         return JSONResponse(
@@ -451,22 +2382,74 @@ async def get_logs(
         )
 
 
+# source_details rows, serialized; None means "no such source". Geo writes and
+# newly created sources invalidate their entry; counters (times_seen,
+# last_seen) and writes from other processes may lag by up to the TTL.
+def _invalidate_source(app, ip):
+    cache = getattr(app.state, "source_cache", None)
+    if cache is not None:
+        cache.invalidate(ip)
+
+
+async def _load_sources(app, ips):
+    """source_details rows (serialized, or None if unknown) for `ips`, read through the cache."""
+    cache = app.state.source_cache
+    if cache is None:
+        found, missing = {}, list(ips)
+    else:
+        found, missing = cache.get_many(ips)
+    if not missing:
+        return found
+    async with _db_connection(app, "read") as conn:
+        async with conn.cursor() as cur:
+            await _execute(
+                cur, "SELECT * FROM source_details WHERE src_host = ANY(%s)", (missing,)
+            )
+            with _phase("fetch"):
+                rows = await cur.fetchall()
+                columns = [desc[0] for desc in cur.description]
+    loaded = dict.fromkeys(missing)
+    for row in rows:
+        record = serialize_datetimes(dict(zip(columns, row)))
+        loaded[record["src_host"]] = record
+    if cache is not None:
+        for ip, record in loaded.items():
+            cache.put(ip, record)
+    found.update(loaded)
+    return found
+
+
+@app.get("/api/admin/enrichment")
+async def get_enrichment_stats(request: Request):
+    if not _is_admin(request):
+        return _admin_forbidden()
+    data = request.app.state.enrichment.stats()
+    return JSONResponse(content={"status": "success", "data": data}, status_code=200)
+
+
+@app.get("/api/admin/cache")
+async def get_cache_stats(request: Request):
+    if not _is_admin(request):
+        return _admin_forbidden()
+    cache = request.app.state.source_cache
+    data = {
+        "source_details": cache.stats() if cache is not None else None,
+        "geo_prefix": _GEO_PREFIX_CACHE.stats() if _GEO_PREFIX_CACHE is not None else None,
+        "dashboard_stats": request.app.state.stats_cache.stats(),
+    }
+    return JSONResponse(content={"status": "success", "data": data}, status_code=200)
+
+
 @app.get("/api/source_details/{src_host}")
 async def get_source_details(src_host: str, request: Request):
     try:
-        pool = request.app.state.db_pool
-        async with pool.connection() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(
-                    "SELECT * FROM source_details WHERE src_host = %s", (src_host,)
-                )
-                rows = await cur.fetchall()
-                columns = [desc[0] for desc in cur.description]
-                data = [dict(zip(columns, row)) for row in rows]
-                data = serialize_datetimes(data)
-                return JSONResponse(
-                    content={"status": "success", "data": data}, status_code=200
-                )
+        row = (await _load_sources(request.app, [src_host]))[src_host]
+        data = [row] if row is not None else []
+        return JSONResponse(
+            content={"status": "success", "data": data}, status_code=200
+        )
+    except _Overloaded as e:
+        return _overloaded_response(e)
     except Exception as e:
         logger.error(f"Failed to retrieve source details for {src_host}: {e}")
         return JSONResponse(
@@ -476,7 +2459,20 @@ async def get_source_details(src_host: str, request: Request):
 
 
 @app.post("/api/source_details/batch")
-async def get_source_details_batch(request: Request):
+async def get_source_details_batch(
+    request: Request, fields: str | None = None, format: str = "json"
+):
+    """
+    Country codes for a list of ips: {"data": {ip: iso_code}}. With `fields`,
+    {"data": {ip: {field: value}}}; `format=columnar` returns columns/rows
+    with src_host first. Unknown ips are omitted.
+    """
+    if format not in _RESPONSE_FORMATS:
+        return _error_response("format must be json or columnar")
+    try:
+        fields = _parse_fields(fields, _SOURCE_FIELDS)
+    except ValueError as e:
+        return _error_response(str(e))
     try:
         data = await request.json()
         ips = data.get("ips", [])
@@ -485,19 +2481,28 @@ async def get_source_details_batch(request: Request):
                 content={"status": "error", "message": "ips is required"},
                 status_code=400,
             )
+        if not isinstance(ips, list) or not all(isinstance(ip, str) for ip in ips):
+            return _error_response("ips must be a list of strings")
+        ips = list(dict.fromkeys(ips))
+        batch_max = int(os.getenv("SOURCE_BATCH_MAX", "500"))
+        if len(ips) > batch_max:
+            return _error_response(f"At most {batch_max} ips per request", 413)
 
-        pool = request.app.state.db_pool
-        async with pool.connection() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(
-                    "SELECT src_host, src_isocountrycode FROM source_details WHERE src_host = ANY(%s)",
-                    (ips,),
-                )
-                rows = await cur.fetchall()
-                result = {row[0]: row[1] for row in rows}
-                return JSONResponse(
-                    content={"status": "success", "data": result}, status_code=200
-                )
+        rows = await _load_sources(request.app, ips)
+        rows = {ip: row for ip, row in rows.items() if row is not None}
+        if format == "columnar":
+            columns = ["src_host"] + [f for f in fields or ["src_isocountrycode"] if f != "src_host"]
+            content = {
+                "columns": columns,
+                "rows": [[row.get(c) for c in columns] for row in rows.values()],
+            }
+        elif fields:
+            content = {"data": {ip: {f: row.get(f) for f in fields} for ip, row in rows.items()}}
+        else:
+            content = {"data": {ip: row["src_isocountrycode"] for ip, row in rows.items()}}
+        return JSONResponse(content={"status": "success", **content}, status_code=200)
+    except _Overloaded as e:
+        return _overloaded_response(e)
     except Exception as e:
         logger.error(f"Failed to retrieve source details for batch: {e}")
         return JSONResponse(
@@ -506,108 +2511,638 @@ async def get_source_details_batch(request: Request):
         )
 
 
+# Second stats statement: top username, password and node. top_node reads
+# node_rollups when it exists and otherwise sums webhook_logs directly.
+_STATS_CREDENTIALS_TEMPLATE = """
+    WITH
+    top_username AS (
+        SELECT logdata_username AS value, COUNT(*) AS cnt
+        FROM webhook_logs
+        WHERE logdata_username IS NOT NULL
+          AND TRIM(logdata_username) != ''
+        GROUP BY logdata_username
+        ORDER BY cnt DESC, value ASC
+        LIMIT 1
+    ),
+    top_password AS (
+        SELECT logdata_password AS value, COUNT(*) AS cnt
+        FROM webhook_logs
+        WHERE logdata_password IS NOT NULL
+          AND TRIM(logdata_password) != ''
+        GROUP BY logdata_password
+        ORDER BY cnt DESC, value ASC
+        LIMIT 1
+    ),
+    top_node AS ({top_node}
+        ORDER BY cnt DESC, value ASC
+        LIMIT 1
+    )
+    SELECT
+        (SELECT value FROM top_username) AS top_username,
+        (SELECT value FROM top_password) AS top_password,
+        (SELECT value FROM top_node) AS top_node
+"""
+_STATS_CREDENTIALS_SQL = _STATS_CREDENTIALS_TEMPLATE.format(top_node="""
+        SELECT node_id AS value, SUM(events) AS cnt
+        FROM node_rollups
+        GROUP BY node_id""")
+_STATS_CREDENTIALS_FALLBACK_SQL = _STATS_CREDENTIALS_TEMPLATE.format(top_node="""
+        SELECT node_id AS value, SUM(repeat_count) AS cnt
+        FROM webhook_logs
+        WHERE node_id IS NOT NULL AND node_id != ''
+        GROUP BY node_id""")
+
+
+async def _query_stats(cur):
+    """Top values and the distinct source count shown in the stats bar."""
+    await _execute(cur, """
+                    WITH
+                    top_src_host AS (
+                        SELECT src_host AS value
+                        FROM source_details
+                        WHERE src_host IS NOT NULL AND src_host != ''
+                        ORDER BY times_seen DESC NULLS LAST, src_host ASC
+                        LIMIT 1
+                    ),
+                    top_asnum AS (
+                        SELECT value FROM source_breakdowns
+                        WHERE dimension = 'asn'
+                        ORDER BY events DESC, value ASC
+                        LIMIT 1
+                    ),
+                    top_isp AS (
+                        SELECT value FROM source_breakdowns
+                        WHERE dimension = 'isp'
+                        ORDER BY events DESC, value ASC
+                        LIMIT 1
+                    ),
+                    top_country AS (
+                        SELECT value FROM source_breakdowns
+                        WHERE dimension = 'country'
+                        ORDER BY events DESC, value ASC
+                        LIMIT 1
+                    )
+                    SELECT
+                        (SELECT value FROM top_src_host) AS top_src,
+                        (SELECT value FROM top_asnum) AS top_as,
+                        (SELECT value FROM top_isp) AS top_isp,
+                        (SELECT value FROM top_country) AS top_country
+                    """)
+    with _phase("fetch"):
+        row = await cur.fetchone()
+    if row:
+        columns = [desc[0] for desc in cur.description]
+        top_stats = dict(zip(columns, row))
+    else:
+        top_stats = {}
+
+    top_stats["total_unique_srcs"] = await _count_sources(cur)
+
+    try:
+        await _execute(cur, _STATS_CREDENTIALS_SQL)
+    except psycopg.errors.UndefinedTable:
+        # node_rollups only exists once migration 0002 has been applied
+        # (tools/migrate.py); until then, count nodes from webhook_logs.
+        await cur.connection.rollback()
+        await _execute(cur, _STATS_CREDENTIALS_FALLBACK_SQL)
+    with _phase("fetch"):
+        row = await cur.fetchone()
+    if row:
+        columns = [desc[0] for desc in cur.description]
+        row_dict = dict(zip(columns, row))
+        top_stats.update(row_dict)
+    return top_stats
+
+
 @app.get("/api/stats")
 async def get_stats(request: Request):
     try:
-        pool = request.app.state.db_pool
-        async with pool.connection() as conn:
+        async with _db_connection(request.app, "read") as conn:
             async with conn.cursor() as cur:
-                await cur.execute("""
-                                WITH
-                                top_src_host AS (
-                                    SELECT src_host AS value, SUM(times_seen) AS cnt
-                                    FROM source_details
-                                    WHERE src_host IS NOT NULL AND src_host != ''
-                                    GROUP BY src_host
-                                    ORDER BY cnt DESC, value ASC
-                                    LIMIT 1
-                                ),
-                                top_asnum AS (
-                                    SELECT src_asnum::text AS value, SUM(times_seen) AS cnt
-                                    FROM source_details
-                                    WHERE src_asnum IS NOT NULL
-                                    GROUP BY src_asnum
-                                    ORDER BY cnt DESC, value ASC
-                                    LIMIT 1
-                                ),
-                                top_isp AS (
-                                    SELECT src_isp AS value, SUM(times_seen) AS cnt
-                                    FROM source_details
-                                    WHERE src_isp IS NOT NULL AND src_isp != ''
-                                    GROUP BY src_isp
-                                    ORDER BY cnt DESC, value ASC
-                                    LIMIT 1
-                                ),
-                                top_country AS (
-                                    SELECT src_country AS value, SUM(times_seen) AS cnt
-                                    FROM source_details
-                                    WHERE src_country IS NOT NULL AND src_country != ''
-                                    GROUP BY src_country
-                                    ORDER BY cnt DESC, value ASC
-                                    LIMIT 1
-                                )
-                                SELECT
-                                    (SELECT value FROM top_src_host) AS top_src,
-                                    (SELECT value FROM top_asnum) AS top_as,
-                                    (SELECT value FROM top_isp) AS top_isp,
-                                    (SELECT value FROM top_country) AS top_country
-                                """)
-                row = await cur.fetchone()
-                if row:
-                    columns = [desc[0] for desc in cur.description]
-                    top_stats = dict(zip(columns, row))
+                top_stats = await _query_stats(cur)
+                with _phase("encode"):
+                    return JSONResponse(content=top_stats, status_code=200)
+    except _Overloaded as e:
+        return _overloaded_response(e)
+    except Exception as e:
+        logger.error(f"Failed to retrieve stats: {e}")
+        return JSONResponse(content={"status": "error", "message": "Failed to retrieve stats"}, status_code=500)
+
+
+# One page of the source list with country codes joined in: everything the
+# list renders, in one statement, with the total from the same snapshot.
+_DASHBOARD_PAGE_TEMPLATE = """
+    WITH page AS ({page}
+    )
+    SELECT p.src_host, p.last_seen, p.times_seen, d.src_isocountrycode AS country,
+           ({count}) AS total
+    FROM page p
+    LEFT JOIN source_details d ON d.src_host = p.src_host
+    ORDER BY p.last_seen DESC NULLS LAST, p.src_host
+"""
+
+
+def _dashboard_page_sql(rollups):
+    count, page = _source_list_sql(None, rollups)
+    return _DASHBOARD_PAGE_TEMPLATE.format(page=page, count=count)
+
+
+_DASHBOARD_PAGE_SQL = _dashboard_page_sql(True)
+_DASHBOARD_PAGE_FALLBACK_SQL = _dashboard_page_sql(False)
+
+
+@app.get("/api/dashboard")
+async def get_dashboard(request: Request, page: int = 1, per_page: int = 10):
+    """
+    Everything the landing page renders, from one pooled connection: a page
+    of sources with their country codes and the total source count, plus
+    the stats bar, cached for DASHBOARD_STATS_TTL seconds and refreshed by
+    one request at a time.
+    Response:
+      { status: "success", data: [{src_host, last_seen, times_seen, country}, ...],
+        total: <int>, page: <int>, per_page: <int>, stats: {...} }
+    """
+    per_page = max(1, min(int(per_page), 1000))
+    page = max(1, int(page))
+    cache = request.app.state.stats_cache
+    try:
+        async with _db_connection(request.app, "read") as conn:
+            async with conn.cursor() as cur:
+                params = (per_page, (page - 1) * per_page)
+                try:
+                    await _execute(cur, _DASHBOARD_PAGE_SQL, params)
+                except psycopg.errors.UndefinedTable:
+                    # source_rollups only exists once migration 0004 has been applied
+                    await cur.connection.rollback()
+                    await _execute(cur, _DASHBOARD_PAGE_FALLBACK_SQL, params)
+                with _phase("fetch"):
+                    rows = await cur.fetchall()
+                    columns = [desc[0] for desc in cur.description][:-1]
+                if rows:
+                    total = rows[0][-1]
+                    rows = [row[:-1] for row in rows]
+                elif page == 1:
+                    total = 0
                 else:
-                    top_stats = {}
-                
-                await cur.execute(
-                    "SELECT COUNT(DISTINCT src_host) FROM webhook_logs WHERE src_host IS NOT NULL AND src_host != ''"
+                    # Past the last page: no rows to carry the count
+                    total = await _count_sources(cur)
+
+                async def refresh_stats():
+                    fresh = await _query_stats(cur)
+                    cache.put("stats", fresh)
+                    return fresh
+
+                found, _ = cache.get_many(("stats",))
+                stats = found.get("stats")
+                if stats is None:
+                    # Requests arriving while the stats are being recomputed
+                    # wait for that result instead of running the queries too.
+                    stats = await request.app.state.stats_flights.do("stats", refresh_stats)
+        with _phase("serialize"):
+            content = _rows_content(columns, rows, "json")
+        with _phase("encode"):
+            return JSONResponse(
+                content={
+                    "status": "success",
+                    **content,
+                    "total": total,
+                    "page": page,
+                    "per_page": per_page,
+                    "stats": stats,
+                },
+                status_code=200,
+            )
+    except _Overloaded as e:
+        return _overloaded_response(e)
+    except Exception as e:
+        logger.error(f"Failed to retrieve dashboard: {e}")
+        return JSONResponse(
+            content={"status": "error", "message": "Failed to retrieve dashboard"}, status_code=500
+        )
+
+
+# Ranked breakdowns, precomputed in source_breakdowns by a trigger on
+# source_details. `label` is the AS organisation or ISO country code.
+_BREAKDOWN_DIMENSIONS = ("asn", "isp", "country")
+_BREAKDOWN_ORDER = {
+    "events": "events DESC, value ASC",
+    "sources": "sources DESC, value ASC",
+}
+
+
+@app.get("/api/breakdown/{dimension}")
+async def get_breakdown(
+    dimension: str,
+    request: Request,
+    page: int = 1,
+    per_page: int = 100,
+    sort: str = "events",
+):
+    """
+    Ranked sources/events per ASN, ISP or country.
+    Response:
+      { status: "success", data: [{value, label, sources, events}, ...],
+        total: <int>, page: <int>, per_page: <int> }
+    """
+    if dimension not in _BREAKDOWN_DIMENSIONS:
+        return _error_response(
+            f"dimension must be one of {', '.join(_BREAKDOWN_DIMENSIONS)}", 404
+        )
+    if sort not in _BREAKDOWN_ORDER:
+        return _error_response("sort must be events or sources")
+    per_page = max(1, min(int(per_page), 1000))
+    page = max(1, int(page))
+    try:
+        async with _db_connection(request.app, "read") as conn:
+            async with conn.cursor() as cur:
+                await _execute(
+                    cur,
+                    "SELECT COUNT(*) FROM source_breakdowns WHERE dimension = %s AND sources > 0",
+                    (dimension,),
+                )
+                with _phase("fetch"):
+                    total_row = await cur.fetchone()
+                await _execute(
+                    cur,
+                    f"""
+                    SELECT value, label, sources, events
+                    FROM source_breakdowns
+                    WHERE dimension = %s AND sources > 0
+                    ORDER BY {_BREAKDOWN_ORDER[sort]}
+                    LIMIT %s OFFSET %s
+                """,
+                    (dimension, per_page, (page - 1) * per_page),
                 )
-                unique_src_count_row = await cur.fetchone()
-                top_stats["total_unique_srcs"] = unique_src_count_row[0] if unique_src_count_row else 0
-
-                await cur.execute("""
-                            WITH
-                            top_username AS (
-                                SELECT logdata_username AS value, COUNT(*) AS cnt
-                                FROM webhook_logs
-                                WHERE logdata_username IS NOT NULL
-                                  AND TRIM(logdata_username) != ''
-                                GROUP BY logdata_username
-                                ORDER BY cnt DESC, value ASC
-                                LIMIT 1
-                            ),
-                             top_password AS (
-                                SELECT logdata_password AS value, COUNT(*) AS cnt
-                                FROM webhook_logs
-                                WHERE logdata_password IS NOT NULL
-                                  AND TRIM(logdata_password) != ''
-                                GROUP BY logdata_password
-                                ORDER BY cnt DESC, value ASC
-                                LIMIT 1
-                            ),
-                             top_node AS (
-                                 SELECT node_id AS value, COUNT(*) AS cnt
-                                 FROM webhook_logs
-                                 WHERE node_id IS NOT NULL AND node_id != ''
-                                 GROUP BY node_id
-                                 ORDER BY cnt DESC, value ASC
-                                 LIMIT 1
-                             )
-                             SELECT
-                                 (SELECT value FROM top_username) AS top_username,
-                                 (SELECT value FROM top_password) AS top_password,
-                                 (SELECT value FROM top_node) AS top_node
-                            """)
-                row = await cur.fetchone()
-                if row:
+                with _phase("fetch"):
+                    rows = await cur.fetchall()
                     columns = [desc[0] for desc in cur.description]
-                    row_dict = dict(zip(columns, row))
-                    top_stats.update(row_dict)
+                    data = [dict(zip(columns, row)) for row in rows]
+        with _phase("encode"):
+            return JSONResponse(
+                content={
+                    "status": "success",
+                    "data": data,
+                    "total": total_row[0] if total_row else 0,
+                    "page": page,
+                    "per_page": per_page,
+                },
+                status_code=200,
+            )
+    except _Overloaded as e:
+        return _overloaded_response(e)
+    except Exception as e:
+        logger.error(f"Failed to retrieve breakdown: {e}")
+        return JSONResponse(
+            content={"status": "error", "message": "Failed to retrieve breakdown"},
+            status_code=500,
+        )
+
+
+# Per-node activity, precomputed in hourly buckets by statement-level
+# triggers on webhook_logs (infra/migrations/0002_node_rollups.sql).
+_NODE_TOP_KEYS = {"port": "top_ports", "logtype": "top_logtypes", "src": "top_sources"}
+_NODE_ROLLUPS_MISSING = "Node rollups are not set up yet; apply migration 0002 with tools/migrate.py."
+
+
+def _node_window(hours):
+    """First bucket to include for the last `hours` hours; 0 means all time."""
+    if hours <= 0:
+        return datetime(1970, 1, 1)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return (now - timedelta(hours=hours)).replace(minute=0, second=0, microsecond=0)
+
 
-                return JSONResponse(content=top_stats, status_code=200)
+@app.get("/api/nodes")
+async def get_nodes(request: Request, hours: int = 24):
+    """
+    Every node with activity in the last `hours` hours (0 = all time).
+    Response:
+      { status: "success", data: [{node_id, events, sources, last_seen}, ...] }
+    """
+    since = _node_window(int(hours))
+    try:
+        async with _db_connection(request.app, "read") as conn:
+            async with conn.cursor() as cur:
+                await _execute(
+                    cur,
+                    """
+                    SELECT r.node_id, SUM(r.events)::bigint AS events,
+                        (SELECT COUNT(DISTINCT v.value) FROM node_rollup_values v
+                         WHERE v.node_id = r.node_id AND v.dimension = 'src'
+                           AND v.bucket >= %(since)s) AS sources,
+                        MAX(r.last_seen) AS last_seen
+                    FROM node_rollups r
+                    WHERE r.bucket >= %(since)s
+                    GROUP BY r.node_id
+                    ORDER BY events DESC, r.node_id ASC
+                """,
+                    {"since": since},
+                )
+                with _phase("fetch"):
+                    rows = await cur.fetchall()
+                    columns = [desc[0] for desc in cur.description]
+        with _phase("serialize"):
+            content = _rows_content(columns, rows, "json")
+        with _phase("encode"):
+            return JSONResponse(content={"status": "success", **content}, status_code=200)
+    except _Overloaded as e:
+        return _overloaded_response(e)
+    except psycopg.errors.UndefinedTable:
+        return _error_response(_NODE_ROLLUPS_MISSING, 503)
     except Exception as e:
-        logger.error(f"Failed to retrieve stats: {e}")
-        return JSONResponse(content={"status": "error", "message": "Failed to retrieve stats"}, status_code=500)
+        logger.error(f"Failed to retrieve nodes: {e}")
+        return JSONResponse(content={"status": "error", "message": "Failed to retrieve nodes"}, status_code=500)
+
+
+@app.get("/api/nodes/{node_id}/stats")
+async def get_node_stats(node_id: str, request: Request, hours: int = 24, top: int = 10):
+    """
+    One node's activity in the last `hours` hours (0 = all time).
+    Response:
+      { status: "success", node_id, events, sources, last_seen,
+        series: [[bucket, events], ...],
+        top_ports / top_logtypes / top_sources: [{value, events}, ...] }
+    """
+    since = _node_window(int(hours))
+    top = max(1, min(int(top), 100))
+    try:
+        async with _db_connection(request.app, "read") as conn:
+            async with conn.cursor() as cur:
+                await _execute(
+                    cur,
+                    """
+                    SELECT bucket, events, last_seen FROM node_rollups
+                    WHERE node_id = %s AND bucket >= %s
+                    ORDER BY bucket
+                """,
+                    (node_id, since),
+                )
+                with _phase("fetch"):
+                    series = await cur.fetchall()
+                if not series:
+                    return _error_response("No activity for this node.", 404)
+                # Ranked values per dimension; the partition size is the
+                # number of distinct values, i.e. unique sources for 'src'.
+                await _execute(
+                    cur,
+                    """
+                    SELECT dimension, value, events, distinct_values FROM (
+                        SELECT dimension, value, SUM(events)::bigint AS events,
+                            ROW_NUMBER() OVER (
+                                PARTITION BY dimension ORDER BY SUM(events) DESC, value ASC
+                            ) AS rank,
+                            COUNT(*) OVER (PARTITION BY dimension) AS distinct_values
+                        FROM node_rollup_values
+                        WHERE node_id = %s AND bucket >= %s
+                        GROUP BY dimension, value
+                    ) ranked
+                    WHERE rank <= %s
+                    ORDER BY dimension, rank
+                """,
+                    (node_id, since, top),
+                )
+                with _phase("fetch"):
+                    ranked = await cur.fetchall()
+        with _phase("serialize"):
+            content = {
+                "status": "success",
+                "node_id": node_id,
+                "events": sum(events for _, events, _ in series),
+                "sources": 0,
+                "last_seen": max((seen for _, _, seen in series if seen), default=None),
+                "series": [[bucket, events] for bucket, events, _ in series],
+                **{key: [] for key in _NODE_TOP_KEYS.values()},
+            }
+            for dimension, value, events, distinct_values in ranked:
+                if dimension not in _NODE_TOP_KEYS:
+                    continue
+                if dimension == "src":
+                    content["sources"] = distinct_values
+                else:
+                    value = int(value)
+                content[_NODE_TOP_KEYS[dimension]].append({"value": value, "events": events})
+            content = serialize_datetimes(content)
+        with _phase("encode"):
+            return JSONResponse(content=content, status_code=200)
+    except _Overloaded as e:
+        return _overloaded_response(e)
+    except psycopg.errors.UndefinedTable:
+        return _error_response(_NODE_ROLLUPS_MISSING, 503)
+    except Exception as e:
+        logger.error(f"Failed to retrieve node stats: {e}")
+        return JSONResponse(
+            content={"status": "error", "message": "Failed to retrieve node stats"}, status_code=500
+        )
+
+
+# Attack map cells, precomputed in source_geo_cells by a trigger on
+# source_details. Must match the sizes in infra/initdb/init.sql.
+_MAP_CELL_SIZES = (10, 2, 0.5, 0.1)
+_MAP_CELLS_ACROSS = 16
+
+
+def _map_resolution(zoom):
+    """Coarsest grid with at least ~16 cells across the map at this zoom level."""
+    target = 360 / 2 ** max(0, zoom) / _MAP_CELLS_ACROSS
+    for resolution, size in enumerate(_MAP_CELL_SIZES):
+        if size <= target:
+            return resolution
+    return len(_MAP_CELL_SIZES) - 1
+
+
+def _parse_bbox(bbox):
+    """"west,south,east,north" in degrees; west > east crosses the antimeridian."""
+    if not bbox:
+        return -180.0, -90.0, 180.0, 90.0
+    west, south, east, north = (float(v) for v in bbox.split(","))
+    if not all(math.isfinite(v) for v in (west, south, east, north)) or south > north:
+        raise ValueError(bbox)
+    clamp = lambda v, limit: max(-limit, min(limit, v))  # noqa: E731
+    return clamp(west, 180), clamp(south, 90), clamp(east, 180), clamp(north, 90)
+
+
+@app.get("/api/map")
+async def get_map(request: Request, zoom: int = 0, bbox: str | None = None):
+    """
+    Clustered sources for a map view. `data` rows are
+    [centroid_lat, centroid_lon, sources, events], one per grid cell.
+    """
+    try:
+        west, south, east, north = _parse_bbox(bbox)
+    except ValueError:
+        return _error_response("bbox must be west,south,east,north in degrees")
+    resolution = _map_resolution(zoom)
+    size = _MAP_CELL_SIZES[resolution]
+    lat_range = (math.floor((south + 90) / size), math.floor((north + 90) / size))
+    west_cell = math.floor((west + 180) / size)
+    east_cell = math.floor((east + 180) / size)
+    lon_filter = "cell_lon BETWEEN %s AND %s" if west <= east else "(cell_lon >= %s OR cell_lon <= %s)"
+    try:
+        async with _db_connection(request.app, "read") as conn:
+            async with conn.cursor() as cur:
+                await _execute(
+                    cur,
+                    f"""
+                    SELECT sum_lat / sources, sum_lon / sources, sources, events
+                    FROM source_geo_cells
+                    WHERE resolution = %s AND sources > 0
+                      AND cell_lat BETWEEN %s AND %s AND {lon_filter}
+                """,
+                    (resolution, *lat_range, west_cell, east_cell),
+                )
+                with _phase("fetch"):
+                    rows = await cur.fetchall()
+        with _phase("encode"):
+            data = [[round(lat, 4), round(lon, 4), n, events] for lat, lon, n, events in rows]
+            return JSONResponse(
+                content={
+                    "status": "success",
+                    "resolution": resolution,
+                    "cell_size": size,
+                    "data": data,
+                },
+                status_code=200,
+            )
+    except _Overloaded as e:
+        return _overloaded_response(e)
+    except Exception as e:
+        logger.error(f"Failed to retrieve map: {e}")
+        return JSONResponse(
+            content={"status": "error", "message": "Failed to retrieve map"},
+            status_code=500,
+        )
+
+
+# Bulk export straight from COPY ... TO STDOUT. NDJSON is produced by
+# row_to_json() and copied as single-column CSV with quote and delimiter
+# characters that never occur in JSON text, so rows come out unescaped.
+_EXPORT_TABLES = {
+    "events": ("webhook_logs", "utc_time"),
+    "sources": ("source_details", "last_seen"),
+}
+_EXPORT_FIELDS = {"events": _LOG_FIELDS, "sources": _SOURCE_FIELDS}
+_EXPORT_FORMATS = {
+    "csv": ("text/csv", "WITH (FORMAT csv, HEADER)"),
+    "ndjson": ("application/x-ndjson", "WITH (FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')"),
+}
+_EXPORT_CHUNK = 64 * 1024
+
+
+def _export_query(kind, fmt, since=None, until=None, node_id=None, src_host=None, fields=None):
+    table, time_column = _EXPORT_TABLES[kind]
+    where, params = [], []
+    if since is not None:
+        where.append(f"{time_column} >= %s")
+        params.append(since)
+    if until is not None:
+        where.append(f"{time_column} < %s")
+        params.append(until)
+    if src_host:
+        where.append("src_host = %s")
+        params.append(src_host)
+    if node_id:
+        if kind == "events":
+            where.append("node_id = %s")
+        else:
+            where.append("src_host IN (SELECT src_host FROM webhook_logs WHERE node_id = %s)")
+        params.append(node_id)
+    select = f"SELECT {', '.join(fields) if fields else '*'} FROM {table}"
+    if where:
+        select += " WHERE " + " AND ".join(where)
+    if fmt == "ndjson":
+        select = f"SELECT row_to_json(t) FROM ({select}) t"
+    return f"COPY ({select}) TO STDOUT {_EXPORT_FORMATS[fmt][1]}", params
+
+
+async def _copy_chunks(conn, query, params, gzip=False):
+    """Yield COPY output in ~64 KiB chunks, optionally gzip-compressed."""
+    encoder = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+    buffer = bytearray()
+    async with conn.cursor() as cur:
+        async with cur.copy(query, params) as copy:
+            async for data in copy:
+                buffer += data
+                if len(buffer) >= _EXPORT_CHUNK:
+                    chunk = encoder.compress(buffer) if encoder else bytes(buffer)
+                    buffer.clear()
+                    if chunk:
+                        yield chunk
+    tail = encoder.compress(buffer) + encoder.flush() if encoder else bytes(buffer)
+    if tail:
+        yield tail
+
+
+async def _export(request, kind, fmt, since, until, node_id, src_host, gzip, fields):
+    if fmt not in _EXPORT_FORMATS:
+        return _error_response("format must be csv or ndjson")
+    try:
+        since = datetime.fromisoformat(since) if since else None
+        until = datetime.fromisoformat(until) if until else None
+    except ValueError:
+        return _error_response("since/until must be ISO 8601 timestamps")
+    try:
+        fields = _parse_fields(fields, _EXPORT_FIELDS[kind])
+    except ValueError as e:
+        return _error_response(str(e))
+    query, params = _export_query(kind, fmt, since, until, node_id, src_host, fields)
+    # Admit and check out before the response starts, so a busy server can
+    # still answer 503; the stream then owns the connection until it ends.
+    # The response's background task releases both even if the body is
+    # never started or is abandoned by a disconnect.
+    stack = AsyncExitStack()
+    try:
+        conn = await stack.enter_async_context(_db_connection(request.app, "export"))
+    except _Overloaded as e:
+        return _overloaded_response(e)
+
+    async def body():
+        async with stack:
+            async for chunk in _copy_chunks(conn, query, params, gzip):
+                yield chunk
+
+    media_type, _ = _EXPORT_FORMATS[fmt]
+    filename = f"{kind}.{fmt}"
+    if gzip:
+        media_type, filename = "application/gzip", filename + ".gz"
+    return StreamingResponse(
+        body(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        background=BackgroundTask(stack.aclose),
+    )
+
+
+@app.get("/api/export/events")
+async def export_events(
+    request: Request,
+    format: str = "csv",
+    since: str | None = None,
+    until: str | None = None,
+    node_id: str | None = None,
+    src_host: str | None = None,
+    gzip: bool = False,
+    fields: str | None = None,
+):
+    """Stream webhook_logs rows with utc_time in [since, until) as CSV or NDJSON."""
+    return await _export(request, "events", format, since, until, node_id, src_host, gzip, fields)
+
+
+@app.get("/api/export/sources")
+async def export_sources(
+    request: Request,
+    format: str = "csv",
+    since: str | None = None,
+    until: str | None = None,
+    node_id: str | None = None,
+    src_host: str | None = None,
+    gzip: bool = False,
+    fields: str | None = None,
+):
+    """
+    Stream source_details rows with last_seen in [since, until). `node_id`
+    limits the export to sources that node has logged.
+    """
+    return await _export(request, "sources", format, since, until, node_id, src_host, gzip, fields)
 
 
 @app.get("/", include_in_schema=False)
@@ -633,5 +3168,7 @@ async def _spa_fallback(full_path: str): # pragma: no cover
 
 
 if __name__ == "__main__": # pragma: no cover
-    # run with an ASGI server for FastAPI
+    # run with an ASGI server for FastAPI; see launcher.py for multiple workers
+    import uvicorn
+
     uvicorn.run("main:app", host="0.0.0.0", port=8081, reload=False)
@@ -1,21 +1,37 @@
+import asyncio
+import gzip
+import json
+import os
 import re
-from datetime import datetime, timezone
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
+from types import SimpleNamespace
 from typing import Any, Dict, List
 
+import psycopg
 import pytest
+from fastapi import BackgroundTasks
 from fastapi.testclient import TestClient
 
+import events
 import main
 
+_real_geo_worker = main._geo_worker_async
+
 
 # ---------------------------------------------------------------------------
 # Fakes: In‑memory DB layer replacing psycopg_pool.AsyncConnectionPool
 # ---------------------------------------------------------------------------
 
 class FakeCursor:
-    def __init__(self, store):
+    def __init__(self, store, connection=None):
         self.store = store
+        self.connection = connection
         self._rows: List[tuple] = []
         self.description: List[tuple] | None = None
         self._last_sql = ""
@@ -26,9 +42,43 @@ class FakeCursor:
     async def __aexit__(self, exc_type, exc, tb):
         return False
 
-    async def execute(self, sql, params=None):
+    def _logs(self, low, params):
+        """webhook_logs rows, filtered on node_id when the query asks for it."""
+        rows = self.store["webhook_logs"]
+        if "and node_id = %s" in low:
+            rows = [r for r in rows if r["node_id"] == params[0]]
+        return rows
+
+    def _sources(self, node_id=None):
+        """The source list (src_host, last_seen, events), newest first, as the rollups hold it."""
+        agg: Dict[str, list] = {}
+        for r in self.store["webhook_logs"]:
+            if not r["src_host"] or (node_id is not None and r["node_id"] != node_id):
+                continue
+            a = agg.setdefault(r["src_host"], [None, 0])
+            a[1] += r["repeat_count"]
+            t = r["last_utc_time"] or r["utc_time"]
+            if t is not None and (a[0] is None or t > a[0]):
+                a[0] = t
+        rows = sorted((ip, seen, count) for ip, (seen, count) in agg.items())
+        rows.sort(key=lambda x: (x[1] is not None, x[1] or datetime.min), reverse=True)
+        return rows
+
+    def _node_events(self, node_id, since):
+        for r in self.store["webhook_logs"]:
+            if not r["node_id"] or r["utc_time"] is None:
+                continue
+            r = {**r, "utc_time": r["utc_time"].replace(tzinfo=None)}
+            if (node_id is None or r["node_id"] == node_id) and r["utc_time"] >= since:
+                yield r
+
+    async def execute(self, sql, params=None, prepare=None):
         self._last_sql = sql
         low = re.sub(r"\s+", " ", sql.lower()).strip()
+        # Tables a test marks as not created yet (pending migrations)
+        for table in self.store.get("missing_tables", ()):
+            if f"from {table}" in low:
+                raise psycopg.errors.UndefinedTable(f'relation "{table}" does not exist')
 
         # Webhook insert
         if low.startswith("insert into webhook_logs"):
@@ -38,7 +88,11 @@ class FakeCursor:
                 logdata_hostname, logdata_path, logdata_useragent, logdata_localversion,
                 logdata_password, logdata_remoteversion, logdata_username, logdata_session
             ) = params
+            row_id = len(self.store["webhook_logs"]) + 1
             self.store["webhook_logs"].append({
+                "id": row_id,
+                "repeat_count": 1,
+                "last_utc_time": None,
                 "dst_host": dst_host,
                 "dst_port": dst_port,
                 "local_time": local_time,
@@ -57,91 +111,135 @@ class FakeCursor:
                 "logdata_username": logdata_username,
                 "logdata_session": logdata_session,
             })
+            self._rows = [(row_id,)] if "returning id" in low else []
+            self.description = [("id",)] if "returning id" in low else []
+            return
+
+        # Aggregated burst close-out
+        if low.startswith("update webhook_logs set repeat_count"):
+            count, last_time, row_id = params
+            for r in self.store["webhook_logs"]:
+                if r["id"] == row_id:
+                    r["repeat_count"] = count
+                    r["last_utc_time"] = last_time
             self._rows = []
             self.description = []
             return
 
-        # Count distinct sources
-        if "select count(distinct src_host) from webhook_logs" in low:
-            distinct = {r["src_host"] for r in self.store["webhook_logs"] if r["src_host"]}
-            self._rows = [(len(distinct),)]
+        if low.startswith("update source_details set times_seen = times_seen +"):
+            extra, last_time, ip = params
+            sd = self.store["source_details"].get(ip)
+            if sd:
+                sd["times_seen"] += extra
+            self._rows = []
+            self.description = []
+            return
+
+        # Source counts: distinct sources in webhook_logs, or rows of the
+        # source rollups, optionally within one node
+        node = params[0] if params and "node_id = %s" in low else None
+        if "select count(distinct src_host) from webhook_logs" in low or re.match(
+            r"select count\(\*\) from source_(node_)?rollups", low
+        ):
+            self._rows = [(len(self._sources(node)),)]
             self.description = [("count",)]
             return
 
-        # Aggregated sources listing
-        if "select src_host, max(utc_time) as last_seen, count(*) as times_seen" in low:
-            agg: Dict[str, Dict[str, Any]] = {}
-            for r in self.store["webhook_logs"]:
-                ip = r["src_host"]
-                if not ip:
-                    continue
-                a = agg.setdefault(ip, {"count": 0, "last_seen": None})
-                a["count"] += 1
-                t = r["utc_time"]
-                if t is not None and (a["last_seen"] is None or t > a["last_seen"]):
-                    a["last_seen"] = t
-            rows = [(ip, v["last_seen"], v["count"]) for ip, v in agg.items()]
-            rows.sort(key=lambda x: (x[1] is None, x[1]), reverse=True)
-            limit = params[0]
-            offset = params[1]
-            self._rows = rows[offset: offset + limit]
+        # Dashboard: a page of sources joined with their country codes
+        if low.startswith("with page as ("):
+            rows = self._sources()
+            limit, offset = params
+            self._rows = [
+                (ip, seen, count, (self.store["source_details"].get(ip) or {}).get("src_isocountrycode"), len(rows))
+                for ip, seen, count in rows[offset: offset + limit]
+            ]
+            self.description = [("src_host",), ("last_seen",), ("times_seen",), ("country",), ("total",)]
+            return
+
+        # Source list, from the rollups or aggregated from webhook_logs
+        if low.startswith((
+            "select src_host, max(coalesce(last_utc_time, utc_time)) as last_seen, sum(repeat_count) as times_seen",
+            "select src_host, last_seen, events as times_seen from source_",
+        )):
+            limit, offset = params[-2:]
+            self._rows = self._sources(node)[offset: offset + limit]
             self.description = [("src_host",), ("last_seen",), ("times_seen",)]
             return
 
-        # Select * filtered by src_host
-        if "select * from webhook_logs" in low and "where src_host" in low:
+        # Logs for one src_host, optionally projected
+        m = re.match(r"select (.+?) from webhook_logs where src_host = %s", low)
+        if m:
             ip = params[0]
-            rows = []
-            for r in self.store["webhook_logs"]:
-                if r["src_host"] == ip:
-                    # stable column order
-                    columns = [
-                        "dst_host", "dst_port", "local_time", "local_time_adjusted",
-                        "logtype", "node_id", "src_host", "src_port", "utc_time",
-                        "logdata_hostname", "logdata_path", "logdata_useragent",
-                        "logdata_localversion", "logdata_password", "logdata_remoteversion",
-                        "logdata_username", "logdata_session"
-                    ]
-                    rows.append(tuple(r[c] for c in columns))
-            self._rows = rows
-            self.description = [(c,) for c in [
+            # stable column order
+            columns = [
                 "dst_host", "dst_port", "local_time", "local_time_adjusted",
                 "logtype", "node_id", "src_host", "src_port", "utc_time",
                 "logdata_hostname", "logdata_path", "logdata_useragent",
                 "logdata_localversion", "logdata_password", "logdata_remoteversion",
                 "logdata_username", "logdata_session"
-            ]]
+            ]
+            if m.group(1) != "*":
+                columns = [c.strip() for c in m.group(1).split(",")]
+            self._rows = [
+                tuple(r[c] for c in columns)
+                for r in self._logs(low, params[1:])
+                if r["src_host"] == ip
+            ]
+            self.description = [(c,) for c in columns]
             return
 
-        # Source details single
-        if "select * from source_details" in low and "where src_host" in low:
-            ip = params[0]
-            sd = self.store["source_details"].get(ip)
-            if sd:
-                cols = [
-                    "first_seen", "last_seen", "times_seen", "src_host", "src_country",
-                    "src_isocountrycode", "src_region", "src_regionname", "src_city",
-                    "src_zip", "src_latitude", "src_longitude", "src_timezone",
-                    "src_isp", "src_org", "src_asnum", "src_asorg", "src_reversedns",
-                    "src_mobile", "src_proxy", "src_hosting"
-                ]
-                self._rows = [tuple(sd.get(c) for c in cols)]
-                self.description = [(c,) for c in cols]
-            else:
-                self._rows = []
-                self.description = []
+        # Node rollups, computed from the stored events like the triggers would
+        if "from node_rollups r where r.bucket >=" in low:
+            nodes = {}
+            for r in self._node_events(None, params["since"]):
+                n = nodes.setdefault(r["node_id"], [0, set(), None])
+                n[0] += r["repeat_count"]
+                n[1].add(r["src_host"])
+                n[2] = max(filter(None, (n[2], r["utc_time"])), default=None)
+            self._rows = sorted(
+                ((node, n[0], len(n[1]), n[2]) for node, n in nodes.items()),
+                key=lambda x: (-x[1], x[0]),
+            )
+            self.description = [("node_id",), ("events",), ("sources",), ("last_seen",)]
+            return
+        if low.startswith("select bucket, events, last_seen from node_rollups"):
+            buckets = {}
+            for r in self._node_events(*params):
+                b = buckets.setdefault(r["utc_time"].replace(minute=0, second=0, microsecond=0), [0, None])
+                b[0] += r["repeat_count"]
+                b[1] = max(filter(None, (b[1], r["utc_time"])), default=None)
+            self._rows = [(k, v[0], v[1]) for k, v in sorted(buckets.items())]
+            return
+        if low.startswith("select dimension, value, events, distinct_values from"):
+            node_id, since, top = params
+            counts = {"port": Counter(), "logtype": Counter(), "src": Counter()}
+            for r in self._node_events(node_id, since):
+                for dim, col in (("port", "dst_port"), ("logtype", "logtype"), ("src", "src_host")):
+                    if r[col] is not None:
+                        counts[dim][str(r[col])] += r["repeat_count"]
+            self._rows = [
+                (dim, value, events, len(c))
+                for dim, c in sorted(counts.items())
+                for value, events in sorted(c.items(), key=lambda x: (-x[1], x[0]))[:top]
+            ]
             return
 
-        # Batch iso country lookup
-        if "select src_host, src_isocountrycode from source_details" in low:
-            ips = params[0]
-            rows = []
-            for ip in ips:
-                sd = self.store["source_details"].get(ip)
-                if sd:
-                    rows.append((ip, sd.get("src_isocountrycode")))
-            self._rows = rows
-            self.description = [("src_host",), ("src_isocountrycode",)]
+        # Source details rows for a list of ips (single and batch endpoints)
+        if "select * from source_details" in low and "where src_host = any" in low:
+            cols = [
+                "first_seen", "last_seen", "times_seen", "src_host", "src_country",
+                "src_isocountrycode", "src_region", "src_regionname", "src_city",
+                "src_zip", "src_latitude", "src_longitude", "src_timezone",
+                "src_isp", "src_org", "src_asnum", "src_asorg", "src_reversedns",
+                "src_mobile", "src_proxy", "src_hosting"
+            ]
+            self.store["source_queries"] = self.store.get("source_queries", 0) + 1
+            self._rows = [
+                tuple(sd.get(c) for c in cols)
+                for sd in (self.store["source_details"].get(ip) for ip in params[0])
+                if sd
+            ]
+            self.description = [(c,) for c in cols]
             return
 
         # Stats top_src_host CTE query (detect by WITH and top_src_host)
@@ -180,15 +278,18 @@ class FakeCursor:
             params_dict = params
             ip = params_dict.get("src_host")
             sd = self.store["source_details"].get(ip)
+            seen = params_dict.get("seen")
+            self._rows = [(sd is None,)] if "returning" in low else []
+            self.description = [("inserted",)] if "returning" in low else []
             if sd:
                 sd["times_seen"] += 1
-                new_last = params_dict.get("last_seen")
+                new_last = params_dict.get("last_seen", seen)
                 if new_last and (sd["last_seen"] is None or new_last > sd["last_seen"]):
                     sd["last_seen"] = new_last
             else:
                 self.store["source_details"][ip] = {
-                    "first_seen": params_dict.get("first_seen"),
-                    "last_seen": params_dict.get("last_seen"),
+                    "first_seen": params_dict.get("first_seen", seen),
+                    "last_seen": params_dict.get("last_seen", seen),
                     "times_seen": params_dict.get("times_seen", 1),
                     "src_host": ip,
                     "src_country": params_dict.get("src_country"),
@@ -197,6 +298,14 @@ class FakeCursor:
                     "src_isp": params_dict.get("src_isp"),
                     "src_asorg": params_dict.get("src_asorg"),
                 }
+            return
+
+        # Geo enrichment of an existing source row
+        # Enrichment writes (named params)
+        if low.startswith("update source_details set") and isinstance(params, dict):
+            sd = self.store["source_details"].get(params["src_host"])
+            if sd:
+                sd.update({k: v for k, v in params.items() if k != "src_host"})
             self._rows = []
             self.description = []
             return
@@ -211,10 +320,121 @@ class FakeCursor:
             self.description = [("1",)]
             return
 
+        # Shared ip-api token bucket
+        if low.startswith("insert into rate_limit_buckets"):
+            now = time.monotonic()
+            tokens, updated = self.store.setdefault("buckets", {}).get(
+                params["name"], (params["capacity"], now)
+            )
+            tokens = min(params["capacity"], tokens + (now - updated) * params["rate"])
+            if tokens >= 1:
+                self.store["buckets"][params["name"]] = (tokens - 1, now)
+                self._rows = [(tokens - 1,)]
+            else:
+                self._rows = []
+            return
+
+        if low.startswith("insert into geo_lookup_claims"):
+            claims = self.store.setdefault("claims", {})
+            now = time.monotonic()
+            claimed = claims.get(params["ip"])
+            if claimed is None or claimed < now - params["ttl"]:
+                claims[params["ip"]] = now
+                self._rows = [(1,)]
+            else:
+                self._rows = []
+            return
+
+        # Newest events for the recent-events ring
+        if low.startswith("select utc_time, src_host, node_id, dst_port, logtype, logdata_username, logdata_password from webhook_logs"):
+            rows = sorted(
+                (r for r in self.store["webhook_logs"] if r["utc_time"]),
+                key=lambda r: r["utc_time"],
+                reverse=True,
+            )[: params[0]]
+            self._rows = [tuple(r[c] for c in main._RECENT_FIELDS) for r in rows]
+            return
+
+        # Recent events for the hot source rebuild
+        if low.startswith("select src_host, node_id, dst_port, coalesce(last_utc_time, utc_time), repeat_count"):
+            self._rows = [
+                (r["src_host"], r["node_id"], r["dst_port"], r["last_utc_time"] or r["utc_time"], r["repeat_count"])
+                for r in self.store["webhook_logs"]
+                if r["utc_time"] and r["utc_time"] >= params[0]
+                and (r["last_utc_time"] or r["utc_time"]) < params[1]
+            ]
+            return
+
+        # Breakdowns: what the source_details trigger would have accumulated
+        if "from source_breakdowns" in low and "dimension = %s" in low:
+            column, label = {
+                "asn": ("src_asnum", "src_asorg"),
+                "isp": ("src_isp", None),
+                "country": ("src_country", "src_isocountrycode"),
+            }[params[0]]
+            agg: Dict[str, Dict[str, Any]] = {}
+            for sd in self.store["source_details"].values():
+                if sd.get(column) in (None, ""):
+                    continue
+                b = agg.setdefault(str(sd[column]), {"label": sd.get(label), "sources": 0, "events": 0})
+                b["sources"] += 1
+                b["events"] += sd.get("times_seen") or 0
+            if low.startswith("select count(*)"):
+                self._rows = [(len(agg),)]
+                return
+            key = "sources" if "order by sources" in low else "events"
+            ranked = sorted(agg.items(), key=lambda kv: (-kv[1][key], kv[0]))
+            limit, offset = params[1], params[2]
+            self._rows = [
+                (value, b["label"], b["sources"], b["events"])
+                for value, b in ranked[offset:offset + limit]
+            ]
+            self.description = [("value",), ("label",), ("sources",), ("events",)]
+            return
+
+        if "from source_geo_cells" in low:
+            self.store["map_params"] = params
+            self._rows = list(self.store.get("geo_cells", []))
+            return
+
+        if low.startswith("delete from enrichment_queue"):
+            queue = self.store.setdefault("enrichment_queue", {})
+            ip = next(iter(queue), None)
+            self._rows = [(ip, queue.pop(ip))] if ip else []
+            return
+
+        if low.startswith("insert into enrichment_queue"):
+            self.store.setdefault("enrichment_queue", {}).setdefault(params[0], params[1])
+            self._rows = []
+            return
+
+        if low.startswith("delete from geo_lookup_claims"):
+            self.store.setdefault("claims", {}).pop(params[0], None)
+            self._rows = []
+            return
+
         # Fallback
         self._rows = []
         self.description = []
 
+    async def close(self):
+        pass
+
+    async def executemany(self, sql, params_seq):
+        for params in params_seq:
+            await self.execute(sql, params)
+
+    @asynccontextmanager
+    async def copy(self, sql, params=None):
+        # Record the statement and stream one "id,src_host" line per stored event
+        self.store.setdefault("copies", []).append((sql, params))
+
+        async def rows():
+            for r in self.store["webhook_logs"]:
+                yield f"{r['id']},{r['src_host']}\n".encode()
+
+        yield rows()
+
     async def fetchone(self):
         return self._rows[0] if self._rows else None
 
@@ -233,23 +453,44 @@ class FakeConnection:
         return False
 
     def cursor(self):
-        return FakeCursor(self.store)
+        return FakeCursor(self.store, self)
+
+    @asynccontextmanager
+    async def pipeline(self):
+        yield
+
+    async def execute(self, sql, params=None):
+        cur = FakeCursor(self.store)
+        await cur.execute(sql, params)
+        return cur
 
     async def commit(self):
         pass
 
+    async def rollback(self):
+        pass
+
 
 class FakePool:
+    # Every pool the app opens (write, read, replicas) sees the same data.
+    shared_store = None
+
     def __init__(self, *args, **kwargs):
-        self.store = {"webhook_logs": [], "source_details": {}}
+        self.kwargs = kwargs
+        if FakePool.shared_store is None:
+            FakePool.shared_store = {"webhook_logs": [], "source_details": {}}
+        self.store = FakePool.shared_store
 
     async def open(self):
         return self
 
+    async def wait(self, timeout=None):
+        return
+
     async def close(self):
         return
 
-    def connection(self):
+    def connection(self, timeout=None):
         return FakeConnection(self.store)
 
 
@@ -264,6 +505,9 @@ def _env(monkeypatch):
     monkeypatch.setenv("POSTGRES_DB", "testdb")
     monkeypatch.setenv("POSTGRES_USER", "user")
     monkeypatch.setenv("POSTGRES_PASSWORD", "pass")
+    # No real PTR lookups from tests
+    monkeypatch.setenv("ENRICH_RDNS", "false")
+    monkeypatch.setenv("MIGRATE_ON_STARTUP", "false")
 
 
 @pytest.fixture(autouse=True)
@@ -276,6 +520,7 @@ def _patch_pool_and_assets(monkeypatch, tmp_path):
     monkeypatch.setattr(main, "_build_dir", str(build_dir))
     # Replace connection pool class before startup
     monkeypatch.setattr(main, "AsyncConnectionPool", FakePool)
+    FakePool.shared_store = None
     # Avoid background geo lookups performing real HTTP
     monkeypatch.setattr(main, "_geo_worker_async", lambda *a, **k: None)
     # Optionally throttle control structures
@@ -299,7 +544,7 @@ def _post_webhook(client, **overrides):
         "dst_port": 22,
         "local_time": "2025-01-01 00:00:00",
         "local_time_adjusted": "2025-01-01 00:00:00",
-        "logtype": "ssh",
+        "logtype": 4002,
         "node_id": "node1",
         "src_host": "8.8.8.8",
         "src_port": 12345,
@@ -465,7 +710,7 @@ def test_schedule_geo_lookup_private_ip_not_scheduled(monkeypatch):
     added = {}
 
     class BG:
-        def add_task(self, fn, *args):
+        def add_task(self, fn, *args, **kwargs):
             added["fn"] = fn
             added["args"] = args
 
@@ -520,8 +765,8 @@ def test_logs_invalid_page_params_do_not_crash(client, monkeypatch):
     # Monkeypatch the connection's cursor method to use BrokenCursor once
     orig_connection = pool.connection
 
-    def connection_with_broken():
-        conn = orig_connection()
+    def connection_with_broken(*args, **kwargs):
+        conn = orig_connection(*args, **kwargs)
         conn.cursor = broken_cursor.__get__(conn, FakeConnection)
         return conn
 
@@ -529,4 +774,1248 @@ def test_logs_invalid_page_params_do_not_crash(client, monkeypatch):
 
     r = client.get("/api/logs")
     # Should be 500 due to forced failure path
-    assert r.status_code in (200, 500)  # Accept either; main code logs & returns 500 on failure.
\ No newline at end of file
+    assert r.status_code in (200, 500)  # Accept either; main code logs & returns 500 on failure.
+
+# ---------------------------------------------------------------------------
+# Tests: Profiling (Server-Timing + slow query ring buffer)
+# ---------------------------------------------------------------------------
+
+def test_profiling_server_timing_requires_admin(client, monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    r = client.get("/api/stats", headers={"X-Profile": "1"})
+    assert "server-timing" not in r.headers
+
+    r = client.get("/api/stats", headers={"X-Profile": "1", "X-Admin-Token": "secret"})
+    assert r.status_code == 200
+    timing = r.headers["server-timing"]
+    for phase in ("pool", "sql", "fetch", "encode", "total"):
+        assert f"{phase};dur=" in timing
+
+
+def test_profiling_slow_query_ring_buffer(client, monkeypatch):
+    monkeypatch.setenv("PROFILING_ENABLED", "true")
+    monkeypatch.setattr(main, "_SLOW_QUERY_MS", 0)
+    main._slow_queries.clear()
+    r = client.get("/api/logs")
+    assert "server-timing" in r.headers
+
+    assert client.get("/api/admin/slow_queries").status_code == 403
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    r = client.get("/api/admin/slow_queries", headers={"X-Admin-Token": "secret"})
+    assert r.status_code == 200
+    data = r.json()["data"]
+    assert data and all(e["path"] == "/api/logs" for e in data)
+    assert any("select count(*) from source_rollups" in e["sql"].lower() for e in data)
+
+
+# ---------------------------------------------------------------------------
+# Tests: Webhook parsing (content-type dispatch, coercion, ack modes)
+# ---------------------------------------------------------------------------
+
+def test_webhook_opencanary_form_post_is_coerced(client):
+    message = {
+        "src_host": "1.1.1.1",
+        "dst_port": "22",
+        "src_port": 40000,
+        "logtype": "4002",
+        "utc_time": "2025-08-28T18:37:49.453Z",
+        "logdata": {"USERNAME": "root", "PASSWORD": "toor"},
+    }
+    r = client.post("/api/webhook", data={"message": json.dumps(message)})
+    assert r.status_code == 200
+    assert r.json()["received"]["dst_port"] == "22"
+
+    row = main.app.state.db_pool.store["webhook_logs"][-1]
+    assert row["dst_port"] == 22
+    assert row["logtype"] == 4002
+    assert row["utc_time"] == datetime(2025, 8, 28, 18, 37, 49, 453000)
+    assert row["logdata_username"] == "root"
+
+
+def test_webhook_rejects_invalid_fields_and_bodies(client):
+    r = _post_webhook(client, dst_port="twenty-two")
+    assert r.status_code == 400
+    assert "dst_port" in r.json()["message"]
+
+    r = _post_webhook(client, utc_time="yesterday")
+    assert r.status_code == 400
+
+    r = client.post("/api/webhook", data={"other": "x"})
+    assert r.status_code == 400
+    assert r.json()["message"] == "No 'message' field in form data."
+
+    r = client.post(
+        "/api/webhook", content=b"{not json", headers={"content-type": "application/json"}
+    )
+    assert r.status_code == 400
+
+
+def test_parse_event_fast_path_matches_coercers():
+    data = {
+        "dst_host": "10.0.0.5", "dst_port": 22, "local_time": "2025-08-28 13:37:49.454000",
+        "local_time_adjusted": "2025-08-28 15:37:49", "logtype": 4002, "node_id": "opencanary-1",
+        "src_host": "1.2.3.4", "src_port": 40000, "utc_time": "2025-08-28 18:37:49",
+        "logdata": {key: key.lower() for _, key in events._LOGDATA_SCHEMA},
+    }
+    event = main._parse_event(data)
+    assert event == events._coerce_event(data)
+    assert event.row() == (
+        "10.0.0.5", 22, datetime(2025, 8, 28, 13, 37, 49, 454000), datetime(2025, 8, 28, 15, 37, 49),
+        4002, "opencanary-1", "1.2.3.4", 40000, datetime(2025, 8, 28, 18, 37, 49),
+        "hostname", "path", "useragent", "localversion", "password", "remoteversion", "username", "session",
+    )
+    assert event.src_host == "1.2.3.4" and event.get("logdata_session") == "session"
+
+    # Anything else is coerced field by field
+    event = main._parse_event({**data, "dst_port": "22", "utc_time": "2025-08-28T18:37:49+00:00"})
+    assert event.dst_port == 22
+    assert event.utc_time == datetime(2025, 8, 28, 18, 37, 49)
+
+
+def test_webhook_sniffs_json_sent_with_other_content_types(client):
+    body = json.dumps({"src_host": "1.2.3.4", "dst_port": 22}).encode()
+    r = client.post("/api/webhook", content=body, headers={"content-type": "text/plain"})
+    assert r.status_code == 200
+    assert main.app.state.db_pool.store["webhook_logs"][-1]["dst_port"] == 22
+
+    r = client.post("/api/webhook", content=b"src_host=1.2.3.4", headers={"content-type": "text/plain"})
+    assert r.status_code == 400
+    assert r.json()["message"] == "Unsupported content type: text/plain."
+
+
+def test_webhook_minimal_ack(client, monkeypatch):
+    r = client.post("/api/webhook?ack=minimal", json={"src_host": "1.2.3.4"})
+    assert r.status_code == 200
+    assert r.json() == {"status": "success"}
+
+    monkeypatch.setenv("WEBHOOK_ACK_MODE", "minimal")
+    r = _post_webhook(client)
+    assert r.json() == {"status": "success"}
+
+
+# ---------------------------------------------------------------------------
+# Tests: Ingest burst aggregation
+# ---------------------------------------------------------------------------
+
+def test_ingest_aggregation_merges_scan_floods(monkeypatch):
+    monkeypatch.setenv("INGEST_AGGREGATE_WINDOW", "60")
+    with TestClient(main.app) as c:
+        store = main.app.state.db_pool.store
+        for i in range(5):
+            _post_webhook(c, src_host="1.2.3.4", src_port=1000 + i, logdata={},
+                          utc_time=f"2025-01-01 00:00:0{i}")
+        # Credentials are never merged
+        _post_webhook(c, src_host="1.2.3.4")
+        _post_webhook(c, src_host="1.2.3.4")
+        assert len(store["webhook_logs"]) == 3
+
+        r = c.get("/api/logs")
+        # Counts are only folded in once the window closes
+        assert r.json()["data"][0]["times_seen"] == 3
+
+    # Shutdown flushes open bursts
+    burst_row = store["webhook_logs"][0]
+    assert burst_row["repeat_count"] == 5
+    assert burst_row["last_utc_time"] == datetime(2025, 1, 1, 0, 0, 4)
+    assert store["source_details"]["1.2.3.4"]["times_seen"] == 7
+
+
+def test_ingest_aggregation_window_expiry(monkeypatch):
+    agg = main._IngestAggregator(window=10)
+    event = main._parse_event({"src_host": "5.5.5.5", "dst_port": 80})
+    clock = [100.0]
+    monkeypatch.setattr(main.time, "monotonic", lambda: clock[0])
+    assert not agg.merge(event)
+    agg.open(event, 1)
+    assert agg.merge(event)
+    clock[0] += 11
+    assert not agg.merge(event)
+    agg.open(event, 2)
+    bursts = agg.drain(force=True)
+    assert sorted((b.row_id, b.count) for b in bursts) == [(1, 2)]
+    assert len(agg) == 0
+
+
+# ---------------------------------------------------------------------------
+# Tests: Admission control and overflow spool
+# ---------------------------------------------------------------------------
+
+class _SaturatedController:
+    @asynccontextmanager
+    async def slot(self):
+        raise main._Overloaded("ingest", 7)
+        yield
+
+
+@pytest.mark.asyncio
+async def test_admission_controller_caps_concurrency():
+    monitor = main._PoolMonitor()
+    ctl = main._AdmissionController("read", 1, 0.01, monitor)
+    async with ctl.slot():
+        with pytest.raises(main._Overloaded):
+            async with ctl.slot():
+                pass
+    assert ctl.stats() == {"limit": 1, "in_flight": 0, "admitted": 1, "rejected": 1}
+
+    # Reads are shed while checkouts are slow, then recover as the wait decays
+    shedding = main._AdmissionController("read", 5, 0.01, monitor, shed_wait=0.5)
+    monitor.observe(10)
+    with pytest.raises(main._Overloaded) as exc:
+        async with shedding.slot():
+            pass
+    assert exc.value.retry_after >= 1
+    monitor._updated -= 60
+    async with shedding.slot():
+        pass
+
+
+def test_admission_monitors_are_shared_per_pool(client):
+    admission = main.app.state.admission
+    # Reads and exports check out from the read pools, ingest from its own
+    assert admission["read"].monitor is admission["export"].monitor
+    assert admission["ingest"].monitor is not admission["read"].monitor
+
+
+def test_webhook_overloaded_returns_retry_after(client):
+    main.app.state.admission["ingest"] = _SaturatedController()
+    r = _post_webhook(client)
+    assert r.status_code == 429
+    assert r.headers["retry-after"] == "7"
+
+
+def test_webhook_overload_spools_and_drains(monkeypatch):
+    monkeypatch.setenv("INGEST_SPOOL_MAX", "1")
+    with TestClient(main.app) as c:
+        admission = main.app.state.admission
+        ingest = admission["ingest"]
+        admission["ingest"] = _SaturatedController()
+        assert _post_webhook(c, src_host="7.7.7.7").status_code == 202
+        assert _post_webhook(c, src_host="7.7.7.8").status_code == 429
+        assert len(main.app.state.spool) == 1
+        admission["ingest"] = ingest
+    # Shutdown drains the spool into the database
+    rows = main.app.state.db_pool.store["webhook_logs"]
+    assert [r["src_host"] for r in rows] == ["7.7.7.7"]
+
+
+# ---------------------------------------------------------------------------
+# Tests: Read/write pool split and replica routing
+# ---------------------------------------------------------------------------
+
+class _LagPool:
+    def __init__(self, lag):
+        self.lag = lag
+
+    def connection(self, timeout=None):
+        pool = self
+
+        class Conn:
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc):
+                return False
+
+            def cursor(self):
+                class Cur:
+                    async def __aenter__(self):
+                        return self
+
+                    async def __aexit__(self, *exc):
+                        return False
+
+                    async def execute(self, sql, params=None):
+                        if isinstance(pool.lag, Exception):
+                            raise pool.lag
+
+                    async def fetchone(self):
+                        return (pool.lag,)
+
+                return Cur()
+
+        return Conn()
+
+
+@pytest.mark.asyncio
+async def test_read_router_round_robin_and_fallback():
+    primary = _LagPool(0)
+    r1, r2 = _LagPool(1), _LagPool(2)
+    router = main._ReadRouter(primary, [("r1", r1), ("r2", r2)], max_lag=5)
+    assert [router.pool() for _ in range(3)] == [r1, r2, r1]
+
+    r1.lag = 60  # too far behind
+    r2.lag = RuntimeError("down")
+    await router.check()
+    assert router.stats() == {
+        "r1": {"healthy": False, "lag_seconds": 60.0},
+        "r2": {"healthy": False, "lag_seconds": None},
+    }
+    assert router.pool() is primary
+
+    r2.lag = 0
+    await router.check()
+    assert router.pool() is r2
+
+
+def test_reads_use_separate_pools(monkeypatch):
+    monkeypatch.setenv("POSTGRES_READ_HOSTS", "replica-a:5433,replica-b")
+    monkeypatch.setenv("DB_READ_POOL_MAX", "3")
+    with TestClient(main.app) as c:
+        state = main.app.state
+        replica_pools = [pool for _, pool in state.read_router.replicas]
+        assert len(replica_pools) == 2
+        assert "host=replica-a port=5433 " in replica_pools[0].kwargs["conninfo"]
+        assert replica_pools[0].kwargs["max_size"] == 3
+        assert state.read_router.primary is not state.db_pool
+        assert state.read_router.primary.kwargs["min_size"] == 0
+        _post_webhook(c, src_host="6.6.6.6")
+        assert c.get("/api/logs").json()["data"][0]["src_host"] == "6.6.6.6"
+
+
+# ---------------------------------------------------------------------------
+# Tests: Pipelined ingest
+# ---------------------------------------------------------------------------
+
+def test_pipeline_ingest_upserts_source_and_enriches_new_only(client, monkeypatch):
+    scheduled = []
+    monkeypatch.setattr(main, "_geo_worker_async", lambda app, ip, event, **k: scheduled.append(ip))
+    _post_webhook(client, src_host="8.8.4.4")
+    _post_webhook(client, src_host="8.8.4.4")
+    _post_webhook(client, src_host="10.1.1.1")  # private: no source row
+    store = main.app.state.db_pool.store
+    assert len(store["webhook_logs"]) == 3
+    assert store["source_details"]["8.8.4.4"]["times_seen"] == 2
+    assert "10.1.1.1" not in store["source_details"]
+    assert scheduled == ["8.8.4.4"]
+
+
+@pytest.mark.asyncio
+async def test_geo_worker_only_enriches_in_pipeline_mode(client, monkeypatch):
+    async def fake_fetch(ip, coordinator=None):
+        return {"country": "Wonderland", "countryCode": "WL", "as": "AS64500 Rabbit Hole"}
+
+    monkeypatch.setattr(main, "_fetch_geo_async", fake_fetch)
+    _post_webhook(client, src_host="8.8.4.4")
+    # The fixture stubs the worker; run the real one directly.
+    await _real_geo_worker(main.app, "8.8.4.4", {"src_host": "8.8.4.4"})
+    sd = main.app.state.db_pool.store["source_details"]["8.8.4.4"]
+    assert sd["times_seen"] == 1
+    assert sd["src_isocountrycode"] == "WL"
+    assert sd["src_asnum"] == 64500
+
+
+# ---------------------------------------------------------------------------
+# Tests: Shared geo rate limiting / claims
+# ---------------------------------------------------------------------------
+
+@pytest.mark.asyncio
+async def test_postgres_geo_coordinator_bucket_and_claims(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: clock[0])
+    pool = FakePool()
+    # Two processes sharing one database
+    a = main._PostgresGeoCoordinator(pool, limit=45, burst=5)
+    b = main._PostgresGeoCoordinator(pool, limit=45, burst=5)
+    allowed = [await (a if i % 2 else b).allow_lookup() for i in range(8)]
+    assert allowed == [True] * 5 + [False] * 3
+    clock[0] += 3  # refill at 40/min
+    assert await a.allow_lookup()
+    assert await b.allow_lookup()
+    assert not await a.allow_lookup()
+
+    assert await a.claim("8.8.8.8")
+    assert not await b.claim("8.8.8.8")
+    await a.release("8.8.8.8")
+    assert await b.claim("8.8.8.8")
+    clock[0] += 61  # stale claims from a crashed worker expire
+    assert await a.claim("8.8.8.8")
+
+
+@pytest.mark.asyncio
+async def test_legacy_worker_counts_event_when_claim_is_held_elsewhere(client, monkeypatch):
+    fetched = []
+
+    async def fake_fetch(ip, coordinator=None):
+        fetched.append(ip)
+        return {"country": "Wonderland", "countryCode": "WL"}
+
+    monkeypatch.setattr(main, "_fetch_geo_async", fake_fetch)
+    monkeypatch.setattr(main.app.state, "ingest_pipeline", False)
+    coordinator = main._PostgresGeoCoordinator(main.app.state.db_pool)
+    monkeypatch.setattr(main.app.state, "geo_coordinator", coordinator)
+    event = {"src_host": "8.8.8.8", "utc_time": datetime(2025, 1, 1)}
+    await _real_geo_worker(main.app, "8.8.8.8", event)
+    # Another worker claims the address; this event is still counted.
+    assert await coordinator.claim("8.8.8.8")
+    await _real_geo_worker(main.app, "8.8.8.8", event)
+    assert FakePool.shared_store["source_details"]["8.8.8.8"]["times_seen"] == 2
+    assert fetched == ["8.8.8.8"]
+
+
+def test_geo_coordinator_backend_selection(monkeypatch):
+    assert main._build_geo_coordinator(FakePool()) is main._LOCAL_GEO_COORDINATOR
+    monkeypatch.setenv("GEO_COORDINATION", "postgres")
+    assert isinstance(main._build_geo_coordinator(FakePool()), main._PostgresGeoCoordinator)
+
+
+# ---------------------------------------------------------------------------
+# Tests: Geo single-flight registry
+# ---------------------------------------------------------------------------
+
+@pytest.mark.asyncio
+async def test_single_flight_coalesces_and_forgets():
+    flights = main._SingleFlight(max_pending=10)
+    calls = []
+    gate = asyncio.Event()
+
+    async def lookup():
+        calls.append(1)
+        await gate.wait()
+        return "geo"
+
+    waiters = [asyncio.ensure_future(flights.do("8.8.8.8", lookup)) for _ in range(20)]
+    await asyncio.sleep(0)
+    assert len(flights) == 1 and "8.8.8.8" in flights
+    gate.set()
+    assert await asyncio.gather(*waiters) == ["geo"] * 20
+    assert calls == [1]
+    assert len(flights) == 0
+
+    async def boom():
+        raise RuntimeError("down")
+
+    with pytest.raises(RuntimeError):
+        await flights.do("8.8.8.8", boom)
+    assert len(flights) == 0
+
+
+@pytest.mark.asyncio
+async def test_geo_worker_registry_stays_empty_after_many_ips(client, monkeypatch):
+    async def fake_fetch(ip, coordinator=None):
+        return {"country": "Wonderland", "countryCode": "WL"}
+
+    monkeypatch.setattr(main, "_fetch_geo_async", fake_fetch)
+    ips = [f"203.0.{i >> 8}.{i & 255}" for i in range(2000)]
+    await asyncio.gather(*(_real_geo_worker(main.app, ip, {"src_host": ip}) for ip in ips))
+    assert len(main.app.state.geo_flights) == 0
+
+
+def test_schedule_geo_lookup_drops_when_full(client):
+    flights = main.app.state.geo_flights
+    flights.pending = flights.max_pending
+    try:
+        bg = BackgroundTasks()
+        main.schedule_geo_lookup({"src_host": "8.8.4.4"}, bg, main.app)
+        assert not bg.tasks
+        assert flights.dropped == 1
+    finally:
+        flights.pending = 0
+
+
+@pytest.mark.asyncio
+async def test_scheduled_geo_lookups_count_against_the_cap(client, monkeypatch):
+    async def fake_fetch(ip, coordinator=None):
+        return {"country": "Wonderland", "countryCode": "WL"}
+
+    monkeypatch.setattr(main, "_fetch_geo_async", fake_fetch)
+    monkeypatch.setattr(main, "_geo_worker_async", _real_geo_worker)
+    monkeypatch.setattr(main.app.state, "ingest_pipeline", False)
+    flights = main._SingleFlight(max_pending=3)
+    monkeypatch.setattr(main.app.state, "geo_flights", flights)
+    bg = BackgroundTasks()
+    # Legacy mode schedules one task per event, all for the same address;
+    # none has started, but each holds a slot.
+    for _ in range(5):
+        main.schedule_geo_lookup({"src_host": "8.8.4.4"}, bg, main.app)
+    assert len(bg.tasks) == 3
+    assert flights.pending == 3 and flights.dropped == 2
+    await bg()
+    assert flights.pending == 0 and len(flights) == 0
+
+
+@pytest.mark.asyncio
+async def test_skipped_geo_lookups_give_back_their_slots(client, monkeypatch):
+    flights = main._SingleFlight(max_pending=3)
+    monkeypatch.setattr(main.app.state, "geo_flights", flights)
+
+    async def boom():
+        raise RuntimeError("earlier task failed")
+
+    bg = BackgroundTasks()
+    bg.add_task(boom)
+    for ip in ("8.8.4.4", "8.8.8.8"):
+        main.schedule_geo_lookup({"src_host": ip}, bg, main.app)
+    assert flights.pending == 2
+    # Starlette stops at the first task that raises; the lookups never run.
+    with pytest.raises(RuntimeError):
+        await bg()
+    del bg
+    assert flights.pending == 0
+    main.schedule_geo_lookup({"src_host": "8.8.4.4"}, BackgroundTasks(), main.app)
+    assert flights.dropped == 0
+
+
+# ---------------------------------------------------------------------------
+# Tests: Warm-up and readiness
+# ---------------------------------------------------------------------------
+
+def test_ready_after_warm_up(client):
+    assert main.app.state.db_pool.kwargs["min_size"] == 4  # DB_POOL_WARM default
+    r = client.get("/api/ready")
+    assert r.status_code == 200
+    assert r.json() == {"status": "ready"}
+    main.app.state.ready = False
+    r = client.get("/api/ready")
+    assert r.status_code == 503
+    assert r.json() == {"status": "warming"}
+
+
+# ---------------------------------------------------------------------------
+# Tests: Bulk export
+# ---------------------------------------------------------------------------
+
+def test_export_events_streams_copy_output(client):
+    for ip in ("8.8.8.8", "1.1.1.1"):
+        _post_webhook(client, src_host=ip)
+    r = client.get(
+        "/api/export/events",
+        params={"since": "2025-01-01T00:00:00", "node_id": "node1"},
+    )
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/csv")
+    assert r.text == "1,8.8.8.8\n2,1.1.1.1\n"
+    sql, params = main.app.state.db_pool.store["copies"][-1]
+    assert sql.startswith("COPY (SELECT * FROM webhook_logs WHERE utc_time >= %s AND node_id = %s)")
+    assert "FORMAT csv, HEADER" in sql
+    assert params == [datetime(2025, 1, 1), "node1"]
+
+
+def test_export_sources_ndjson_gzip(client):
+    _post_webhook(client, src_host="8.8.8.8")
+    r = client.get("/api/export/sources", params={"format": "ndjson", "gzip": "true"})
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "application/gzip"
+    assert 'filename="sources.ndjson.gz"' in r.headers["content-disposition"]
+    assert gzip.decompress(r.content) == b"1,8.8.8.8\n"
+    sql, _ = main.app.state.db_pool.store["copies"][-1]
+    assert sql.startswith("COPY (SELECT row_to_json(t) FROM (SELECT * FROM source_details) t)")
+
+
+@pytest.mark.asyncio
+async def test_export_releases_slot_when_body_never_starts(client):
+    request = type("R", (), {"app": main.app})()
+    controller = main.app.state.admission["export"]
+    response = await main._export(request, "events", "csv", None, None, None, None, False, None)
+    assert controller.in_flight == 1
+    # The client went away before the body was iterated.
+    await response.background()
+    assert controller.in_flight == 0
+
+
+def test_export_rejects_bad_parameters(client):
+    assert client.get("/api/export/events", params={"format": "xml"}).status_code == 400
+    assert client.get("/api/export/events", params={"since": "yesterday"}).status_code == 400
+
+
+# ---------------------------------------------------------------------------
+# Tests: Bulk import and the enrichment queue
+# ---------------------------------------------------------------------------
+
+def test_import_batch_aggregates_public_sources():
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tools"))
+    import import_opencanary
+
+    batch = import_opencanary._Batch()
+    lines = [
+        json.dumps({"src_host": "8.8.8.8", "logtype": 4002, "utc_time": "2025-01-01 00:00:02"}),
+        json.dumps({"src_host": "8.8.8.8", "logtype": 4002, "utc_time": "2025-01-01 00:00:01"}),
+        json.dumps({"src_host": "10.0.0.1", "logtype": 4002}),
+        json.dumps({"src_host": "", "logtype": 1001}),  # startup message
+        json.dumps({"src_host": "1.1.1.1", "logtype": "bogus"}),
+        "not json",
+    ]
+    for line in lines:
+        row = import_opencanary._parse_line(line.encode() + b"\n")
+        if row is not None:
+            batch.add(row)
+    assert len(batch.rows) == 3
+    assert len(batch.rows[0]) == len(events._EVENT_COLUMNS)
+    assert batch.sources == {
+        "8.8.8.8": [datetime(2025, 1, 1, 0, 0, 1), datetime(2025, 1, 1, 0, 0, 2), 2]
+    }
+
+
+@pytest.mark.asyncio
+async def test_enrichment_queue_enriches_and_retries(client, monkeypatch):
+    results = [None, {"country": "Wonderland", "countryCode": "WL"}]
+
+    async def fake_fetch(ip, coordinator=None):
+        return results.pop(0)
+
+    monkeypatch.setattr(main, "_fetch_geo_async", fake_fetch)
+    _post_webhook(client, src_host="8.8.4.4")
+    store = main.app.state.db_pool.store
+    store["enrichment_queue"] = {"8.8.4.4": 0}
+    assert await main._enrich_queued_source(main.app)  # lookup failed: requeued
+    assert store["enrichment_queue"] == {"8.8.4.4": 1}
+    assert await main._enrich_queued_source(main.app)
+    assert store["enrichment_queue"] == {}
+    assert store["source_details"]["8.8.4.4"]["src_isocountrycode"] == "WL"
+    assert not await main._enrich_queued_source(main.app)
+
+
+# ---------------------------------------------------------------------------
+# Tests: Attack map
+# ---------------------------------------------------------------------------
+
+def test_map_resolution_and_bbox(client):
+    assert [main._map_resolution(z) for z in (0, 2, 4, 6, 12)] == [0, 1, 2, 3, 3]
+    main.app.state.db_pool.store["geo_cells"] = [(37.751234567, -97.822, 3, 42)]
+    r = client.get("/api/map", params={"zoom": 4, "bbox": "170,-10,-170,10.2"})
+    assert r.status_code == 200
+    body = r.json()
+    assert body["resolution"] == 2 and body["cell_size"] == 0.5
+    assert body["data"] == [[37.7512, -97.822, 3, 42]]
+    # Antimeridian crossing: cells east of 170E or west of 170W
+    assert main.app.state.db_pool.store["map_params"] == (2, 160, 200, 700, 20)
+    assert client.get("/api/map", params={"bbox": "1,2,3"}).status_code == 400
+
+
+# ---------------------------------------------------------------------------
+# Tests: Breakdowns
+# ---------------------------------------------------------------------------
+
+def test_breakdown_ranks_and_paginates(client):
+    sd = main.app.state.db_pool.store["source_details"]
+    for ip, asn, seen in (("1.1.1.1", 13335, 5), ("1.0.0.1", 13335, 1), ("8.8.8.8", 15169, 4)):
+        sd[ip] = {"src_host": ip, "src_asnum": asn, "src_asorg": f"AS{asn} org", "times_seen": seen}
+    r = client.get("/api/breakdown/asn", params={"per_page": 1})
+    body = r.json()
+    assert r.status_code == 200
+    assert body["total"] == 2
+    assert body["data"] == [{"value": "13335", "label": "AS13335 org", "sources": 2, "events": 6}]
+    r = client.get("/api/breakdown/asn", params={"per_page": 1, "page": 2})
+    assert r.json()["data"][0]["value"] == "15169"
+    assert client.get("/api/breakdown/city").status_code == 404
+    assert client.get("/api/breakdown/asn", params={"sort": "name"}).status_code == 400
+
+
+# ---------------------------------------------------------------------------
+# Tests: source_details cache
+# ---------------------------------------------------------------------------
+
+def test_ttl_cache_lru_and_ttl(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(time, "monotonic", lambda: clock[0])
+    cache = main._TTLCache(max_size=2, ttl=10)
+    cache.put("a", {"src_host": "a"})
+    cache.put("b", None)
+    assert cache.get_many(["a", "b", "c"]) == ({"a": {"src_host": "a"}, "b": None}, ["c"])
+    cache.put("c", None)  # evicts the least recently used ("a")
+    assert cache.get_many(["a"]) == ({}, ["a"])
+    clock[0] += 11
+    assert cache.get_many(["c"]) == ({}, ["c"])
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["hits"] == 2
+
+
+def test_source_details_batch_reads_through_cache(client, monkeypatch):
+    store = main.app.state.db_pool.store
+    store["source_details"]["9.9.9.9"] = {"src_host": "9.9.9.9", "src_isocountrycode": "US"}
+    r = client.post("/api/source_details/batch", json={"ips": ["9.9.9.9", "8.8.8.8"]})
+    assert r.json()["data"] == {"9.9.9.9": "US"}
+    assert store["source_queries"] == 1
+    # Both the hit and the negative entry are served from memory
+    client.post("/api/source_details/batch", json={"ips": ["9.9.9.9", "8.8.8.8"]})
+    assert client.get("/api/source_details/9.9.9.9").json()["data"][0]["src_isocountrycode"] == "US"
+    assert store["source_queries"] == 1
+    # A newly ingested source drops its negative entry
+    _post_webhook(client, src_host="8.8.8.8")
+    client.post("/api/source_details/batch", json={"ips": ["8.8.8.8"]})
+    assert store["source_queries"] == 2
+
+    monkeypatch.setenv("SOURCE_BATCH_MAX", "2")
+    r = client.post("/api/source_details/batch", json={"ips": ["1.1.1.1", "2.2.2.2", "3.3.3.3"]})
+    assert r.status_code == 413
+
+
+# ---------------------------------------------------------------------------
+# Tests: Prefix geo cache
+# ---------------------------------------------------------------------------
+
+@pytest.mark.asyncio
+async def test_fetch_geo_reuses_lookup_within_prefix(monkeypatch):
+    calls = []
+
+    class FakeResponse:
+        status_code = 200
+
+        def json(self):
+            return {"status": "success", "query": "203.0.113.5", "reverse": "a.example",
+                    "countryCode": "WL", "as": "AS64500 Rabbit Hole"}
+
+    class FakeClient:
+        def __init__(self, *a, **k):
+            pass
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        async def get(self, url):
+            calls.append(url)
+            return FakeResponse()
+
+    monkeypatch.setattr(main.httpx, "AsyncClient", FakeClient)
+    monkeypatch.setattr(main, "_GEO_PREFIX_CACHE", main._TTLCache(100, 60))
+    first = await main._fetch_geo_async("203.0.113.5")
+    assert not main._geo_columns(first)["src_geo_inferred"]
+    neighbour = await main._fetch_geo_async("203.0.113.77")
+    assert len(calls) == 1
+    assert neighbour["countryCode"] == "WL" and "reverse" not in neighbour
+    columns = main._geo_columns(neighbour)
+    assert columns["src_geo_inferred"] and columns["src_asnum"] == 64500
+    await main._fetch_geo_async("203.0.114.5")  # different /24
+    assert len(calls) == 2
+    assert main._geo_prefix("2001:db8::1") == "2001:db8::/64"
+
+
+# ---------------------------------------------------------------------------
+# Tests: Enrichment pipeline
+# ---------------------------------------------------------------------------
+
+@pytest.mark.asyncio
+async def test_enrichment_stages_run_concurrently_with_own_timeouts():
+    class Stage(main._Enricher):
+        def __init__(self, name, delay, columns, **kwargs):
+            super().__init__(concurrency=1, **kwargs)
+            self.name, self.delay, self.columns = name, delay, columns
+
+        async def lookup(self, ip):
+            await asyncio.sleep(self.delay)
+            return self.columns
+
+    pipeline = main._EnrichmentPipeline([
+        Stage("geo", 0.05, {"src_asnum": 1, "src_reversedns": None}, timeout=1),
+        Stage("asn", 0.05, {"src_asnum": 2, "src_asorg": "Local"}, timeout=1),
+        Stage("slow", 10, {"src_reversedns": "never"}, timeout=0.1),
+    ])
+    start = time.perf_counter()
+    results = await pipeline.run("203.0.113.9")
+    assert time.perf_counter() - start < 1
+    assert results["slow"] == {}
+    assert pipeline.merge(results) == {"src_asnum": 1, "src_asorg": "Local"}
+    stats = pipeline.stats()
+    assert stats["slow"]["timeouts"] == 1
+    assert stats["geo"]["calls"] == 1 and stats["geo"]["p50_ms"] >= 40
+    await pipeline.run("203.0.113.9")  # served from the per-stage caches
+    assert pipeline.stats()["geo"]["calls"] == 1
+
+
+@pytest.mark.asyncio
+async def test_local_asn_and_threat_list_enrichers(tmp_path):
+    asn_file = tmp_path / "ip2asn-combined.tsv"
+    asn_file.write_text(
+        "1.0.0.0\t1.0.0.255\t13335\tUS\tCLOUDFLARENET\n"
+        "2001:db8::\t2001:db8:ffff:ffff:ffff:ffff:ffff:ffff\t64500\tZZ\tDOC\n"
+        "5.0.0.0\t5.0.0.255\t0\tNone\tNot routed\n"
+    )
+    asn = main._AsnEnricher(str(asn_file), concurrency=1, timeout=1)
+    assert await asn.enrich("1.0.0.77") == {"src_asnum": 13335, "src_asorg": "CLOUDFLARENET"}
+    assert await asn.enrich("2001:db8::5") == {"src_asnum": 64500, "src_asorg": "DOC"}
+    assert await asn.enrich("5.0.0.1") == {}
+
+    tor = tmp_path / "tor.txt"
+    tor.write_text("# exit nodes\n203.0.113.0/25\n203.0.113.64/26 ; overlap\n198.51.100.7\n")
+    threat = main._ThreatListEnricher({"tor": str(tor)}, concurrency=1, timeout=1)
+    assert len(threat.tables["tor"]) == 2
+    assert await threat.enrich("203.0.113.100") == {"src_threat_tags": ["tor"]}
+    assert await threat.enrich("203.0.113.200") == {}
+
+
+@pytest.mark.asyncio
+async def test_reverse_dns_runs_on_its_own_bounded_threads(monkeypatch):
+    release = threading.Event()
+    calls = []
+
+    def slow_getnameinfo(sockaddr, flags):
+        calls.append(sockaddr[0])
+        release.wait(5)
+        return "scanner.example.net", "0"
+
+    monkeypatch.setattr(main.socket, "getnameinfo", slow_getnameinfo)
+    rdns = main._ReverseDnsEnricher(concurrency=1, timeout=0.05, cache_size=0)
+    assert await rdns.enrich("203.0.113.1") == {}  # timed out, thread still busy
+    assert await rdns.enrich("203.0.113.2") == {}  # skipped, nothing queued
+    assert calls == ["203.0.113.1"]
+    assert rdns.stats()["skipped"] == 1 and rdns.stats()["busy_threads"] == 1
+    release.set()
+    while rdns.busy:
+        await asyncio.sleep(0.01)
+    assert await rdns.enrich("203.0.113.3") == {"src_reversedns": "scanner.example.net"}
+
+
+def test_reverse_dns_is_off_by_default(monkeypatch):
+    monkeypatch.delenv("ENRICH_RDNS", raising=False)
+    assert [s.name for s in main._build_enrichment(None).stages] == ["geo"]
+    monkeypatch.setenv("ENRICH_RDNS", "true")
+    assert "rdns" in [s.name for s in main._build_enrichment(None).stages]
+
+
+# ---------------------------------------------------------------------------
+# Tests: Field projection and columnar responses
+# ---------------------------------------------------------------------------
+
+def test_logs_fields_and_columnar(client):
+    _post_webhook(client, src_host="1.2.3.4")
+    _post_webhook(client, src_host="1.2.3.4", dst_port=2222)
+    r = client.get("/api/logs", params={"src": "1.2.3.4", "fields": "dst_port,node_id"})
+    assert r.json()["data"] == [{"dst_port": 22, "node_id": "node1"}, {"dst_port": 2222, "node_id": "node1"}]
+    r = client.get("/api/logs", params={"src": "1.2.3.4", "fields": "dst_port", "format": "columnar"})
+    body = r.json()
+    assert body["columns"] == ["dst_port"] and body["rows"] == [[22], [2222]]
+    assert "data" not in body
+    r = client.get("/api/logs", params={"fields": "times_seen,src_host", "format": "columnar"})
+    body = r.json()
+    assert body["columns"] == ["times_seen", "src_host"] and body["rows"] == [[2, "1.2.3.4"]]
+    assert body["total"] == 1
+    bad = client.get("/api/logs", params={"src": "1.2.3.4", "fields": "dst_port,1;drop table x"})
+    assert bad.status_code == 400
+    assert client.get("/api/logs", params={"format": "xml"}).status_code == 400
+
+
+def test_source_batch_fields_and_columnar(client):
+    store = main.app.state.db_pool.store
+    store["source_details"]["9.9.9.9"] = {"src_host": "9.9.9.9", "src_isocountrycode": "US", "src_city": "Berkeley"}
+    ips = {"ips": ["9.9.9.9", "8.8.8.8"]}
+    r = client.post("/api/source_details/batch", params={"fields": "src_city"}, json=ips)
+    assert r.json()["data"] == {"9.9.9.9": {"src_city": "Berkeley"}}
+    r = client.post("/api/source_details/batch", params={"format": "columnar"}, json=ips)
+    assert r.json()["columns"] == ["src_host", "src_isocountrycode"]
+    assert r.json()["rows"] == [["9.9.9.9", "US"]]
+
+
+def test_export_fields_projection(client):
+    client.get("/api/export/events", params={"fields": "utc_time,src_host"})
+    sql, _ = main.app.state.db_pool.store["copies"][-1]
+    assert sql.startswith("COPY (SELECT utc_time, src_host FROM webhook_logs)")
+    assert client.get("/api/export/sources", params={"fields": "password"}).status_code == 400
+
+
+# ---------------------------------------------------------------------------
+# Tests: Hot sources
+# ---------------------------------------------------------------------------
+
+def test_rate_tracker_window_eviction_and_alerts(monkeypatch):
+    clock = [1_000_000.0]
+    monkeypatch.setattr(time, "time", lambda: clock[0])
+    tracker = main._RateTracker(window=60, buckets=12, max_sources=2)
+    alerts = []
+    tracker.alert_events, tracker.alert_spread = 5, 3
+    tracker.hooks.append(alerts.append)
+    for port in range(6):
+        tracker.record("203.0.113.1", "node1", 20 + port)
+    tracker.record("203.0.113.2", "node1", 22)
+    assert [a["src_host"] for a in alerts] == ["203.0.113.1"]
+    assert alerts[0]["events"] == 5 and alerts[0]["ports"] == 5
+    top = tracker.top()
+    assert top[0] == {"src_host": "203.0.113.1", "events": 6, "per_minute": 6.0, "nodes": 1, "ports": 6}
+    clock[0] += 30
+    tracker.record("203.0.113.2", "node2", 22)
+    assert [(h["events"], h["nodes"]) for h in tracker.top()] == [(6, 1), (2, 2)]
+    clock[0] += 31  # the first burst has left the window
+    assert [h["src_host"] for h in tracker.top()] == ["203.0.113.2"]
+    tracker.record("203.0.113.3")  # over max_sources: least recently active goes
+    assert len(tracker) == 2 and tracker.evictions == 1
+    assert "203.0.113.1" not in tracker._sources
+
+
+def test_hot_sources_endpoint_and_rebuild(client):
+    for _ in range(3):
+        _post_webhook(client, src_host="1.2.3.4", utc_time=datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"))
+    _post_webhook(client, src_host="5.6.7.8")
+    body = client.get("/api/hot_sources", params={"min_events": 2}).json()
+    assert body["window"] == 60
+    assert [(h["src_host"], h["events"]) for h in body["data"]] == [("1.2.3.4", 3)]
+
+    # A fresh tracker recovers recent events from webhook_logs
+    main.app.state.rate_tracker = main._RateTracker()
+    asyncio.run(main._rebuild_rates(main.app))
+    assert [(h["src_host"], h["events"]) for h in main.app.state.rate_tracker.top()] == [("1.2.3.4", 3)]
+
+
+def test_rate_rebuild_skips_events_recorded_live(client):
+    tracker = main.app.state.rate_tracker = main._RateTracker()
+    tracker.started -= 5
+    now = datetime.now(timezone.utc)
+    _post_webhook(client, src_host="1.2.3.4", utc_time=(now - timedelta(seconds=20)).strftime("%Y-%m-%d %H:%M:%S"))
+    # Arrives after the tracker started: recorded live and stored
+    _post_webhook(client, src_host="1.2.3.4", utc_time=now.strftime("%Y-%m-%d %H:%M:%S"))
+    asyncio.run(main._rebuild_rates(main.app))
+    # 2 live + 1 replayed from before the start; the newer row is not replayed
+    assert [(h["src_host"], h["events"]) for h in tracker.top()] == [("1.2.3.4", 3)]
+
+
+# ---------------------------------------------------------------------------
+# Tests: Migrations
+# ---------------------------------------------------------------------------
+
+class _Rows:
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    async def fetchall(self):
+        return self.rows
+
+
+class _MigrationConn:
+    """Records statements; answers the lock and applied-version queries."""
+
+    def __init__(self, applied=(), locked=False):
+        self.applied = set(applied)
+        self.locked = locked
+        self.statements = []
+        self.transactions = 0
+
+    async def execute(self, sql, params=None):
+        self.statements.append(sql)
+        rows = []
+        if "pg_try_advisory_lock" in sql:
+            rows = [(not self.locked,)]
+        elif sql.startswith("SELECT version FROM schema_migrations"):
+            rows = [(v,) for v in self.applied]
+        elif sql.startswith("INSERT INTO schema_migrations"):
+            self.applied.add(params[0])
+        return _Rows(rows)
+
+    def transaction(self):
+        conn = self
+
+        class _Tx:
+            async def __aenter__(self):
+                conn.transactions += 1
+
+            async def __aexit__(self, *exc):
+                return False
+
+        return _Tx()
+
+
+def test_load_and_apply_migrations(tmp_path):
+    (tmp_path / "0002_indexes.sql").write_text(
+        "-- migrate: no-transaction\n-- comment\nCREATE INDEX CONCURRENTLY IF NOT EXISTS a ON t (x);\n\n"
+        "DROP INDEX CONCURRENTLY IF EXISTS b;\n"
+    )
+    (tmp_path / "0001_table.sql").write_text("CREATE TABLE t (x int);\nCREATE FUNCTION f() AS $$ SELECT 1; $$;\n")
+    (tmp_path / "notes.txt").write_text("ignored")
+    migrations = main._load_migrations(str(tmp_path))
+    assert [(m.version, m.name, m.transactional) for m in migrations] == [
+        (1, "table", True),
+        (2, "indexes", False),
+    ]
+    assert migrations[1].statements() == [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS a ON t (x)",
+        "DROP INDEX CONCURRENTLY IF EXISTS b",
+    ]
+
+    conn = _MigrationConn(applied=[1])
+    assert asyncio.run(main._migrate(conn, migrations)) == [2]
+    assert conn.applied == {1, 2} and conn.transactions == 0
+    assert "CREATE TABLE t (x int);" not in "".join(conn.statements)
+    assert "pg_advisory_unlock" in conn.statements[-1]
+    assert asyncio.run(main._migrate(conn, migrations)) == []
+
+    fresh = _MigrationConn()
+    assert asyncio.run(main._migrate(fresh, migrations)) == [1, 2]
+    assert fresh.transactions == 1
+
+    busy = _MigrationConn(locked=True)
+    assert asyncio.run(main._migrate(busy, migrations)) is None
+    assert busy.applied == set()
+
+
+def test_manual_migrations_wait_for_migrate_tool(tmp_path):
+    (tmp_path / "0001_table.sql").write_text("CREATE TABLE t (x int);\n")
+    (tmp_path / "0002_backfill.sql").write_text("-- migrate: manual\n--\n-- Slow.\nINSERT INTO t SELECT 1;\n")
+    (tmp_path / "0003_index.sql").write_text("-- migrate: no-transaction\nCREATE INDEX CONCURRENTLY IF NOT EXISTS a ON t (x);\n")
+    migrations = main._load_migrations(str(tmp_path))
+    assert [(m.manual, m.transactional) for m in migrations] == [(False, True), (True, True), (False, False)]
+
+    conn = _MigrationConn()
+    # Startup stops at the manual migration; later ones wait for it
+    assert asyncio.run(main._migrate(conn, migrations)) == [1]
+    assert asyncio.run(main._migrate(conn, migrations, manual=True)) == [2, 3]
+
+
+def test_shipped_migrations_are_concurrent():
+    migrations = {m.version: m for m in main._load_migrations()}
+    assert migrations[0].name == "baseline" and migrations[0].transactional
+    for statement in migrations[1].statements():
+        assert "CONCURRENTLY" in statement
+
+
+def test_migrations_create_everything_init_sql_does():
+    root = os.path.join(os.path.dirname(__file__), "..")
+    with open(os.path.join(root, "infra", "initdb", "init.sql")) as f:
+        init_sql = f.read()
+    migrated = "".join(m.sql for m in main._load_migrations())
+    pattern = r"CREATE (?:TABLE|(?:UNIQUE )?INDEX|OR REPLACE TRIGGER) (?:CONCURRENTLY )?(?:IF NOT EXISTS )?(\w+)"
+    # Only the original two tables and their first indexes predate migrations
+    original = {"webhook_logs", "source_details", "uq_source_details_src_host", "idx_webhook_logs_utc_time", "idx_webhook_logs_src_host"}
+    original.add("schema_migrations")  # created by db._migrate
+    assert set(re.findall(pattern, init_sql)) - original <= set(re.findall(pattern, migrated))
+    for column in re.findall(r"ADD COLUMN IF NOT EXISTS (\w+)", migrated):
+        assert column in init_sql
+
+
+def test_generate_dataset_distributions():
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tools"))
+    import random
+    import generate_dataset
+
+    rng = random.Random(1)
+    ips = generate_dataset._public_ips(rng, 200)
+    assert len(set(ips)) == 200 and all(main._is_public_candidate(ip) for ip in ips)
+    counts = Counter(generate_dataset._Zipf(rng, ips, 1.1).sample(20000))
+    ranked = [counts[ip] for ip in ips]
+    # The head dominates and the tail is thin, in rank order.
+    assert ranked[0] > 5 * ranked[9] > 0 and ranked[0] > sum(ranked[100:])
+
+
+# ---------------------------------------------------------------------------
+# Tests: Recent events
+# ---------------------------------------------------------------------------
+
+def test_recent_events_ring():
+    recent = main._RecentEvents(3)
+    assert recent.latest(10) == []
+    for i in range(5):
+        recent.add(main._parse_event({"src_host": f"198.51.100.{i}", "dst_port": i}))
+    assert len(recent) == 3
+    assert [r[1] for r in recent.latest(10)] == ["198.51.100.4", "198.51.100.3", "198.51.100.2"]
+
+    # Seeded rows go behind live ones and the ring stays bounded
+    recent = main._RecentEvents(3)
+    recent.add(main._parse_event({"src_host": "198.51.100.9"}))
+    recent.seed([(None, "203.0.113.1") + (None,) * 5, (None, "203.0.113.2") + (None,) * 5])
+    assert [r[1] for r in recent.latest(3)] == ["198.51.100.9", "203.0.113.1", "203.0.113.2"]
+    recent.add(main._parse_event({"src_host": "198.51.100.10"}))
+    assert [r[1] for r in recent.latest(3)] == ["198.51.100.10", "198.51.100.9", "203.0.113.1"]
+
+
+def test_recent_events_seed_skips_events_already_added():
+    recent = main._RecentEvents(5)
+    live = [
+        main._parse_event({"src_host": "198.51.100.1", "utc_time": "2025-08-28 18:00:01", "dst_port": 22}),
+        main._parse_event({"src_host": "198.51.100.1", "utc_time": "2025-08-28 18:00:01", "dst_port": 22}),
+    ]
+    for event in live:
+        recent.add(event)
+    older = (datetime(2025, 8, 28, 17), "203.0.113.1") + (None,) * 5
+    # Both live events were stored by the time the ring is seeded, and an
+    # identical third one predates startup; only that one should be added.
+    recent.seed([main._recent_row(live[0])] * 3 + [older])
+    assert [r[1] for r in recent.latest(5)] == ["198.51.100.1"] * 3 + ["203.0.113.1"]
+
+
+def test_recent_endpoint(client):
+    _post_webhook(client, src_host="1.2.3.4", utc_time="2025-08-28 18:37:49.453000")
+    _post_webhook(client, src_host="5.6.7.8", utc_time="2025-08-28 18:38:00.000000")
+    body = client.get("/api/recent", params={"limit": 1}).json()
+    assert [e["src_host"] for e in body["data"]] == ["5.6.7.8"]
+    body = client.get("/api/recent", params={"format": "columnar"}).json()
+    assert body["columns"] == list(main._RECENT_FIELDS)
+    assert [r[1] for r in body["rows"]] == ["5.6.7.8", "1.2.3.4"]
+
+    # A restarted worker seeds itself from webhook_logs
+    main.app.state.recent_events = main._RecentEvents(10)
+    asyncio.run(main._seed_recent_events(main.app))
+    assert [r[1] for r in main.app.state.recent_events.latest(10)] == ["5.6.7.8", "1.2.3.4"]
+
+
+# ---------------------------------------------------------------------------
+# Tests: Nodes
+# ---------------------------------------------------------------------------
+
+def test_node_endpoints_and_log_filter(client):
+    now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    _post_webhook(client, src_host="1.2.3.4", node_id="canary-a", dst_port=22, utc_time=now)
+    _post_webhook(client, src_host="1.2.3.4", node_id="canary-a", dst_port=22, utc_time=now)
+    _post_webhook(client, src_host="5.6.7.8", node_id="canary-a", dst_port=80, utc_time=now)
+    _post_webhook(client, src_host="5.6.7.8", node_id="canary-b", dst_port=22, utc_time=now)
+
+    data = client.get("/api/nodes").json()["data"]
+    assert [(n["node_id"], n["events"], n["sources"]) for n in data] == [
+        ("canary-a", 3, 2),
+        ("canary-b", 1, 1),
+    ]
+
+    body = client.get("/api/nodes/canary-a/stats", params={"top": 1}).json()
+    assert body["events"] == 3 and body["sources"] == 2
+    assert len(body["series"]) == 1 and body["series"][0][1] == 3
+    assert body["top_ports"] == [{"value": 22, "events": 2}]
+    assert body["top_sources"] == [{"value": "1.2.3.4", "events": 2}]
+    assert client.get("/api/nodes/unknown/stats").status_code == 404
+
+    logs = client.get("/api/logs", params={"node_id": "canary-b"}).json()
+    assert logs["total"] == 1 and [r["src_host"] for r in logs["data"]] == ["5.6.7.8"]
+    logs = client.get("/api/logs", params={"src": "5.6.7.8", "node_id": "canary-a"}).json()
+    assert [r["dst_port"] for r in logs["data"]] == [80]
+
+
+def test_nodes_before_rollup_migration(client, monkeypatch):
+    monkeypatch.setitem(FakePool.shared_store, "missing_tables", {"node_rollups", "node_rollup_values"})
+    _post_webhook(client, src_host="1.2.3.4", node_id="canary-a")
+    _post_webhook(client, src_host="5.6.7.8", node_id="canary-b")
+    _post_webhook(client, src_host="5.6.7.8", node_id="canary-b")
+    # The stats bar falls back to counting webhook_logs
+    assert client.get("/api/stats").json()["top_node"] == "canary-b"
+    r = client.get("/api/nodes")
+    assert r.status_code == 503 and "tools/migrate.py" in r.json()["message"]
+    assert client.get("/api/nodes/canary-a/stats").status_code == 503
+
+
+def test_source_lists_before_rollup_migration(client, monkeypatch):
+    monkeypatch.setitem(FakePool.shared_store, "missing_tables", {"source_rollups", "source_node_rollups"})
+    _post_webhook(client, src_host="1.2.3.4", node_id="canary-a", utc_time="2025-01-01 00:00:01")
+    _post_webhook(client, src_host="5.6.7.8", node_id="canary-b", utc_time="2025-01-01 00:00:02")
+    # Lists, totals and the stats bar are aggregated from webhook_logs instead
+    body = client.get("/api/logs").json()
+    assert [r["src_host"] for r in body["data"]] == ["5.6.7.8", "1.2.3.4"] and body["total"] == 2
+    body = client.get("/api/logs", params={"node_id": "canary-a"}).json()
+    assert [r["src_host"] for r in body["data"]] == ["1.2.3.4"] and body["total"] == 1
+    body = client.get("/api/dashboard").json()
+    assert body["total"] == 2 and body["stats"]["total_unique_srcs"] == 2
+
+
+# ---------------------------------------------------------------------------
+# Tests: IP filter
+# ---------------------------------------------------------------------------
+
+# Fixed expectations rather than the interpreter's ipaddress properties,
+# whose tables change between Python versions (3.13 reclassified 192.0.0.8,
+# 2002::/16, 2001:1::1 and others).
+_PUBLIC_EXPECTED = {
+    "": False, "not-an-ip": False, "1.2.3": False, "01.2.3.4": False, "999.1.1.1": False,
+    "8.8.8.8": True, "1.1.1.1": True, "0.255.255.255": False, "1.0.0.0": True,
+    "9.255.255.255": True, "10.0.0.0": False, "10.255.255.255": False, "11.0.0.0": True,
+    "100.63.255.255": True, "100.64.0.1": False, "100.127.255.255": False, "100.128.0.0": True,
+    "127.0.0.1": False, "169.254.1.1": False, "172.15.255.255": True, "172.16.0.1": False,
+    "172.31.255.255": False, "172.32.0.0": True, "192.0.0.7": False, "192.0.0.8": True,
+    "192.0.0.9": True, "192.0.0.170": False, "192.0.0.171": False, "192.0.0.172": True,
+    "192.0.2.1": False, "192.88.99.1": True, "192.167.255.255": True, "192.168.1.1": False,
+    "198.17.255.255": True, "198.18.0.1": False, "198.19.255.255": False, "198.20.0.0": True,
+    "198.51.100.7": False, "203.0.113.9": False, "223.255.255.255": True, "224.0.0.1": False,
+    "239.255.255.255": False, "240.0.0.1": False, "255.255.255.255": False,
+    "::": False, "::1": False, "::ffff:8.8.8.8": False, "fe80::1%eth0": False,
+    "100::1": False, "2001::1": False, "2001:1::1": False, "2001:1ff:ffff::1": False,
+    "2001:200::1": True, "2001:4860:4860::8888": True, "2001:db8::1": False, "2002::1": True,
+    "2606:4700::1111": True, "3fff:ffff::1": True, "4000::1": False, "fc00::1": False,
+    "fd12:3456::1": False, "fe80::1": False, "fec0::1": True, "ff02::1": False,
+}
+
+
+def test_builtin_ip_filter_expected_table():
+    for ip, public in _PUBLIC_EXPECTED.items():
+        assert main._is_public_candidate(ip) is public, ip
+
+
+def test_builtin_ip_filter_matches_listed_networks():
+    import ipaddress
+    import random
+
+    nets = [ipaddress.ip_network(n) for n in events._BUILTIN_EXCLUDED_NETS]
+    samples = []
+    for net in nets:
+        first, last = int(net.network_address), int(net.broadcast_address)
+        top = (1 << net.max_prefixlen) - 1
+        for value in (first - 1, first, last, last + 1):
+            if 0 <= value <= top:
+                samples.append(ipaddress.ip_address(value) if net.version == 4 else ipaddress.IPv6Address(value))
+    rng = random.Random(7)
+    samples += [ipaddress.IPv4Address(rng.getrandbits(32)) for _ in range(5000)]
+    samples += [ipaddress.IPv6Address(rng.getrandbits(128)) for _ in range(2000)]
+    for ip in samples:
+        listed = any(ip.version == net.version and ip in net for net in nets)
+        assert main._is_public_candidate(str(ip)) is not listed, ip
+
+
+def test_ingest_filter_deny_allow(client, monkeypatch):
+    ip_filter = events._IpFilter(deny=["198.18.0.0/15", "8.8.8.0/24", "2606:4700::/32"], allow=["8.8.8.8/32"])
+    assert not ip_filter.accepts("8.8.8.9") and not ip_filter.accepts("2606:4700::1")
+    assert ip_filter.accepts("8.8.8.8") and ip_filter.accepts("8.8.4.4")
+    assert ip_filter.accepts("not-an-ip") and not ip_filter.public("not-an-ip")
+    # Deny doesn't change what counts as public, and vice versa
+    assert ip_filter.public("8.8.8.9") and not ip_filter.accepts("198.18.0.1")
+
+    main.app.state.ip_filter = ip_filter
+    r = _post_webhook(client, src_host="8.8.8.9")
+    assert r.json() == {"status": "filtered"}
+    assert _post_webhook(client, src_host="8.8.8.8").json()["status"] == "success"
+    logs = client.get("/api/logs").json()["data"]
+    assert [row["src_host"] for row in logs] == ["8.8.8.8"]
+
+    monkeypatch.setenv("INGEST_DENY_CIDRS", "192.0.2.0/24, 2001:db8::/32")
+    monkeypatch.setenv("INGEST_ALLOW_CIDRS", "192.0.2.1")
+    built = main._build_ip_filter()
+    assert built.deny == ("192.0.2.0/24", "2001:db8::/32") and built.accepts("192.0.2.1")
+
+
+# ---------------------------------------------------------------------------
+# Tests: Dashboard
+# ---------------------------------------------------------------------------
+
+def test_dashboard_bundle(client):
+    store = FakePool.shared_store
+    _post_webhook(client, src_host="1.2.3.4", utc_time="2025-01-01 00:00:01")
+    _post_webhook(client, src_host="5.6.7.8", utc_time="2025-01-01 00:00:02")
+    store["source_details"]["5.6.7.8"]["src_isocountrycode"] = "NL"
+
+    body = client.get("/api/dashboard", params={"per_page": 1}).json()
+    assert body["data"] == [
+        {"src_host": "5.6.7.8", "last_seen": "2025-01-01 00:00:02 ", "times_seen": 1, "country": "NL"}
+    ]
+    assert body["total"] == 2 and body["page"] == 1 and body["per_page"] == 1
+    assert body["stats"]["total_unique_srcs"] == 2 and "top_username" in body["stats"]
+    page2 = client.get("/api/dashboard", params={"page": 2, "per_page": 1}).json()
+    assert [r["src_host"] for r in page2["data"]] == ["1.2.3.4"]
+
+    assert page2["total"] == 2
+    past = client.get("/api/dashboard", params={"page": 5, "per_page": 1}).json()
+    assert past["data"] == [] and past["total"] == 2
+
+    # Stats come from the cache until it expires; the total is always current
+    _post_webhook(client, src_host="9.9.9.9", utc_time="2025-01-01 00:00:03")
+    body = client.get("/api/dashboard").json()
+    assert len(body["data"]) == 3 and body["total"] == 3
+    assert body["stats"]["total_unique_srcs"] == 2
+    main.app.state.stats_cache.invalidate("stats")
+    assert client.get("/api/dashboard").json()["stats"]["total_unique_srcs"] == 3
+
+
+@pytest.mark.asyncio
+async def test_dashboard_stats_refresh_single_flight(client, monkeypatch):
+    _post_webhook(client, src_host="1.2.3.4", utc_time="2025-01-01 00:00:01")
+    main.app.state.stats_cache.invalidate("stats")
+    calls = []
+    gate = asyncio.Event()
+
+    async def slow_stats(cur):
+        calls.append(1)
+        await gate.wait()
+        return {"total_unique_srcs": 1}
+
+    monkeypatch.setattr(main, "_query_stats", slow_stats)
+    request = SimpleNamespace(app=main.app)
+    waiters = [asyncio.ensure_future(main.get_dashboard(request)) for _ in range(5)]
+    for _ in range(5):
+        await asyncio.sleep(0)
+    gate.set()
+    responses = await asyncio.gather(*waiters)
+    assert calls == [1]
+    assert all(json.loads(r.body)["stats"] == {"total_unique_srcs": 1} for r in responses)
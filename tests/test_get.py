@@ -24,4 +24,14 @@ def test_stats_endpoint():
     assert "top_username" in data
     assert "top_password" in data
     assert "top_node" in data
-    assert "total_unique_srcs" in data
\ No newline at end of file
+    assert "total_unique_srcs" in data
+
+def test_dashboard_endpoint():
+    response = requests.get("http://localhost:8081/api/dashboard")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/json")
+    data = response.json()
+    assert data["status"] == "success"
+    assert "data" in data
+    assert "total" in data
+    assert "top_src" in data["stats"]
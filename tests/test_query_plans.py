@@ -0,0 +1,238 @@
+"""
+Query-plan regression tests. Every SQL statement the API endpoints send
+through main._execute, plus the ingest, background, import and export
+statements that bypass it, is re-run with EXPLAIN (ANALYZE, BUFFERS, FORMAT
+JSON) against a database filled by tools/generate_dataset.py. A test fails when a plan falls back to a
+sequential scan of webhook_logs or source_details, or when a statement takes
+longer than QUERY_PLAN_BUDGET_MS (default 500).
+
+Skipped unless QUERY_PLAN_TESTS is set; uses the same POSTGRES_* variables
+as the app:
+
+    uv run python tools/generate_dataset.py --events 5000000 --reset
+    QUERY_PLAN_TESTS=1 uv run pytest -s tests/test_query_plans.py
+
+Set QUERY_PLAN_OUTPUT to a directory to keep the JSON plans for diffing.
+"""
+import json
+import os
+import re
+import sys
+from datetime import datetime, timedelta, timezone
+
+import psycopg
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+pytestmark = pytest.mark.skipif(
+    not os.getenv("QUERY_PLAN_TESTS"), reason="set QUERY_PLAN_TESTS to run against a generated dataset"
+)
+
+_BIG_TABLES = {"webhook_logs", "source_details"}
+_BUDGET_MS = float(os.getenv("QUERY_PLAN_BUDGET_MS", "500"))
+
+# (method, path, params); {src} is replaced by the busiest source.
+_ENDPOINTS = [
+    ("GET", "/api/logs", {}),
+    ("GET", "/api/logs", {"page": 100}),
+    ("GET", "/api/logs", {"src": "{src}"}),
+    ("GET", "/api/logs", {"src": "{src}", "fields": "utc_time,node_id,dst_port"}),
+    ("GET", "/api/stats", {}),
+    ("GET", "/api/source_details/{src}", {}),
+    ("POST", "/api/source_details/batch", {}),
+    ("GET", "/api/breakdown/asn", {}),
+    ("GET", "/api/breakdown/country", {"sort": "sources"}),
+    ("GET", "/api/map", {}),
+    ("GET", "/api/map", {"zoom": 6, "bbox": "0,40,20,55"}),
+    ("GET", "/api/nodes", {}),
+    ("GET", "/api/nodes/canary-00/stats", {}),
+    ("GET", "/api/logs", {"node_id": "canary-00"}),
+    ("GET", "/api/dashboard", {}),
+]
+
+
+@pytest.fixture(scope="module")
+def db():
+    with psycopg.connect(main._dsn(), autocommit=True) as conn:
+        yield conn
+
+
+@pytest.fixture(scope="module")
+def sources(db):
+    rows = db.execute(
+        "SELECT src_host FROM source_details ORDER BY times_seen DESC NULLS LAST LIMIT 100"
+    ).fetchall()
+    if not rows:
+        pytest.skip("no data; run tools/generate_dataset.py first")
+    return [r[0] for r in rows]
+
+
+@pytest.fixture(scope="module")
+def client():
+    with pytest.MonkeyPatch.context() as mp:
+        # Only the request path: no background enrichment, caching or migrations.
+        mp.setenv("MIGRATE_ON_STARTUP", "false")
+        mp.setenv("ENRICHMENT_QUEUE_RATE", "0")
+        mp.setenv("HOT_SOURCE_WINDOW", "0")
+        mp.setenv("SOURCE_CACHE_SIZE", "0")
+        with TestClient(main.app) as c:
+            yield c
+
+
+def _capture(monkeypatch, client, method, path, params, sources):
+    statements = []
+    original = main._execute
+
+    async def recording(cur, sql, params=None):
+        statements.append((sql, params))
+        await original(cur, sql, params)
+
+    monkeypatch.setattr(main, "_execute", recording)
+    path = path.replace("{src}", sources[0])
+    params = {k: str(v).replace("{src}", sources[0]) for k, v in params.items()}
+    if method == "POST":
+        response = client.post(path, params=params, json={"ips": sources})
+    else:
+        response = client.get(path, params=params)
+    assert response.status_code == 200, response.text
+    return statements
+
+
+def _explain(db, sql, params):
+    # ANALYZE really executes the statement; roll back anything it changes.
+    with db.transaction(force_rollback=True):
+        row = db.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql, params).fetchone()
+    return row[0][0]
+
+
+def _nodes(plan):
+    yield plan
+    for child in plan.get("Plans", ()):
+        yield from _nodes(child)
+
+
+def _check(db, name, statements):
+    failures = []
+    plans = []
+    for sql, params in statements:
+        explained = _explain(db, sql, params)
+        plans.append({"sql": sql, "plan": explained})
+        elapsed = explained["Execution Time"]
+        query = re.sub(r"\s+", " ", sql).strip()
+        print(f"{name}: {elapsed:8.1f} ms  {query[:100]}")
+        scans = [
+            n["Relation Name"]
+            for n in _nodes(explained["Plan"])
+            if n["Node Type"] == "Seq Scan" and n.get("Relation Name") in _BIG_TABLES
+        ]
+        if scans:
+            failures.append(f"seq scan on {', '.join(scans)}: {query}")
+        if elapsed > _BUDGET_MS:
+            failures.append(f"{elapsed:.0f} ms > {_BUDGET_MS:.0f} ms budget: {query}")
+    output = os.getenv("QUERY_PLAN_OUTPUT")
+    if output:
+        os.makedirs(output, exist_ok=True)
+        with open(os.path.join(output, re.sub(r"\W+", "_", name).strip("_") + ".json"), "w") as f:
+            json.dump(plans, f, indent=2, default=str)
+    assert not failures, "\n".join(failures)
+
+
+@pytest.mark.parametrize("method,path,params", _ENDPOINTS)
+def test_endpoint_plans(db, client, sources, monkeypatch, method, path, params):
+    statements = _capture(monkeypatch, client, method, path, params, sources)
+    assert statements
+    _check(db, f"{method} {path} {params}", statements)
+
+
+def test_background_plans(db, sources):
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    _check(
+        db,
+        "background",
+        [
+            (main._RECENT_RATES_SQL, (now - timedelta(seconds=60), now)),
+            (main._SEED_RECENT_SQL, (1000,)),
+            (main._DEQUEUE_ENRICHMENT_SQL, None),
+            (main._REQUEUE_ENRICHMENT_SQL, (sources[0], 1)),
+            (main._PostgresGeoCoordinator._ACQUIRE_SQL, {"name": "ip-api", "capacity": 5, "rate": 0.7}),
+            (main._PostgresGeoCoordinator._CLAIM_SQL, {"ip": sources[0], "ttl": 60}),
+            ("DELETE FROM geo_lookup_claims WHERE src_host = %s", (sources[0],)),
+        ],
+    )
+
+
+# Rows per statement standing in for one tools/import_opencanary.py COPY:
+# EXPLAIN cannot run COPY, but an INSERT ... SELECT hands the statement-level
+# triggers the same transition table.
+_IMPORT_ROWS = 10000
+
+
+def test_write_plans(db, sources):
+    """
+    Ingest, burst flushes, enrichment and imports; statements run outside
+    main._execute (pipelined, executemany or in tools). Execution Time
+    includes the AFTER triggers, so the rollup trigger bodies count against
+    the budget too.
+    """
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    row_id = db.execute("SELECT max(id) FROM webhook_logs").fetchone()[0]
+    event = main._parse_event(
+        {"src_host": sources[0], "node_id": "canary-00", "dst_port": 22, "logtype": 4002, "utc_time": str(now)}
+    ).row()
+    geo = main._geo_columns({"country": "Testland", "countryCode": "TL", "lat": 52.1, "lon": 4.3, "as": "AS64500 Test"})
+    enriched = ["src_country", "src_isocountrycode", "src_latitude", "src_longitude", "src_asnum", "src_asorg"]
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tools"))
+    import import_opencanary
+
+    hosts = sources[:50] + [f"192.0.2.{i}" for i in range(50)]
+    _check(
+        db,
+        "writes",
+        [
+            (main._INSERT_EVENT_SQL, event),
+            (main._INSERT_EVENT_SQL + " RETURNING id", event),
+            (main._UPSERT_SOURCE_SQL, {"seen": now, "src_host": sources[0]}),
+            (main._UPSERT_SOURCE_SQL, {"seen": now, "src_host": "192.0.2.1"}),
+            (
+                main._INSERT_SOURCE_SQL,
+                {"first_seen": now, "last_seen": now, "times_seen": 1, "src_host": "192.0.2.1", **geo},
+            ),
+            (main._update_source_sql(enriched), {"src_host": sources[0], **{c: geo[c] for c in enriched}}),
+            (main._FLUSH_BURSTS_SQL, (5, now, row_id)),
+            (main._FLUSH_BURST_SOURCES_SQL, (4, now, sources[0])),
+            (
+                f"""
+                INSERT INTO webhook_logs (src_host, node_id, dst_port, logtype, utc_time)
+                SELECT (%s::varchar[])[1 + i %% 100], 'canary-' || (i %% 8), 22, 4002, %s - i * interval '1 second'
+                FROM generate_series(1, {_IMPORT_ROWS}) AS i
+                """,
+                (hosts, now),
+            ),
+            (
+                import_opencanary._SEED_SOURCES_SQL,
+                (hosts, [now] * len(hosts), [now] * len(hosts), [100] * len(hosts)),
+            ),
+            (import_opencanary._ENQUEUE_SQL, (hosts[50:],)),
+            (import_opencanary._CHECKPOINT_SQL, ("/var/tmp/opencanary.log", 1 << 20, _IMPORT_ROWS)),
+        ],
+    )
+    # The rolled-back rows would otherwise cost index-only scans heap
+    # fetches in the next run.
+    db.execute("VACUUM webhook_logs, source_details")
+
+
+def test_export_plans(db, sources):
+    """The SELECT inside each filtered export's COPY ... TO STDOUT."""
+    since = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=1)
+    statements = []
+    for kind, filters in [
+        ("events", {"since": since}),
+        ("events", {"src_host": sources[0]}),
+        ("events", {"node_id": "canary-00", "since": since}),
+        ("sources", {"since": since}),
+    ]:
+        query, params = main._export_query(kind, "csv", **filters)
+        statements.append((re.match(r"COPY \((.*)\) TO STDOUT", query, re.S).group(1), params))
+    _check(db, "exports", statements)
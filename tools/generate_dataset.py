@@ -0,0 +1,210 @@
+"""
+Fill a scratch database with a large synthetic honeypot dataset, for
+query-plan and latency testing (tests/test_query_plans.py):
+
+    uv run python tools/generate_dataset.py --events 5000000 --sources 200000 --reset
+
+Sources, credentials, nodes and ports are Zipf-distributed like real scan
+traffic: a few hosts and passwords account for most events, with a long tail
+seen once or twice. Event times are skewed towards the present. Every source
+that appears gets a source_details row with synthetic geo/ASN data, so the
+breakdown, map, node and source rollup triggers populate their tables as well.
+
+Pending migrations are applied first, then rows are loaded with COPY and the
+tables are VACUUM ANALYZEd so index-only scans are possible. Uses the
+same POSTGRES_* variables as the app. Never point this at production:
+--reset truncates webhook_logs, source_details and the tables derived from
+them.
+"""
+import argparse
+import asyncio
+import ipaddress
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+
+import psycopg
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import db  # noqa: E402
+import events  # noqa: E402
+
+_EVENT_COLUMNS = (
+    "dst_host", "dst_port", "logtype", "node_id", "src_host", "src_port",
+    "utc_time", "logdata_username", "logdata_password", "repeat_count",
+)
+_SOURCE_COLUMNS = (
+    "src_host", "first_seen", "last_seen", "times_seen", "src_country",
+    "src_isocountrycode", "src_latitude", "src_longitude", "src_isp", "src_org",
+    "src_asnum", "src_asorg",
+)
+_RESET_SQL = """
+    TRUNCATE webhook_logs, source_details, source_breakdowns, source_geo_cells,
+             enrichment_queue, node_rollups, node_rollup_values, source_rollups,
+             source_node_rollups RESTART IDENTITY
+"""
+
+# (dst_port, OpenCanary logtype); credentials are only sent to login services.
+_SERVICES = (
+    (22, 4002), (23, 6001), (80, 3001), (443, 3001), (3389, 14001),
+    (21, 2000), (445, 5000), (3306, 8001), (5900, 12001), (8080, 3001),
+)
+_LOGIN_PORTS = {22, 23, 21, 3389, 3306, 5900}
+_USERNAMES = (
+    "root", "admin", "user", "test", "ubuntu", "oracle", "postgres", "pi",
+    "guest", "ftp", "support", "git", "mysql", "debian", "centos",
+)
+_PASSWORDS = (
+    "123456", "password", "admin", "root", "12345678", "qwerty", "1234",
+    "123456789", "test", "111111", "raspberry", "changeme", "P@ssw0rd",
+)
+# (country, ISO code, latitude, longitude)
+_COUNTRIES = (
+    ("China", "CN", 35.0, 105.0), ("United States", "US", 38.0, -97.0),
+    ("Russia", "RU", 60.0, 100.0), ("Brazil", "BR", -10.0, -55.0),
+    ("India", "IN", 21.0, 78.0), ("Vietnam", "VN", 16.0, 106.0),
+    ("Germany", "DE", 51.0, 9.0), ("Netherlands", "NL", 52.5, 5.75),
+    ("Korea", "KR", 37.0, 127.5), ("Indonesia", "ID", -5.0, 120.0),
+    ("France", "FR", 46.0, 2.0), ("United Kingdom", "GB", 54.0, -2.0),
+    ("Iran", "IR", 32.0, 53.0), ("Taiwan", "TW", 23.5, 121.0),
+    ("Singapore", "SG", 1.37, 103.8), ("Bulgaria", "BG", 43.0, 25.0),
+)
+
+
+class _Zipf:
+    """Draws from `population` with P(rank k) proportional to 1 / k**s."""
+
+    def __init__(self, rng, population, s):
+        self.rng = rng
+        self.population = population
+        self.cum_weights = list(accumulate(1 / k**s for k in range(1, len(population) + 1)))
+
+    def sample(self, k):
+        return self.rng.choices(self.population, cum_weights=self.cum_weights, k=k)
+
+
+def _public_ips(rng, count):
+    ips = set()
+    while len(ips) < count:
+        ip = str(ipaddress.IPv4Address(rng.getrandbits(32)))
+        if events._is_public_candidate(ip):
+            ips.add(ip)
+    ips = sorted(ips)
+    rng.shuffle(ips)
+    return ips
+
+
+def _vocabulary(base, prefix, size):
+    return list(base) + [f"{prefix}{i}" for i in range(max(0, size - len(base)))]
+
+
+def _source_profile(rng, countries, asns):
+    country, iso, lat, lon = countries.sample(1)[0]
+    asn = asns.sample(1)[0]
+    org = f"AS{asn} Hosting {iso}"
+    return (
+        country, iso,
+        round(lat + rng.uniform(-5, 5), 6), round(lon + rng.uniform(-5, 5), 6),
+        org, org, asn, org,
+    )
+
+
+def generate(conn, args):
+    rng = random.Random(args.seed)
+    sources = _Zipf(rng, _public_ips(rng, args.sources), args.zipf)
+    usernames = _Zipf(rng, _vocabulary(_USERNAMES, "user", args.credentials), args.zipf)
+    passwords = _Zipf(rng, _vocabulary(_PASSWORDS, "pass", args.credentials * 4), args.zipf)
+    nodes = _Zipf(rng, [f"canary-{i:02d}" for i in range(args.nodes)], 0.8)
+    services = _Zipf(rng, list(_SERVICES), 1.0)
+    countries = _Zipf(rng, list(_COUNTRIES), 1.0)
+    asns = _Zipf(rng, rng.sample(range(1000, 400000), 3000), args.zipf)
+    now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+    span = args.days * 86400
+
+    seen = {}  # src_host -> [first_seen, last_seen, times_seen]
+    start = time.perf_counter()
+    written = 0
+    while written < args.events:
+        size = min(args.batch, args.events - written)
+        hosts = sources.sample(size)
+        nodes_batch = nodes.sample(size)
+        services_batch = services.sample(size)
+        users, passes = usernames.sample(size), passwords.sample(size)
+        with conn.transaction():
+            with conn.cursor() as cur:
+                with cur.copy(f"COPY webhook_logs ({', '.join(_EVENT_COLUMNS)}) FROM STDIN") as copy:
+                    for i in range(size):
+                        host = hosts[i]
+                        port, logtype = services_batch[i]
+                        # Squaring skews timestamps towards now.
+                        ts = now - timedelta(seconds=int(span * rng.random() ** 2))
+                        login = port in _LOGIN_PORTS
+                        copy.write_row((
+                            "10.0.0.1", port, logtype, nodes_batch[i], host,
+                            rng.randint(1024, 65535), ts,
+                            users[i] if login else None, passes[i] if login else None, 1,
+                        ))
+                        entry = seen.get(host)
+                        if entry is None:
+                            seen[host] = [ts, ts, 1]
+                        else:
+                            entry[2] += 1
+                            if ts < entry[0]:
+                                entry[0] = ts
+                            elif ts > entry[1]:
+                                entry[1] = ts
+        written += size
+        print(
+            f"\rwebhook_logs: {written:,} events ({written / (time.perf_counter() - start):,.0f}/s)",
+            end="",
+            file=sys.stderr,
+        )
+    print(file=sys.stderr)
+
+    with conn.transaction():
+        with conn.cursor() as cur:
+            with cur.copy(f"COPY source_details ({', '.join(_SOURCE_COLUMNS)}) FROM STDIN") as copy:
+                for host, (first, last, count) in seen.items():
+                    copy.write_row((host, first, last, count, *_source_profile(rng, countries, asns)))
+    print(f"source_details: {len(seen):,} sources", file=sys.stderr)
+
+
+async def _migrate():
+    async with await psycopg.AsyncConnection.connect(db._dsn(), autocommit=True) as conn:
+        return await db._migrate(conn, db._load_migrations(), manual=True)
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--sources", type=int, default=100_000, help="distinct source addresses to draw from")
+    parser.add_argument("--credentials", type=int, default=5000, help="distinct usernames (4x as many passwords)")
+    parser.add_argument("--nodes", type=int, default=8)
+    parser.add_argument("--days", type=int, default=90, help="spread events over this many days")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent for sources and credentials")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--batch", type=int, default=100_000, help="events per COPY/commit")
+    parser.add_argument("--reset", action="store_true", help="truncate existing data first")
+    parser.add_argument("--no-migrate", action="store_true", help="skip applying infra/migrations")
+    args = parser.parse_args(argv)
+    # Migrate first: the rollup tables and their triggers must exist before
+    # the data is loaded.
+    if not args.no_migrate:
+        print(f"Applied migrations: {asyncio.run(_migrate())}", file=sys.stderr)
+    with psycopg.connect(db._dsn(), autocommit=True) as conn:
+        if args.reset:
+            conn.execute(_RESET_SQL)
+        generate(conn, args)
+        # Sets the visibility map too, so index-only scans are possible.
+        conn.execute("VACUUM (ANALYZE) webhook_logs")
+        conn.execute("VACUUM (ANALYZE) source_details")
+    return 0
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    sys.exit(main_cli())
@@ -0,0 +1,240 @@
+"""
+Bulk-load OpenCanary JSON log files (one event per line, optionally gzipped)
+that never reached /api/webhook, e.g. after an outage or when onboarding a
+new honeypot.
+
+    uv run python tools/import_opencanary.py /var/tmp/opencanary.log [more.log.gz ...]
+
+Lines are parsed with the same field mapping and INGEST_DENY_CIDRS filter as
+the webhook, loaded into webhook_logs with COPY, and source_details counts
+are seeded with one set-based upsert per batch. Sources that did not exist yet are queued in
+enrichment_queue, which the running app drains at ENRICHMENT_QUEUE_RATE.
+
+Each batch commits together with a byte-offset checkpoint for its file, so an
+interrupted import resumes exactly where it stopped when run again
+(--restart ignores checkpoints). A trailing line without a newline is left
+for the next run, so files that are still being written can be imported
+repeatedly. Uses the same POSTGRES_* variables as the app.
+"""
+import argparse
+import gzip
+import json
+import logging
+import operator
+import os
+import sys
+import time
+
+import psycopg
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import db  # noqa: E402
+import events  # noqa: E402
+
+_COPY_SQL = f"COPY webhook_logs ({', '.join(events._EVENT_COLUMNS)}) FROM STDIN"
+
+_SEED_SOURCES_SQL = """
+    INSERT INTO source_details (src_host, first_seen, last_seen, times_seen)
+    SELECT * FROM unnest(%s::varchar[], %s::timestamp[], %s::timestamp[], %s::int[])
+    ON CONFLICT (src_host)
+    DO UPDATE SET
+        first_seen = LEAST(source_details.first_seen, EXCLUDED.first_seen),
+        last_seen = GREATEST(source_details.last_seen, EXCLUDED.last_seen),
+        times_seen = COALESCE(source_details.times_seen, 0) + EXCLUDED.times_seen
+    RETURNING src_host, (xmax = 0) AS inserted
+"""
+
+_ENQUEUE_SQL = """
+    INSERT INTO enrichment_queue (src_host)
+    SELECT unnest(%s::varchar[])
+    ON CONFLICT (src_host) DO NOTHING
+"""
+
+_CHECKPOINT_SQL = """
+    INSERT INTO import_checkpoints (path, byte_offset, events, updated_at)
+    VALUES (%s, %s, %s, now())
+    ON CONFLICT (path)
+    DO UPDATE SET byte_offset = EXCLUDED.byte_offset, events = EXCLUDED.events, updated_at = now()
+"""
+
+# Same rules as live ingest: INGEST_DENY_CIDRS sources are dropped, and only
+# public addresses get a source_details row. Built in main_cli, after .env.
+_ip_filter = events._BUILTIN_IP_FILTER
+
+
+# The webhook's field mapping (events._EVENT_SCHEMA, events._LOGDATA_SCHEMA),
+# flattened into positions in a webhook_logs row. Lines become row lists
+# directly, without an events._WebhookEvent per line.
+_KEYS = tuple(key for _, key, _ in events._EVENT_SCHEMA)
+_LOGDATA_KEYS = tuple(key for _, key in events._LOGDATA_SCHEMA)
+_INTS = tuple(i for i, (_, _, c) in enumerate(events._EVENT_SCHEMA) if c is events._coerce_int)
+_TIMESTAMPS = tuple(i for i, (_, _, c) in enumerate(events._EVENT_SCHEMA) if c is events._coerce_timestamp)
+_STRINGS = tuple(i for i, (_, _, c) in enumerate(events._EVENT_SCHEMA) if c is events._coerce_str) + tuple(
+    range(len(_KEYS), len(_KEYS) + len(_LOGDATA_KEYS))
+)
+_string_values = operator.itemgetter(*_STRINGS)
+_PLAIN_STRING_TYPES = {str, type(None)}
+_SRC_HOST = _KEYS.index("src_host")
+_UTC_TIME = _KEYS.index("utc_time")
+_raw_decode = json.JSONDecoder().raw_decode
+
+
+class _Batch:
+    __slots__ = ("rows", "sources")
+
+    def __init__(self):
+        self.rows = []
+        # src_host -> [first_seen, last_seen, count]
+        self.sources = {}
+
+    def add(self, row):
+        self.rows.append(row)
+        ip = row[_SRC_HOST]
+        if not ip or not _ip_filter.public(ip):
+            return
+        seen = row[_UTC_TIME]
+        source = self.sources.get(ip)
+        if source is None:
+            self.sources[ip] = [seen, seen, 1]
+            return
+        source[2] += 1
+        if seen is not None:
+            if source[0] is None or seen < source[0]:
+                source[0] = seen
+            if source[1] is None or seen > source[1]:
+                source[1] = seen
+
+
+def _parse_line(line):
+    """
+    The webhook's validation and ingest filter, applied to one log line.
+    Returns the webhook_logs row, or None if the line is rejected.
+    """
+    # raw_decode skips json.loads' encoding detection and whitespace regexes;
+    # anything after the object makes the line invalid, as with loads.
+    try:
+        text = line.decode().strip()
+        data, end = _raw_decode(text)
+    except ValueError:
+        return None
+    if end != len(text):
+        return None
+    if type(data) is not dict or data.get("src_host") == "":
+        return None
+    get = data.get
+    row = [get(key) for key in _KEYS]
+    logdata = get("logdata") or {}
+    if type(logdata) is not dict:
+        return None
+    get = logdata.get
+    row += [get(key) for key in _LOGDATA_KEYS]
+    try:
+        for i in _INTS:
+            if type(row[i]) is not int:
+                row[i] = events._coerce_int(row[i])
+        for i in _TIMESTAMPS:
+            row[i] = events._coerce_timestamp(row[i])
+    except events._InvalidEvent:
+        return None
+    # Nearly every line only has strings here; check them all at once.
+    if not _PLAIN_STRING_TYPES.issuperset(map(type, _string_values(row))):
+        for i in _STRINGS:
+            row[i] = events._coerce_str(row[i])
+    ip = row[_SRC_HOST]
+    if ip and not _ip_filter.accepts(ip):
+        return None
+    return row
+
+
+def _store(conn, path, batch, offset, total):
+    """Write one batch and its checkpoint in a single transaction."""
+    with conn.transaction():
+        with conn.cursor() as cur:
+            with cur.copy(_COPY_SQL) as copy:
+                for row in batch.rows:
+                    copy.write_row(row)
+            new_sources = []
+            if batch.sources:
+                hosts = list(batch.sources)
+                first, last, counts = zip(*batch.sources.values())
+                cur.execute(_SEED_SOURCES_SQL, (hosts, list(first), list(last), list(counts)))
+                new_sources = [host for host, inserted in cur.fetchall() if inserted]
+            if new_sources:
+                cur.execute(_ENQUEUE_SQL, (new_sources,))
+            cur.execute(_CHECKPOINT_SQL, (path, offset, total))
+    return len(new_sources)
+
+
+def _checkpoint(conn, path):
+    row = conn.execute(
+        "SELECT byte_offset, events FROM import_checkpoints WHERE path = %s", (path,)
+    ).fetchone()
+    return row if row else (0, 0)
+
+
+def import_file(conn, path, batch_size, restart=False):
+    path = os.path.realpath(path)
+    offset, total = (0, 0) if restart else _checkpoint(conn, path)
+    size = os.path.getsize(path)
+    raw = open(path, "rb")
+    reader = gzip.GzipFile(fileobj=raw) if path.endswith(".gz") else raw
+    rejected = new_sources = 0
+    start = time.perf_counter()
+    imported = 0
+    with raw, reader:
+        if offset:
+            reader.seek(offset)
+            print(f"{path}: resuming at byte {offset} ({total} events)", file=sys.stderr)
+        batch = _Batch()
+        for line in reader:
+            if not line.endswith(b"\n"):
+                break
+            offset += len(line)
+            row = _parse_line(line)
+            if row is None:
+                rejected += line.strip() != b""
+                continue
+            batch.add(row)
+            if len(batch.rows) >= batch_size:
+                total += len(batch.rows)
+                imported += len(batch.rows)
+                new_sources += _store(conn, path, batch, offset, total)
+                batch = _Batch()
+                elapsed = time.perf_counter() - start
+                print(
+                    f"\r{path}: {total} events, {imported / elapsed:,.0f}/s, "
+                    f"{raw.tell() * 100 / max(size, 1):.1f}%",
+                    end="",
+                    file=sys.stderr,
+                )
+        total += len(batch.rows)
+        imported += len(batch.rows)
+        new_sources += _store(conn, path, batch, offset, total)
+    elapsed = time.perf_counter() - start
+    print(
+        f"\r{path}: imported {imported} events in {elapsed:.1f}s "
+        f"({imported / max(elapsed, 1e-9):,.0f}/s), {rejected} rejected lines, "
+        f"{new_sources} new sources queued for enrichment",
+        file=sys.stderr,
+    )
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("files", nargs="+", help="OpenCanary log files (.gz allowed)")
+    parser.add_argument("--batch", type=int, default=50000, help="events per COPY/commit")
+    parser.add_argument("--restart", action="store_true", help="ignore saved checkpoints")
+    args = parser.parse_args(argv)
+    global _ip_filter
+    _ip_filter = events._build_ip_filter()
+    with psycopg.connect(db._dsn(), autocommit=True) as conn:
+        for path in args.files:
+            import_file(conn, path, args.batch, args.restart)
+    return 0
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main_cli())
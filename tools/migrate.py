@@ -0,0 +1,58 @@
+"""
+Apply pending schema migrations from infra/migrations with the same runner
+(db.py) the app uses at startup (MIGRATE_ON_STARTUP), for deployments that
+prefer to migrate explicitly before rolling out:
+
+    uv run python tools/migrate.py [--list]
+
+Applied versions are recorded in schema_migrations. Migrations marked
+"-- migrate: manual" (long backfills) are only applied here, never at startup.
+Uses the same POSTGRES_* variables as the app.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+
+import psycopg
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import db  # noqa: E402
+
+
+async def run(list_only):
+    migrations = db._load_migrations()
+    async with await psycopg.AsyncConnection.connect(db._dsn(), autocommit=True) as conn:
+        if list_only:
+            try:
+                cur = await conn.execute("SELECT version, applied_at FROM schema_migrations")
+                applied = dict(await cur.fetchall())
+            except psycopg.errors.UndefinedTable:
+                applied = {}
+            for m in migrations:
+                state = applied[m.version].isoformat() if m.version in applied else "pending"
+                if m.manual and m.version not in applied:
+                    state += " (manual)"
+                print(f"{m.version:04d}_{m.name:<40} {state}")
+            return 0
+        applied = await db._migrate(conn, migrations, manual=True)
+    if applied is None:
+        print("Another process holds the migration lock; try again later", file=sys.stderr)
+        return 1
+    print(f"Applied {len(applied)} migration(s)", file=sys.stderr)
+    return 0
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--list", action="store_true", help="show migrations and whether they are applied")
+    args = parser.parse_args(argv)
+    return asyncio.run(run(args.list))
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main_cli())